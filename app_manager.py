@@ -5,6 +5,7 @@ Starting point for managing/running the app
 __author__ = 'Ritaja'
 
 import os
+from typing import List
 
 from distutils.util import strtobool
 from dotenv import load_dotenv
@@ -18,8 +19,38 @@ class AppManager(object):
         self.logger = TRLogger.instance().get_logger(__name__)
         self._goog_api_key()
         self._kafka_config()
+        self._scrape_config()
         self.news_aggregator = NewsAggregator(goog_api_key=self.goog_api_key, kafka_broker=self.kafka_broker,
-                                              kafka_schema=self.kafka_schema, avro_namespace=self.avro_namespace)
+                                              kafka_schema=self.kafka_schema, avro_namespace=self.avro_namespace,
+                                              scrape_workers=self.scrape_workers,
+                                              scrape_max_per_host=self.scrape_max_per_host,
+                                              news_download_workers=self.news_download_workers,
+                                              news_parse_workers=self.news_parse_workers,
+                                              max_concurrent_sources=self.max_concurrent_sources,
+                                              source_stats_path=self.source_stats_path,
+                                              seen_url_index_path=self.seen_url_index_path,
+                                              seen_url_ttl_days=self.seen_url_ttl_days,
+                                              kafka_linger_ms=self.kafka_linger_ms,
+                                              kafka_batch_size=self.kafka_batch_size,
+                                              kafka_compression=self.kafka_compression,
+                                              extraction_cache_entries=self.extraction_cache_entries,
+                                              extraction_cache_path=self.extraction_cache_path,
+                                              near_duplicate_mode=self.near_duplicate_mode,
+                                              near_duplicate_window_hours=self.near_duplicate_window_hours,
+                                              near_duplicate_threshold=self.near_duplicate_threshold,
+                                              goog_max_results_per_query=self.goog_max_results_per_query,
+                                              goog_max_calls=self.goog_max_calls,
+                                              goog_query_workers=self.goog_query_workers,
+                                              newsapi_requests_per_day=self.newsapi_requests_per_day,
+                                              newsapi_cache_path=self.newsapi_cache_path,
+                                              newsapi_cache_ttl_secs=self.newsapi_cache_ttl_secs,
+                                              http_pool_maxsize=self.http_pool_maxsize,
+                                              http_connect_timeout_secs=self.http_connect_timeout_secs,
+                                              http_read_timeout_secs=self.http_read_timeout_secs,
+                                              http_max_response_bytes=int(self.http_max_response_mb * 1024 * 1024),
+                                              http_dns_ttl_secs=self.http_dns_ttl_secs,
+                                              http_cache_path=self.http_cache_path,
+                                              http_cache_ttl_days=self.http_cache_ttl_days)
 
     def _goog_api_key(self):
         """
@@ -52,43 +83,153 @@ class AppManager(object):
         self.kafka_schema = os.getenv("KAFKA_SCHEMA")
         self.avro_namespace = os.getenv("AVRO_NAMESPACE")
         self.kafka_topic = os.getenv("KAFKA_NEWS_RAW_TOPIC")
+        # batching of the producer, optional
+        self.kafka_linger_ms = int(os.getenv("KAFKA_LINGER_MS", 50))
+        self.kafka_batch_size = int(os.getenv("KAFKA_BATCH_SIZE", 10000))
+        self.kafka_compression = os.getenv("KAFKA_COMPRESSION", "lz4")
         self.logger.info(
             "kafka client configured with KAFKA_BROKER: {}, KAFKA_SCHEMA: {}, AVRO_NAMESPACE: {}, "
-            "KAFKA_NEWS_RAW_TOPIC: {}".format(
-                self.kafka_broker, self.kafka_schema, self.avro_namespace, self.kafka_topic))
+            "KAFKA_NEWS_RAW_TOPIC: {}, KAFKA_LINGER_MS: {}, KAFKA_BATCH_SIZE: {}, KAFKA_COMPRESSION: {}".format(
+                self.kafka_broker, self.kafka_schema, self.avro_namespace, self.kafka_topic, self.kafka_linger_ms,
+                self.kafka_batch_size, self.kafka_compression))
 
-    def gather_news(self, news_topic: str, scrape_month: bool = False):
+    def _scrape_config(self):
+        """
+        configuration helper, concurrency of the scrapers (defaults to a serial scrape)
+        Returns:
+
+        """
+        self.scrape_workers = int(os.getenv("SCRAPE_WORKERS", 1))
+        self.scrape_max_per_host = int(os.getenv("SCRAPE_MAX_PER_HOST", 2))
+        self.news_download_workers = int(os.getenv("NEWS_DOWNLOAD_WORKERS", 1))
+        self.news_parse_workers = int(os.getenv("NEWS_PARSE_WORKERS", 0))
+        self.max_concurrent_sources = int(os.getenv("MAX_CONCURRENT_SOURCES", 1))
+        self.source_stats_path = os.getenv("SOURCE_STATS_PATH")
+        self.seen_url_index_path = os.getenv("SEEN_URL_INDEX_PATH")
+        self.seen_url_ttl_days = float(os.getenv("SEEN_URL_TTL_DAYS", 30))
+        # extraction results kept in memory per process, and/or in a sqlite file shared by the extraction processes
+        # (the cache is off without either)
+        self.extraction_cache_entries = int(os.getenv("EXTRACTION_CACHE_ENTRIES", 0))
+        self.extraction_cache_path = os.getenv("EXTRACTION_CACHE_PATH")
+        # near-duplicate articles are suppressed, clustered (published with a header) or published as they are (off)
+        self.near_duplicate_mode = os.getenv("NEAR_DUPLICATE_MODE", "off")
+        self.near_duplicate_window_hours = float(os.getenv("NEAR_DUPLICATE_WINDOW_HOURS", 24))
+        self.near_duplicate_threshold = float(os.getenv("NEAR_DUPLICATE_THRESHOLD", 0.6))
+        # results of a newsapi query over all pages (100 on the free plan), api calls per topic and calls in flight
+        self.goog_max_results_per_query = int(os.getenv("GOOG_NEWS_MAX_RESULTS", 100))
+        self.goog_max_calls = int(os.getenv("GOOG_NEWS_MAX_CALLS", 50))
+        self.goog_query_workers = int(os.getenv("GOOG_NEWS_QUERY_WORKERS", 4))
+        # quota of the newsapi plan and the response cache (in memory without a path)
+        self.newsapi_requests_per_day = float(os.getenv("NEWSAPI_REQUESTS_PER_DAY", 100))
+        self.newsapi_cache_path = os.getenv("NEWSAPI_CACHE_PATH")
+        self.newsapi_cache_ttl_secs = float(os.getenv("NEWSAPI_CACHE_TTL_SECS", 3600))
+        # the http session shared by all downloads: keep-alive connections per host, timeouts, the max size of a
+        # response and the time a resolved address is reused
+        self.http_pool_maxsize = int(os.getenv("HTTP_POOL_MAXSIZE", 10))
+        self.http_connect_timeout_secs = float(os.getenv("HTTP_CONNECT_TIMEOUT_SECS", 5))
+        self.http_read_timeout_secs = float(os.getenv("HTTP_READ_TIMEOUT_SECS", 30))
+        self.http_max_response_mb = float(os.getenv("HTTP_MAX_RESPONSE_MB", 10))
+        self.http_dns_ttl_secs = float(os.getenv("HTTP_DNS_TTL_SECS", 300))
+        # sqlite file of the validators of the downloaded articles, unchanged articles are not parsed or published
+        self.http_cache_path = os.getenv("HTTP_CACHE_PATH")
+        self.http_cache_ttl_days = float(os.getenv("HTTP_CACHE_TTL_DAYS", 30))
+        self.logger.info("scrapers configured with SCRAPE_WORKERS: {}, SCRAPE_MAX_PER_HOST: {}, "
+                         "NEWS_DOWNLOAD_WORKERS: {}, NEWS_PARSE_WORKERS: {}, MAX_CONCURRENT_SOURCES: {}, "
+                         "SOURCE_STATS_PATH: {}, SEEN_URL_INDEX_PATH: {}, SEEN_URL_TTL_DAYS: {}, "
+                         "EXTRACTION_CACHE_ENTRIES: {}, EXTRACTION_CACHE_PATH: {}, NEAR_DUPLICATE_MODE: {}, "
+                         "NEAR_DUPLICATE_WINDOW_HOURS: {}, NEAR_DUPLICATE_THRESHOLD: {}, GOOG_NEWS_MAX_RESULTS: {}, "
+                         "GOOG_NEWS_MAX_CALLS: {}, GOOG_NEWS_QUERY_WORKERS: {}, NEWSAPI_REQUESTS_PER_DAY: {}, "
+                         "NEWSAPI_CACHE_PATH: {}, NEWSAPI_CACHE_TTL_SECS: {}, HTTP_POOL_MAXSIZE: {}, "
+                         "HTTP_CONNECT_TIMEOUT_SECS: {}, HTTP_READ_TIMEOUT_SECS: {}, HTTP_MAX_RESPONSE_MB: {}, "
+                         "HTTP_DNS_TTL_SECS: {}, HTTP_CACHE_PATH: {}, HTTP_CACHE_TTL_DAYS: {}".format(
+                             self.scrape_workers, self.scrape_max_per_host, self.news_download_workers,
+                             self.news_parse_workers, self.max_concurrent_sources, self.source_stats_path,
+                             self.seen_url_index_path, self.seen_url_ttl_days, self.extraction_cache_entries,
+                             self.extraction_cache_path, self.near_duplicate_mode, self.near_duplicate_window_hours,
+                             self.near_duplicate_threshold, self.goog_max_results_per_query, self.goog_max_calls,
+                             self.goog_query_workers, self.newsapi_requests_per_day, self.newsapi_cache_path,
+                             self.newsapi_cache_ttl_secs, self.http_pool_maxsize, self.http_connect_timeout_secs,
+                             self.http_read_timeout_secs, self.http_max_response_mb, self.http_dns_ttl_secs,
+                             self.http_cache_path, self.http_cache_ttl_days))
+
+    def gather_news(self, news_topics: List[str], scrape_month: bool = False):
         """
         scrapes and aggregates all news articles and publishes to kafka stream
         Args:
-            news_topic:
+            news_topics: queried together, every article is scraped once and tagged with the topics it matches (a
+                         single topic is published without the topics header, as before)
             scrape_month:
 
         Returns:
 
         """
         self.logger.info(
-            "Gathering news.. config: NEWS_TOPIC:{}, SCRAPE_MONTH:{}".format(news_topic, scrape_month))
-        self.news_aggregator.aggregate_google(news_topic=news_topic, kafka_topic=self.kafka_topic,
-                                              scrape_month=scrape_month)
+            "Gathering news.. config: NEWS_TOPICS:{}, SCRAPE_MONTH:{}".format(news_topics, scrape_month))
+        if len(news_topics) == 1:
+            self.news_aggregator.aggregate_google(news_topic=news_topics[0], kafka_topic=self.kafka_topic,
+                                                  scrape_month=scrape_month)
+        else:
+            self.news_aggregator.aggregate_google_topics(news_topics=news_topics, kafka_topic=self.kafka_topic,
+                                                         scrape_month=scrape_month)
         self.news_aggregator.aggregate_non_google(kafka_topic=self.kafka_topic)
 
-    def common_crawl_news(self, download_dir_article: str, download_dir_warc: str):
+    def common_crawl_news(self, download_dir_article: str, download_dir_warc: str, mode: str = "window",
+                          poll_interval_secs: float = 600, stream_warcs: bool = False, prefetch_warcs: int = 0,
+                          warc_disk_budget_bytes: int = None, split_warcs: bool = False,
+                          extraction_processes: int = 1, work_queue_path: str = None):
         self.news_aggregator.common_crawl_news(kafka_topic=self.kafka_topic, download_dir_article=download_dir_article,
-                                               download_dir_warc=download_dir_warc)
+                                               download_dir_warc=download_dir_warc, mode=mode,
+                                               poll_interval_secs=poll_interval_secs, stream_warcs=stream_warcs,
+                                               prefetch_warcs=prefetch_warcs,
+                                               warc_disk_budget_bytes=warc_disk_budget_bytes,
+                                               split_warcs=split_warcs, extraction_processes=extraction_processes,
+                                               work_queue_path=work_queue_path)
+
+    def close(self):
+        """
+        flushes everything still buffered for kafka
+        Returns:
+
+        """
+        self.news_aggregator.close()
 
 
 if __name__ == '__main__':
     load_dotenv()
     app_manager = AppManager()
-    news_topic = os.getenv("NEWS_TOPIC")
+    # a comma separated list of topics crawled in a batch, or a single NEWS_TOPIC
+    news_topics = [topic.strip() for topic in os.getenv("NEWS_TOPICS", os.getenv("NEWS_TOPIC", "")).split(",")
+                   if topic.strip()]
     download_dir_warc = os.getenv("WARC_DOWNLOAD_DIR")
     download_dir_article = os.getenv("ARTICLE_DOWNLOAD_DIR")
     scrape_month = strtobool(os.getenv("SCRAPE_MONTH"))
     common_crawl = strtobool(os.getenv("COMMON_CRAWL"))
+    # window (default), tail, follow or replay (of the article archive)
+    common_crawl_mode = os.getenv("COMMON_CRAWL_MODE", "window")
+    common_crawl_poll_secs = float(os.getenv("COMMON_CRAWL_POLL_SECS", 600))
+    common_crawl_stream = strtobool(os.getenv("COMMON_CRAWL_STREAM", "false"))
+    # WARCs downloaded ahead of the extraction (0: download and extract in turn) and their disk budget
+    common_crawl_prefetch = int(os.getenv("COMMON_CRAWL_PREFETCH_WARCS", 0))
+    common_crawl_disk_budget_mb = os.getenv("COMMON_CRAWL_WARC_DISK_BUDGET_MB")
+    # split the records of each WARC across the extraction processes
+    common_crawl_split_warcs = strtobool(os.getenv("COMMON_CRAWL_SPLIT_WARCS", "false"))
+    common_crawl_processes = int(os.getenv("COMMON_CRAWL_EXTRACTION_PROCESSES", 1))
+    # sqlite file on a volume shared by the crawler nodes, they split the WARC files between them
+    common_crawl_work_queue = os.getenv("COMMON_CRAWL_WORK_QUEUE")
     news_crawl = strtobool(os.getenv("NEWS_CRAWL"))
 
-    if news_crawl:
-        AppManager().gather_news(news_topic=news_topic, scrape_month=scrape_month)
-    if common_crawl:
-        app_manager.common_crawl_news(download_dir_warc=download_dir_warc, download_dir_article=download_dir_article)
+    try:
+        if news_crawl:
+            app_manager.gather_news(news_topics=news_topics, scrape_month=scrape_month)
+        if common_crawl:
+            app_manager.common_crawl_news(download_dir_warc=download_dir_warc,
+                                          download_dir_article=download_dir_article, mode=common_crawl_mode,
+                                          poll_interval_secs=common_crawl_poll_secs,
+                                          stream_warcs=common_crawl_stream, prefetch_warcs=common_crawl_prefetch,
+                                          warc_disk_budget_bytes=int(common_crawl_disk_budget_mb) * 1024 * 1024
+                                          if common_crawl_disk_budget_mb else None,
+                                          split_warcs=common_crawl_split_warcs,
+                                          extraction_processes=common_crawl_processes,
+                                          work_queue_path=common_crawl_work_queue)
+    finally:
+        app_manager.close()
@@ -0,0 +1,269 @@
+"""
+Lists the WARC files of the common crawl news crawl (CC-NEWS) natively (no awscli), with a local manifest cache
+"""
+import datetime
+import gzip
+import itertools
+import json
+import os
+import re
+import xml.etree.ElementTree as ElementTree
+from typing import Iterator, List, Optional, Set, Tuple
+
+import requests
+from kgai_py_commons.logging.log import TRLogger
+
+CC_NEWS_PREFIX = "crawl-data/CC-NEWS/"
+# e.g. crawl-data/CC-NEWS/2020/05/CC-NEWS-20200510123456-00123.warc.gz
+WARC_TIMESTAMP_PATTERN = re.compile(r"CC-NEWS-(\d{14})-\d+\.warc\.gz$")
+
+
+def month_prefix(year: int, month: int) -> str:
+    return "{}{}/{:02d}/".format(CC_NEWS_PREFIX, year, month)
+
+
+def warc_timestamp(name: str) -> Optional[datetime.datetime]:
+    """
+    the time a CC-NEWS WARC was written, parsed from its name
+    Args:
+        name:
+
+    Returns:
+
+    """
+    match = WARC_TIMESTAMP_PATTERN.search(name)
+    if not match:
+        return None
+    return datetime.datetime.strptime(match.group(1), "%Y%m%d%H%M%S")
+
+
+def iter_months(start_date: datetime.datetime, end_date: datetime.datetime) -> Iterator[Tuple[int, int]]:
+    """
+    yields (year, month) for every month touched by the date range, both ends included
+    Args:
+        start_date:
+        end_date:
+
+    Returns:
+
+    """
+    year, month = start_date.year, start_date.month
+    while (year, month) <= (end_date.year, end_date.month):
+        yield year, month
+        year, month = (year + 1, 1) if month == 12 else (year, month + 1)
+
+
+class S3ListingBackend(object):
+    """
+    Paginated S3 ListObjectsV2 over plain (unsigned) HTTP, what `aws s3 ls --no-sign-request` does
+    """
+
+    def __init__(self, base_url: str = "https://commoncrawl.s3.amazonaws.com/", timeout_secs: float = 60):
+        self.base_url = base_url
+        self.timeout_secs = timeout_secs
+
+    def list_month(self, year: int, month: int, start_after: Optional[str] = None) -> List[str]:
+        names = []
+        params = {"list-type": "2", "prefix": month_prefix(year, month)}
+        if start_after:
+            params["start-after"] = start_after
+        while True:
+            response = requests.get(self.base_url, params=params, timeout=self.timeout_secs)
+            response.raise_for_status()
+            root = ElementTree.fromstring(response.content)
+            # the listing is namespaced, match on the local tag names
+            namespace = root.tag[:root.tag.index("}") + 1] if root.tag.startswith("{") else ""
+            names.extend(key.text for key in root.iter(namespace + "Key") if key.text.endswith(".warc.gz"))
+            token = root.findtext(namespace + "NextContinuationToken")
+            if root.findtext(namespace + "IsTruncated") != "true" or not token:
+                return names
+            params["continuation-token"] = token
+
+
+class WarcPathsBackend(object):
+    """
+    Reads the monthly warc.paths.gz listing published next to the WARC files (works through any http mirror)
+    """
+
+    def __init__(self, base_url: str = "https://commoncrawl.s3.amazonaws.com/", timeout_secs: float = 60):
+        self.base_url = base_url
+        self.timeout_secs = timeout_secs
+
+    def list_month(self, year: int, month: int, start_after: Optional[str] = None) -> List[str]:
+        response = requests.get(self.base_url + month_prefix(year, month) + "warc.paths.gz", timeout=self.timeout_secs)
+        if response.status_code == 404:
+            return []
+        response.raise_for_status()
+        names = gzip.decompress(response.content).decode("utf-8").split()
+        return [name for name in names if not start_after or name > start_after]
+
+
+class LocalDirectoryBackend(object):
+    """
+    Lists a local mirror laid out like the bucket (root/crawl-data/CC-NEWS/YYYY/MM/*.warc.gz), for tests and
+    offline runs. Downloads work through file:// urls
+    """
+
+    def __init__(self, root: str):
+        self.root = os.path.abspath(root)
+        self.base_url = "file://" + self.root + "/"
+
+    def list_month(self, year: int, month: int, start_after: Optional[str] = None) -> List[str]:
+        prefix = month_prefix(year, month)
+        month_dir = os.path.join(self.root, prefix)
+        if not os.path.isdir(month_dir):
+            return []
+        names = [prefix + name for name in sorted(os.listdir(month_dir)) if name.endswith(".warc.gz")]
+        return [name for name in names if not start_after or name > start_after]
+
+
+class CCNewsIndex(object):
+    """
+    Lists CC-NEWS WARC names per month through a backend and keeps a json manifest per month: months that are
+    over (with a grace period for late WARCs) are listed once and for all, the running month is only extended
+    with the WARCs published after the last known one
+    """
+
+    def __init__(self, backend=None, manifest_dir: str = ".",
+                 grace_period: datetime.timedelta = datetime.timedelta(days=2)):
+        """
+        Args:
+            backend: S3ListingBackend (default), WarcPathsBackend or LocalDirectoryBackend
+            manifest_dir: where the per month manifests are kept
+            grace_period: how long after a month ended it is still re-listed
+        """
+        self.logger = TRLogger.instance().get_logger(__name__)
+        self.backend = backend or S3ListingBackend()
+        self.manifest_dir = manifest_dir
+        self.grace_period = grace_period
+        if not os.path.exists(manifest_dir):
+            os.makedirs(manifest_dir)
+
+    @property
+    def base_url(self) -> str:
+        return self.backend.base_url
+
+    def _manifest_path(self, year: int, month: int) -> str:
+        return os.path.join(self.manifest_dir, "cc-news-manifest-{}-{:02d}.json".format(year, month))
+
+    def _read_manifest(self, year: int, month: int) -> dict:
+        path = self._manifest_path(year, month)
+        if not os.path.isfile(path):
+            return {"complete": False, "names": []}
+        with open(path, encoding="utf-8") as manifest_file:
+            return json.load(manifest_file)
+
+    def _write_manifest(self, year: int, month: int, manifest: dict):
+        path = self._manifest_path(year, month)
+        with open(path + ".tmp", "w", encoding="utf-8") as manifest_file:
+            json.dump(manifest, manifest_file)
+        os.replace(path + ".tmp", path)
+
+    def _month_is_over(self, year: int, month: int, now: datetime.datetime) -> bool:
+        next_month = datetime.datetime(year + 1, 1, 1) if month == 12 else datetime.datetime(year, month + 1, 1)
+        return now >= next_month + self.grace_period
+
+    def list_month(self, year: int, month: int, now: datetime.datetime = None) -> List[str]:
+        """
+        WARC names of a month, from the manifest where possible
+        Args:
+            year:
+            month:
+            now:
+
+        Returns:
+
+        """
+        now = now or datetime.datetime.utcnow()
+        manifest = self._read_manifest(year, month)
+        if manifest["complete"]:
+            return manifest["names"]
+
+        known = manifest["names"]
+        start_after = known[-1] if known else None
+        new_names = self.backend.list_month(year, month, start_after=start_after)
+        self.logger.info("listed {} new WARC files for {}-{:02d} ({} known)".format(len(new_names), year, month,
+                                                                                  len(known)))
+        names = sorted(set(known).union(new_names))
+        self._write_manifest(year, month, {"complete": self._month_is_over(year, month, now), "names": names,
+                                           "listed_at": now.isoformat()})
+        return names
+
+    def get_names(self, start_date: datetime.datetime, end_date: datetime.datetime) -> List[str]:
+        """
+        WARC names of all months touched by the date range
+        Args:
+            start_date:
+            end_date:
+
+        Returns:
+
+        """
+        names = []
+        for year, month in iter_months(start_date, end_date):
+            names.extend(self.list_month(year, month))
+        return names
+
+
+class HighWaterMark(object):
+    """
+    Remembers the newest WARC processed so far (name and timestamp) in a small json file
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+
+    def read(self) -> Optional[str]:
+        """
+        Returns: name of the newest processed WARC, None if nothing was processed yet
+
+        """
+        if not os.path.isfile(self.path):
+            return None
+        with open(self.path, encoding="utf-8") as mark_file:
+            return json.load(mark_file).get("name")
+
+    def advance(self, names: List[str]):
+        """
+        moves the mark to the newest of the names (never backwards)
+        Args:
+            names:
+
+        Returns:
+
+        """
+        newest = max(names + [self.read() or ""])
+        if not newest:
+            return
+        timestamp = warc_timestamp(newest)
+        with open(self.path + ".tmp", "w", encoding="utf-8") as mark_file:
+            json.dump({"name": newest, "timestamp": timestamp.isoformat() if timestamp else None}, mark_file)
+        os.replace(self.path + ".tmp", self.path)
+
+    def advance_completed(self, names: List[str], completed_names: Set[str]) -> List[str]:
+        """
+        moves the mark past the names (oldest first) up to the first one that did not complete, so a failed WARC and
+        the ones after it are listed as new again by the next run
+        Args:
+            names: the names processed by the run
+            completed_names: the names that were extracted without error
+
+        Returns: the names not completed, oldest first
+
+        """
+        names = sorted(names)
+        completed_prefix = list(itertools.takewhile(lambda name: name in completed_names, names))
+        self.advance(completed_prefix)
+        return [name for name in names if name not in completed_names]
+
+    def newer_names(self, names: List[str]) -> List[str]:
+        """
+        the names published after the mark, oldest first
+        Args:
+            names:
+
+        Returns:
+
+        """
+        mark = self.read()
+        return sorted(name for name in names if mark is None or name > mark)
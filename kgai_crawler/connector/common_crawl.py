@@ -2,14 +2,15 @@
 """
 This service downloads WARC files from commoncrawl.org's news crawl and extracts articles from these files. You can
 define filter criteria that need to be met (see YOUR CONFIG section), otherwise an article is discarded. Currently, the
-script stores the extracted articles in JSON files, but this behaviour can be adapted to your needs in the method
-on_valid_article_extracted. To speed up the crawling and extraction process, the script supports multiprocessing. You can
-control the number of processes with the parameter my_number_of_extraction_processes.
+script appends the extracted articles to an ArticleArchive (rolling, compressed JSONL segments with an index by
+article hash, see replay_archive) and publishes them to kafka, this behaviour can be adapted in the method
+_store_and_publish. To speed up the crawling and extraction process, the script supports multiprocessing. You can
+control the number of processes with the parameter number_of_extraction_processes, the workers hand the extracted
+articles to a single ArticleSink in the parent process, which owns the kafka producer.
 You can also crawl and extract articles programmatically, i.e., from within your own code, by using the class
 CommonCrawlCrawler provided in newsplease.crawler.commoncrawl_crawler.py
-In case the script crashes and contains a log message in the beginning that states that only 1 file on AWS storage
-was found, make sure that awscli was correctly installed. You can check that by running aws --version from a terminal.
-If aws is not installed, you can (on Ubuntu) also install it using sudo apt-get install awscli.
+The WARC files are listed natively through a CCNewsIndex (no awscli needed), the listing is cached in per month
+manifests in the WARC download directory.
 This script uses relative imports to ensure that the latest, local version of news-please is used, instead of the one
 that might have been installed with pip. Hence, you must run this script following this workflow.
 
@@ -17,24 +18,33 @@ Adapted from: https://github.com/fhamborg/news-please.git
 
 """
 import datetime
-import hashlib
-import json
 import logging
 import os
 import sys
+import time
 
-from kgai_py_commons.clients.kafka.producer.producer import TRAvroProducer
 from kgai_py_commons.logging.log import TRLogger
 from kgai_py_commons.model.googlenews.news_article import NewsArticle
 from kgai_py_commons.model.googlenews.source_article import SourceArticle
 
-from kgai_crawler.scripts import commoncrawl_crawler
+from kgai_crawler.connector.cc_news_index import CCNewsIndex, HighWaterMark, warc_timestamp
+from kgai_crawler.scripts import commoncrawl_crawler, crawl_metrics
+from kgai_crawler.scripts.warc_work_queue import WarcWorkQueue
+from kgai_crawler.service.article_archive import ArticleArchive, ArticleArchiveReader
+from kgai_crawler.service.article_sink import ArticleSink
+from kgai_crawler.service.extraction_cache import ExtractionCache
+from kgai_crawler.service.kafka_publisher import KafkaPublisher
+from kgai_crawler.service.near_duplicates import NearDuplicateIndex
 from kgai_crawler.utils.common_utils import hash_article
 
 
 class CommonCrawl(object):
-    def __init__(self, download_dir_article: str, download_dir_warc: str, kafka_producer: TRAvroProducer,
-                 kafka_topic: str, filter_start_date: datetime = None, filter_end_date: datetime = None):
+    def __init__(self, download_dir_article: str, download_dir_warc: str, kafka_publisher: KafkaPublisher,
+                 kafka_topic: str, filter_start_date: datetime = None, filter_end_date: datetime = None,
+                 cc_news_index: CCNewsIndex = None, stream_warcs: bool = False, prefetch_warcs: int = 0,
+                 warc_disk_budget_bytes: int = None, split_warcs: bool = False,
+                 number_of_extraction_processes: int = 1, work_queue_path: str = None,
+                 extraction_cache: ExtractionCache = None, near_duplicates: NearDuplicateIndex = None):
         """
         Configures the class to prep for downloading from common crawl
         explanations for arguments below
@@ -44,6 +54,19 @@ class CommonCrawl(object):
             download_dir_warc:
             filter_start_date:
             filter_end_date:
+            cc_news_index: lists the WARC files, defaults to S3 listing with manifests in download_dir_warc
+            stream_warcs: extract the WARCs while streaming them instead of downloading them first
+            prefetch_warcs: number of WARCs downloaded ahead of the extraction, 0 downloads and extracts in turn
+            warc_disk_budget_bytes: max bytes of prefetched WARCs on disk, None is unbounded
+            split_warcs: extract the records of each WARC in parallel across the extraction processes
+            number_of_extraction_processes: with more than one, the extracted articles are sent to this process
+                                            through an ArticleSink, which stores and publishes them
+            work_queue_path: sqlite file of a WarcWorkQueue on a volume shared by several crawler nodes, which then
+                             split the WARC files between them
+            extraction_cache: records whose html was extracted before are not extracted again (streamed and
+                              prefetched WARCs)
+            near_duplicates: suppresses or clusters the near-duplicate articles before they are published (they are
+                             archived all the same)
         """
         self.dir_warc = download_dir_warc
         if not os.path.exists(download_dir_article):
@@ -62,6 +85,8 @@ class CommonCrawl(object):
                 days=15)  # datetime.datetime(2016, 1, 1)
         else:
             self.filter_start_date = filter_start_date
+        # the resume checkpoints belong to the dates configured, not to the default window moving with the run date
+        self.checkpoint_dates = (filter_start_date, filter_end_date)
         # if date filtering is strict and news-please could not detect
         # the date of an article, the article will be discarded
         self.filter_strict_date = True
@@ -76,71 +101,117 @@ class CommonCrawl(object):
         self.show_download_progress = False
         # log_level
         self.log_level = logging.INFO
-        # json export style
-        self.json_export_style = 1  # 0 (minimize), 1 (pretty)
+        # the extracted articles are appended to rolling segment files in the article dir
+        self.article_archive = ArticleArchive(download_dir_article)
         # number of extraction processes
-        self.number_of_extraction_processes = 1
+        self.number_of_extraction_processes = number_of_extraction_processes
+        # if True, the WARC files are extracted while they are streamed, nothing is downloaded to disk
+        self.stream_warcs = stream_warcs
+        # number of WARC files downloaded in the background while others are extracted, and their disk budget
+        self.prefetch_warcs = prefetch_warcs
+        self.warc_disk_budget_bytes = warc_disk_budget_bytes
+        # if True, the records of a single WARC file are split across the extraction processes
+        self.split_warcs = split_warcs
         # if True, the WARC file will be deleted after all articles have been extracted from it
         self.delete_warc_after_extraction = True
         # if True, will continue extraction from the latest fully
         # downloaded but not fully extracted WARC files and then
-        # crawling new WARC files. This assumes that the filter
-        # criteria have not been changed since the previous run!
+        # crawling new WARC files. Only progress made with the same
+        # filter criteria is continued
         self.continue_process = True
-        # the kafka producer client (configured) to publish each article to
-        self.kafka_producer = kafka_producer
+        # records extracted between two resume checkpoints within a WARC file (streamed or prefetched WARCs resume
+        # mid-file, the checkpoints only count for the same filter criteria)
+        self.checkpoint_interval_records = 1000
+        # the streamed and prefetched WARCs are extracted by an lxml fast path, records it is less confident about are
+        # extracted by news-please (None extracts every record with news-please)
+        self.fast_extraction_confidence = 0.7
+        self.extraction_cache = extraction_cache
+        self.near_duplicates = near_duplicates
+        # the kafka publisher (configured) to publish each article to
+        self.kafka_publisher = kafka_publisher
         # the topic to pulish to
         self.kafka_topic = kafka_topic
+        # lists (and caches the listing of) the WARC files
+        self.cc_news_index = cc_news_index or CCNewsIndex(manifest_dir=download_dir_warc)
+        # shares the WARC files with the other crawler nodes
+        self.work_queue = WarcWorkQueue(work_queue_path) if work_queue_path else None
+        # newest WARC processed in tail mode
+        self.high_water_mark = HighWaterMark(path=os.path.join(download_dir_warc, "cc-news-highwatermark.json"))
         self.logger = TRLogger.instance().get_logger(__name__)
         # log essential config
         self.logger.info(
             "Common Crawl configured with start_date: {}, end_date: {}, warc_dir: {}, article_dir: {}".format(
                 self.filter_start_date, self.filter_end_date, self.dir_warc, self.dir_article))
 
-    def __get_pretty_filepath(self, path, article):
+    def _on_valid_article_extracted(self, article):
         """
-        Pretty might be an euphemism, but this function tries to avoid too long filenames, while keeping some structure.
-        :param path:
-        :param name:
+        This function will be invoked for each article that was extracted successfully from the archived data and that
+        satisfies the filter criteria (single process extraction, multiple processes go through the ArticleSink).
+        :param article:
         :return:
         """
-        short_filename = hashlib.sha256(article.filename.encode()).hexdigest()
-        sub_dir = article.source_domain
-        final_path = os.path.join(path, sub_dir)
-        if not os.path.exists(final_path):
-            os.makedirs(final_path)
-        return os.path.join(final_path, short_filename + '.json')
+        self._store_and_publish(article.__dict__)
 
-    def _on_valid_article_extracted(self, article):
+    @staticmethod
+    def _to_news_article(article_dict) -> NewsArticle:
         """
-        This function will be invoked for each article that was extracted successfully from the archived data and that
-        satisfies the filter criteria.
-        :param article:
+        maps the attributes of a news-please article to the published model
+        :param article_dict:
         :return:
         """
-        # do whatever you need to do with the article (e.g., save it to disk, store it in ElasticSearch, etc.)
-        with open(self.__get_pretty_filepath(self.dir_article, article), 'w', encoding='utf-8') as outfile:
-            if self.json_export_style == 0:
-                json.dump(article.__dict__, outfile, default=str, separators=(',', ':'), ensure_ascii=False)
-            elif self.json_export_style == 1:
-                json.dump(article.__dict__, outfile, default=str, indent=4, sort_keys=True, ensure_ascii=False)
-
-        # Push to Kafka
-        article_dict = article.__dict__
-        news_article = NewsArticle(title=article_dict.get("title"), publishedAt=str(article_dict.get("date_publish")),
-                                   url=article_dict.get("url"),
-                                   urlToImage="", description=article_dict.get("description"),
-                                   content="",
-                                   author=str(article_dict.get("authors")), articleText=article_dict.get("maintext"),
-                                   source=SourceArticle(name=article_dict.get("source_domain"), id="",
-                                                        description="", url=article_dict.get("url"),
-                                                        category="", language=article_dict.get("language"),
-                                                        country=""))
-        # publish to kafka
-        self.kafka_producer.produce(topic=self.kafka_topic, key=hash_article(news_article),
-                                    value=news_article)
+        return NewsArticle(title=article_dict.get("title"), publishedAt=str(article_dict.get("date_publish")),
+                           url=article_dict.get("url"),
+                           urlToImage="", description=article_dict.get("description"),
+                           content="",
+                           author=str(article_dict.get("authors")), articleText=article_dict.get("maintext"),
+                           source=SourceArticle(name=article_dict.get("source_domain"), id="",
+                                                description="", url=article_dict.get("url"),
+                                                category="", language=article_dict.get("language"),
+                                                country=""))
+
+    def _publish(self, key, news_article):
+        publish, headers = self.near_duplicates.review(key, news_article.articleText) \
+            if self.near_duplicates else (True, None)
+        if not publish:
+            crawl_metrics.inc("article_near_duplicate")
+            return
+        with crawl_metrics.timed("publish"):
+            self.kafka_publisher.publish(topic=self.kafka_topic, key=key, value=news_article, headers=headers)
+        crawl_metrics.inc("article_published")
         self.logger.debug("Pushed article to kafka from common crawl")
 
+    def _store_and_publish(self, article_dict):
+        """
+        Archives an extracted article and publishes it to kafka, runs in the process owning the kafka producer
+        :param article_dict: the attributes of the article
+        :return:
+        """
+        news_article = self._to_news_article(article_dict)
+        key = hash_article(news_article)
+        # do whatever you need to do with the article (e.g., save it to disk, store it in ElasticSearch, etc.)
+        self.article_archive.append(key, article_dict)
+        self._publish(key, news_article)
+
+    def replay_archive(self) -> int:
+        """
+        Publishes all the articles of the archive in download_dir_article to kafka again, nothing is downloaded
+        Returns: number of replayed articles
+
+        """
+        self.article_archive.flush()
+        replayed = ArticleArchiveReader(self.dir_article).replay(
+            lambda key, article_dict: self._publish(key, self._to_news_article(article_dict)))
+        self.logger.info("Replayed {} archived articles to kafka".format(replayed))
+        return replayed
+
+    def close(self):
+        """
+        writes the articles still buffered for the archive
+        Returns:
+
+        """
+        self.article_archive.close()
+
     def _callback_on_warc_completed(self, warc_path, counter_article_passed, counter_article_discarded,
                                     counter_article_error, counter_article_total, counter_warc_processed):
         """
@@ -180,17 +251,97 @@ class CommonCrawl(object):
         self.logger.info("delete_warc_after_extraction: {}".format(str(self.delete_warc_after_extraction)))
         self.logger.info("number_of_extraction_processes: {}".format(str(self.number_of_extraction_processes)))
 
-        commoncrawl_crawler.crawl_from_commoncrawl(self._on_valid_article_extracted,
-                                                   callback_on_warc_completed=self._callback_on_warc_completed,
-                                                   valid_hosts=self.filter_valid_hosts,
-                                                   start_date=self.filter_start_date,
-                                                   end_date=self.filter_end_date,
-                                                   strict_date=self.filter_strict_date,
-                                                   reuse_previously_downloaded_files=self.reuse_previously_downloaded_files,
-                                                   local_download_dir_warc=self.dir_warc,
-                                                   continue_after_error=self.continue_after_error,
-                                                   show_download_progress=self.show_download_progress,
-                                                   number_of_extraction_processes=self.number_of_extraction_processes,
-                                                   log_level=self.log_level,
-                                                   delete_warc_after_extraction=self.delete_warc_after_extraction,
-                                                   continue_process=True)
+        self._crawl(start_date=self.filter_start_date, end_date=self.filter_end_date)
+
+    def tail_news(self) -> int:
+        """
+        Processes only the WARC files published after the newest one processed in a previous tail run (the high water
+        mark), articles are not filtered by date. The first run starts from the configured start date. The mark only
+        advances up to the first WARC that failed, so it is processed again by the next run
+        Returns: number of new WARC files processed without error
+
+        """
+        mark = self.high_water_mark.read()
+        now = datetime.datetime.utcnow()
+        list_from = warc_timestamp(mark) if mark else self.filter_start_date
+        new_names = self.high_water_mark.newer_names(self.cc_news_index.get_names(list_from or now, now))
+        self.logger.info("Tail mode: {} new WARC files after {}".format(len(new_names), mark))
+        if not new_names:
+            return 0
+
+        completed_names = self._crawl(start_date=None, end_date=None, warc_names=new_names)
+        failed_names = self.high_water_mark.advance_completed(new_names, set(completed_names))
+        if failed_names:
+            self.logger.error("Tail mode: {} WARC files failed, retrying them next run from {}".format(
+                len(failed_names), failed_names[0]))
+        return len(new_names) - len(failed_names)
+
+    def follow_news(self, poll_interval_secs: float = 600, max_polls: int = None):
+        """
+        Long lived follower: runs the tail mode every poll interval, so new WARCs reach kafka within minutes
+        Args:
+            poll_interval_secs:
+            max_polls: stop after this many polls, None follows forever
+
+        Returns:
+
+        """
+        polls = 0
+        while max_polls is None or polls < max_polls:
+            started = time.time()
+            try:
+                self.tail_news()
+            except Exception as err:
+                self.logger.error("Error while following common crawl news, retrying next poll: {}".format(err))
+            polls += 1
+            if max_polls is None or polls < max_polls:
+                time.sleep(max(0.0, poll_interval_secs - (time.time() - started)))
+
+    def _crawl(self, start_date: datetime = None, end_date: datetime = None, warc_names=None):
+        """
+        runs the crawler with the configured filters
+        Args:
+            start_date: article date filter (None: no lower bound)
+            end_date: article date filter (None: no upper bound)
+            warc_names: the WARC files to process, None processes all files of the date range
+
+        Returns: the names of the WARC files fully extracted
+
+        """
+        try:
+            if self.number_of_extraction_processes > 1:
+                # the workers only extract, the kafka producer and the article archive stay in this process
+                with ArticleSink(self._store_and_publish) as article_writer:
+                    return self.__crawl_with(article_writer, start_date, end_date, warc_names)
+            else:
+                return self.__crawl_with(self._on_valid_article_extracted, start_date, end_date, warc_names)
+        finally:
+            self.article_archive.flush()
+
+    def __crawl_with(self, callback_on_article_extracted, start_date, end_date, warc_names):
+        return commoncrawl_crawler.crawl_from_commoncrawl(
+            callback_on_article_extracted,
+            callback_on_warc_completed=self._callback_on_warc_completed,
+            valid_hosts=self.filter_valid_hosts,
+            start_date=start_date,
+            end_date=end_date,
+            strict_date=self.filter_strict_date,
+            reuse_previously_downloaded_files=self.reuse_previously_downloaded_files,
+            local_download_dir_warc=self.dir_warc,
+            continue_after_error=self.continue_after_error,
+            show_download_progress=self.show_download_progress,
+            number_of_extraction_processes=self.number_of_extraction_processes,
+            log_level=self.log_level,
+            delete_warc_after_extraction=self.delete_warc_after_extraction,
+            continue_process=self.continue_process,
+            cc_news_index=self.cc_news_index,
+            warc_names=warc_names,
+            stream_warcs=self.stream_warcs,
+            prefetch_warcs=self.prefetch_warcs,
+            warc_disk_budget_bytes=self.warc_disk_budget_bytes,
+            split_warcs=self.split_warcs,
+            checkpoint_interval_records=self.checkpoint_interval_records,
+            checkpoint_dates=self.checkpoint_dates,
+            work_queue=self.work_queue,
+            fast_extraction_confidence=self.fast_extraction_confidence,
+            extraction_cache=self.extraction_cache)
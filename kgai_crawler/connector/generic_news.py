@@ -1,18 +1,38 @@
 """
 Gathers generic news from the internet
 """
-from typing import List
+from typing import Iterator, List
 
 import newspaper
 from kgai_py_commons.logging.log import TRLogger
 from kgai_py_commons.model.googlenews.news_article import NewsArticle
 from kgai_py_commons.model.googlenews.source_article import SourceArticle
-from newspaper import Article
+
+from kgai_crawler.service.article_engine import ArticleEngine, ParsedArticle
+from kgai_crawler.service.extraction_cache import ExtractionCache
+from kgai_crawler.service.http_transport import HttpTransport
+from kgai_crawler.service.url_index import SeenUrlIndex
 
 
 class GenericNews(object):
-    def __init__(self):
+    def __init__(self, download_workers: int = 1, parse_workers: int = 0, max_per_host: int = 2,
+                 url_index: SeenUrlIndex = None, extraction_cache: ExtractionCache = None,
+                 transport: HttpTransport = None):
+        """
+        Args:
+            download_workers: number of threads downloading the articles of a source
+            parse_workers: number of processes parsing the articles of a source, 0 parses in the download threads
+            max_per_host: max concurrent downloads against a single domain
+            url_index: articles with an already published url are not downloaded
+            extraction_cache: already extracted html is not parsed again
+            transport: the pooled http session the articles are downloaded with (newspaper still discovers the
+                       articles of a source with its own requests)
+        """
         self.logger = TRLogger.instance().get_logger(__name__)
+        self.url_index = url_index
+        self.article_engine = ArticleEngine(download_workers=download_workers, parse_workers=parse_workers,
+                                            max_per_host=max_per_host, extraction_cache=extraction_cache,
+                                            transport=transport)
 
     def get_news(self, source: SourceArticle) -> List[NewsArticle]:
         """
@@ -23,26 +43,39 @@ class GenericNews(object):
         Returns:
 
         """
-        all_articles = []
+        return list(self.iter_news(source))
+
+    def iter_news(self, source: SourceArticle) -> Iterator[NewsArticle]:
+        """
+        streaming version of get_news, yields each article of the source as soon as it is scraped
+        Args:
+            source:
+
+        Returns:
+
+        """
         news = newspaper.build(source.url)
 
         # for each source get articles published in source
         self.logger.info("Found {} articles in {}".format(len(news.articles), source.url))
-        for article in news.articles:
-            try:
 
-                article.download()
-                article.parse()
-                all_articles.append(
-                    self._map_articles(article=article, source_name=source.name, source_url=source.url))
+        urls = (article.url for article in news.articles)
+        if self.url_index:
+            urls = (url for url in urls if not self.url_index.is_seen(url))
 
-            except Exception as err:
-                self.logger.error("Error while gathering article from: {}, error: {}".format(article.url, err))
+        for article in self.article_engine.scrape(urls):
+            yield self._map_articles(article=article, source_name=source.name, source_url=source.url)
 
-        return all_articles
+    def close(self):
+        """
+        shuts down the download threads and parse processes of the article engine
+        Returns:
+
+        """
+        self.article_engine.close()
 
     @staticmethod
-    def _map_articles(article: Article, source_name: str, source_url: str) -> NewsArticle:
+    def _map_articles(article: ParsedArticle, source_name: str, source_url: str) -> NewsArticle:
         """
         INternal helper to map from scraped articles to Dataclass representations
         Args:
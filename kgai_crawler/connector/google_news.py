@@ -1,9 +1,12 @@
 """
 Connector to Google news API
 """
+import re
+from collections import OrderedDict
 from datetime import datetime, timedelta
+from functools import partial
 from http.client import HTTPException
-from typing import List
+from typing import Iterator, List, Tuple
 
 from dacite import from_dict
 from kgai_py_commons.logging.log import TRLogger
@@ -11,6 +14,19 @@ from kgai_py_commons.model.googlenews.news_article import NewsArticle
 from kgai_py_commons.model.googlenews.source_article import SourceArticle
 from newsapi import NewsApiClient
 from newsapi.newsapi_exception import NewsAPIException
+from requests import RequestException
+
+from kgai_crawler.connector.news_api_client import QuotaSession
+from kgai_crawler.service.url_index import SeenUrlIndex
+from kgai_crawler.service.window_planner import WindowPlanner, floor_to
+
+# max page size of newsapi
+PAGE_SIZE = 100
+# newsapi takes utc times to the second
+DATE_FORMAT = "%Y-%m-%dT%H:%M:%S"
+# max length of a newsapi query
+MAX_QUERY_CHARS = 500
+WORD_PATTERN = re.compile(r"\w+")
 
 
 class GoogNews(object):
@@ -18,65 +34,189 @@ class GoogNews(object):
     Interacts with Google news API
     """
 
-    def __init__(self, api_key: str):
-        self._news_client = NewsApiClient(api_key=api_key)
+    def __init__(self, api_key: str, url_index: SeenUrlIndex = None, max_results_per_query: int = 100,
+                 max_calls: int = 50, query_workers: int = 4, min_window_hours: float = 1,
+                 session: QuotaSession = None):
+        """
+        Args:
+            api_key:
+            url_index: articles with an already published url are left out of the results
+            max_results_per_query: hits newsapi returns for a query over all pages, 100 on the free plan
+            max_calls: budget of api calls of a get_news
+            query_workers: api calls in flight at the same time
+            min_window_hours: windows holding more hits than a query returns are split down to this
+            session: rate limits, retries and caches the api calls, None calls the api directly
+        """
+        self._news_client = NewsApiClient(api_key=api_key, session=session)
+        self.url_index = url_index
+        self.max_results_per_query = max_results_per_query
+        self.page_size = min(PAGE_SIZE, max_results_per_query)
+        self.max_calls = max_calls
+        self.query_workers = query_workers
+        self.min_window = timedelta(hours=min_window_hours)
         self.logger = TRLogger.instance().get_logger(__name__)
 
     def get_news(self, topic: str, scrape_month: bool = False) -> List[NewsArticle]:
         """
         Retrieves google news for a topic
         Args:
-            parse_all:
             topic:
             scrape_month:
 
         Returns:
 
         """
-        all_articles = []
-        from_date = to_date = base_date = datetime.now()
+        return list(self.iter_news(topic=topic, scrape_month=scrape_month))
 
-        try:
-            if scrape_month:
-                for delta in range(0, 30):
-                    from_date = base_date - timedelta(days=delta)
-                    to_date = from_date - timedelta(days=1)
-                    self.logger.info(
-                        "Requesting google news from_date: {}, to_date: {}, delta: {}".format(from_date, to_date,
-                                                                                              delta))
-                    all_articles.extend(self._get_news_free(topic=topic, from_date=from_date, to_date=to_date))
+    def iter_news(self, topic: str, scrape_month: bool = False) -> Iterator[NewsArticle]:
+        """
+        streaming version of get_news, yields the articles of each api call as soon as it completes. The last day (or
+        month, up to the start of the current min window) is split into windows small enough for the results cap of a
+        query, see WindowPlanner
+        Args:
+            topic:
+            scrape_month:
+
+        Returns:
+
+        """
+        # floored to the min window, so that the queries of runs within the same min window hit the response cache
+        to_date = floor_to(datetime.utcnow(), self.min_window)
+        from_date = to_date - timedelta(days=30 if scrape_month else 1)
+        self.logger.info("Requesting google news from_date: {}, to_date: {}".format(from_date, to_date))
+
+        planner = WindowPlanner(fetch=partial(self._get_news_window, topic), max_results=self.max_results_per_query,
+                                page_size=self.page_size, min_window=self.min_window, max_calls=self.max_calls,
+                                max_workers=self.query_workers)
+        seen_urls = set()
+        for articles in planner.run([(from_date, to_date)]):
+            unseen = []
+            for article in articles:
+                if article.url and article.url in seen_urls:
+                    continue
+                seen_urls.add(article.url)
+                unseen.append(article)
+            yield from self._unseen(unseen)
+        self.logger.info("google news query plan for {}: {}, unique articles: {}".format(
+            topic, planner.stats, len(seen_urls)))
+
+    @staticmethod
+    def merge_topics(topics: List[str], max_query_chars: int = MAX_QUERY_CHARS) -> List[List[str]]:
+        """
+        groups the topics into as few newsapi queries as the max query length allows
+        Args:
+            topics:
+            max_query_chars:
+
+        Returns: the topics of each query, see topics_query
+
+        """
+        groups = []
+        for topic in dict.fromkeys(topic.strip() for topic in topics if topic.strip()):
+            if groups and len(GoogNews.topics_query(groups[-1] + [topic])) <= max_query_chars:
+                groups[-1].append(topic)
             else:
-                all_articles.extend(self._get_news_free(topic=topic, from_date=from_date, to_date=to_date))
-        except HTTPException or NewsAPIException as exp:
-            self.logger.error("Unable to fetch news, HTTP error: {}".format(exp))
+                groups.append([topic])
+        return groups
+
+    @staticmethod
+    def topics_query(topics: List[str]) -> str:
+        """
+        Args:
+            topics:
 
-        return all_articles
+        Returns: the newsapi query matching any of the topics
 
-    def _get_news_free(self, topic: str, from_date: datetime, to_date: datetime) -> List[NewsArticle]:
         """
-        Get free news which is limited to 100 news articles, for the given date
+        return topics[0] if len(topics) == 1 else " OR ".join("({})".format(topic) for topic in topics)
+
+    @staticmethod
+    def matching_topics(article: NewsArticle, query_topics: List[str]) -> List[str]:
+        """
+        Args:
+            article:
+            query_topics: the topics of the query that returned the article, never the other topics of the batch
+
+        Returns: the topics of the query all words of which are in the title, description or content of the
+                 article. If none is (newsapi also matches on the full text, which it does not return), the query
+                 cannot tell which of its topics matched and all of them are
+
+        """
+        words = set(WORD_PATTERN.findall(" ".join(
+            text for text in (article.title, article.description, article.content) if text).lower()))
+        return [topic for topic in query_topics if words.issuperset(WORD_PATTERN.findall(topic.lower()))] or \
+            list(query_topics)
+
+    def iter_news_batch(self, topics: List[str], scrape_month: bool = False) -> Iterator[Tuple[NewsArticle, List[str]]]:
+        """
+        batch version of iter_news: the topics are merged into few OR queries, every url is yielded once with all the
+        topics it matches. A single query streams its articles, with several queries all of them run before the
+        first article is yielded (they are few and cheap next to scraping), so that the topics are complete
+        Args:
+            topics:
+            scrape_month:
+
+        Returns: the articles with their topics
+
+        """
+        groups = self.merge_topics(topics)
+        if len(groups) == 1:
+            for article in self.iter_news(topic=self.topics_query(groups[0]), scrape_month=scrape_month):
+                yield article, self.matching_topics(article, groups[0])
+            return
+
+        by_url = OrderedDict()
+        for group in groups:
+            for article in self.iter_news(topic=self.topics_query(group), scrape_month=scrape_month):
+                _, article_topics = by_url.setdefault(article.url or id(article), (article, []))
+                article_topics.extend(topic for topic in self.matching_topics(article, group)
+                                      if topic not in article_topics)
+        self.logger.info("{} unique google news articles for {} topics".format(len(by_url), len(topics)))
+        yield from by_url.values()
+
+    def _get_news_window(self, topic: str, from_date: datetime, to_date: datetime,
+                         page: int = 1) -> Tuple[int, List[NewsArticle]]:
+        """
+        Get a page of the news of a window
         Args:
             topic:
-            from_date:
-            to_date:
+            from_date: utc
+            to_date: utc
+            page:
 
-        Returns:
+        Returns: the total hits of the window, the articles of the page
 
         """
         try:
             # /v2/everything
             articles = self._news_client.get_everything(q=topic,
                                                         language='en',
-                                                        from_param=from_date,
-                                                        to=to_date,
+                                                        from_param=from_date.strftime(DATE_FORMAT),
+                                                        to=to_date.strftime(DATE_FORMAT),
                                                         sort_by='relevancy',
-                                                        page_size=100,  # cannot get more than this in free plan
-                                                        page=1)  # same as above
+                                                        page_size=self.page_size,
+                                                        page=page)
             # map to dataclass
-            return self._map_articles(articles=articles)
+            return articles.get("totalResults", 0), self._map_articles(articles=articles)
 
-        except HTTPException as exp:
+        except (HTTPException, NewsAPIException, RequestException) as exp:
             self.logger.error("Unable to fetch news, HTTP error: {}".format(exp))
+            return 0, []
+
+    def _unseen(self, articles: List[NewsArticle]) -> List[NewsArticle]:
+        """
+        drops the articles whose url is already in the url index
+        Args:
+            articles:
+
+        Returns:
+
+        """
+        if not self.url_index:
+            return articles
+        unseen = [article for article in articles if not article.url or not self.url_index.is_seen(article.url)]
+        self.logger.debug("Skipping {} already seen google news articles".format(len(articles) - len(unseen)))
+        return unseen
 
     def get_news_headlines(self, country: str) -> List[NewsArticle]:
         """
@@ -90,7 +230,7 @@ class GoogNews(object):
         headlines = {}
         try:
             headlines = self._news_client.get_top_headlines(country=country, page_size=100)
-        except HTTPException as exp:
+        except (HTTPException, NewsAPIException, RequestException) as exp:
             self.logger.error("Unable to fetch news, HTTP error: {}".format(exp))
 
         return self._map_articles(articles=headlines)
@@ -105,7 +245,7 @@ class GoogNews(object):
         try:
             # /v2/sources
             sources = self._news_client.get_sources()
-        except HTTPException as exp:
+        except (HTTPException, NewsAPIException, RequestException) as exp:
             self.logger.error("Unable to fetch news, HTTP error: {}".format(exp))
 
         return self._map_sources(sources=sources)
@@ -0,0 +1,226 @@
+"""
+Quota aware transport of the newsapi client: calls are rate limited by a token bucket sized to the plan, retried with
+jittered backoff on 429 and 5xx, and successful responses are cached on disk for a TTL so repeated queries cost
+neither quota nor latency
+"""
+import hashlib
+import json
+import random
+import sqlite3
+import threading
+import time
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import requests
+from kgai_py_commons.logging.log import TRLogger
+from newsapi.newsapi_exception import NewsAPIException
+
+NEWSAPI_URL = "https://newsapi.org"
+# responses retried with backoff
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+
+
+class TokenBucket(object):
+    """
+    Holds up to capacity tokens, refilled at rate_per_sec, a call takes a token
+    """
+
+    def __init__(self, rate_per_sec: float, capacity: float, tokens: float = None, updated_at: float = None):
+        """
+        Args:
+            rate_per_sec: refill rate
+            capacity: max tokens (the burst)
+            tokens: tokens left, defaults to a full bucket
+            updated_at: time the tokens were counted, defaults to now
+        """
+        self.rate_per_sec = rate_per_sec
+        self.capacity = capacity
+        self.tokens = capacity if tokens is None else tokens
+        self.updated_at = time.time() if updated_at is None else updated_at
+
+    def reserve(self, max_wait_secs: float = float("inf"), now: float = None) -> Optional[float]:
+        """
+        takes a token, possibly one refilled in the future
+        Args:
+            max_wait_secs: no token is taken if it is not refilled within this time
+            now: defaults to now
+
+        Returns: seconds to wait before using the token, None if no token was taken
+
+        """
+        now = time.time() if now is None else now
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated_at) * self.rate_per_sec)
+        self.updated_at = now
+        wait_secs = max(0.0, (1 - self.tokens) / self.rate_per_sec)
+        if wait_secs > max_wait_secs:
+            return None
+        self.tokens -= 1
+        return wait_secs
+
+
+class CachedResponse(object):
+    """
+    A cached response body, exposes what NewsApiClient reads of a response
+    """
+
+    def __init__(self, body: str):
+        self.status_code = requests.codes.ok
+        self.text = body
+
+    def json(self) -> Dict[str, Any]:
+        return json.loads(self.text)
+
+
+class QuotaSession(object):
+    """
+    Stands in for the requests session of a NewsApiClient (only get is used). The token bucket is persisted with the
+    cache, so the quota is shared by the runs using the same cache file
+    """
+
+    def __init__(self, requests_per_day: float = 100, burst: float = None, max_wait_secs: float = 60,
+                 max_retries: int = 3, backoff_secs: float = 1, max_backoff_secs: float = 60, cache_path: str = None,
+                 ttl_secs: float = 3600, sources_ttl_secs: float = 24 * 3600, base_url: str = NEWSAPI_URL,
+                 session: requests.Session = None):
+        """
+        Args:
+            requests_per_day: quota of the plan, the refill rate of the bucket
+            burst: calls made without waiting on a full bucket, defaults to requests_per_day
+            max_wait_secs: calls waiting longer for a token fail with a rateLimited NewsAPIException
+            max_retries: retries of a call answered with 429/5xx or failing to connect
+            backoff_secs: backoff before the first retry, doubled on every retry and jittered (or the Retry-After)
+            max_backoff_secs: bound of the backoff
+            cache_path: sqlite file of the response cache and the bucket, None keeps both in memory
+            ttl_secs: time a response is served from cache
+            sources_ttl_secs: time the source list is served from cache
+            base_url: replaces the newsapi url (a local fake server in tests)
+            session: the requests session (or HttpTransport) calls are made with
+        """
+        self.logger = TRLogger.instance().get_logger(__name__)
+        self.max_wait_secs = max_wait_secs
+        self.max_retries = max_retries
+        self.backoff_secs = backoff_secs
+        self.max_backoff_secs = max_backoff_secs
+        self.ttl_secs = ttl_secs
+        self.sources_ttl_secs = sources_ttl_secs
+        self.base_url = base_url.rstrip("/")
+        self.session = session or requests.Session()
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(cache_path or ":memory:", timeout=30, check_same_thread=False)
+        self._conn.execute("CREATE TABLE IF NOT EXISTS responses (cache_key TEXT PRIMARY KEY, body TEXT NOT NULL, "
+                           "stored_at REAL NOT NULL)")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS token_bucket (id INTEGER PRIMARY KEY, tokens REAL NOT NULL, "
+                           "updated_at REAL NOT NULL)")
+        self._conn.commit()
+        row = self._conn.execute("SELECT tokens, updated_at FROM token_bucket WHERE id = 0").fetchone()
+        self.bucket = TokenBucket(rate_per_sec=requests_per_day / (24 * 3600),
+                                  capacity=burst if burst is not None else requests_per_day,
+                                  tokens=row[0] if row else None, updated_at=row[1] if row else None)
+        self.stats = {"calls": 0, "cache_hits": 0, "retries": 0, "throttled_secs": 0.0}
+
+    @staticmethod
+    def cache_key(url: str, params: Optional[Dict[str, Any]]) -> str:
+        """
+        Args:
+            url:
+            params: query parameters, unset ones are left out and the order does not matter
+
+        Returns:
+
+        """
+        normalized = sorted((name, str(value).strip()) for name, value in (params or {}).items() if value is not None)
+        return hashlib.sha1(json.dumps([urlsplit(url).path, normalized]).encode("utf-8")).hexdigest()
+
+    def _count(self, stat: str):
+        with self._lock:
+            self.stats[stat] += 1
+
+    def _ttl(self, url: str) -> float:
+        return self.sources_ttl_secs if urlsplit(url).path.endswith("/sources") else self.ttl_secs
+
+    def _cached(self, key: str, url: str) -> Optional[CachedResponse]:
+        with self._lock:
+            row = self._conn.execute("SELECT body FROM responses WHERE cache_key = ? AND stored_at >= ?",
+                                     (key, time.time() - self._ttl(url))).fetchone()
+            if row is None:
+                return None
+            self.stats["cache_hits"] += 1
+            return CachedResponse(row[0])
+
+    def _store(self, key: str, body: str):
+        with self._lock:
+            self._conn.execute("INSERT OR REPLACE INTO responses VALUES (?, ?, ?)", (key, body, time.time()))
+            self._conn.commit()
+
+    def _take_token(self):
+        """
+        waits for a token of the bucket
+        Returns:
+
+        """
+        with self._lock:
+            wait_secs = self.bucket.reserve(max_wait_secs=self.max_wait_secs)
+            if wait_secs is not None:
+                self._conn.execute("INSERT OR REPLACE INTO token_bucket VALUES (0, ?, ?)",
+                                   (self.bucket.tokens, self.bucket.updated_at))
+                self._conn.commit()
+                self.stats["throttled_secs"] += wait_secs
+        if wait_secs is None:
+            raise NewsAPIException({"status": "error", "code": "rateLimited",
+                                    "message": "Quota of {:.0f} requests a day spent".format(
+                                        self.bucket.rate_per_sec * 24 * 3600)})
+        if wait_secs:
+            time.sleep(wait_secs)
+
+    def _backoff(self, attempt: int, response: Optional[requests.Response]) -> float:
+        retry_after = response.headers.get("Retry-After") if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.max_backoff_secs)
+        return min(self.backoff_secs * 2 ** attempt, self.max_backoff_secs) * random.uniform(0.5, 1.5)
+
+    def get(self, url: str, auth=None, timeout: float = None, params: Dict[str, Any] = None):
+        """
+        Args:
+            url: a newsapi url
+            auth:
+            timeout:
+            params:
+
+        Returns: the response, from cache or of the last attempt
+
+        """
+        key = self.cache_key(url, params)
+        cached = self._cached(key, url)
+        if cached is not None:
+            return cached
+        if url.startswith(NEWSAPI_URL):
+            url = self.base_url + url[len(NEWSAPI_URL):]
+
+        for attempt in range(self.max_retries + 1):
+            self._take_token()
+            self._count("calls")
+            response = None
+            try:
+                response = self.session.get(url, auth=auth, timeout=timeout, params=params)
+                if response.status_code not in RETRY_STATUSES:
+                    break
+                error = "status {}".format(response.status_code)
+            except (requests.ConnectionError, requests.Timeout) as err:
+                if attempt == self.max_retries:
+                    raise
+                error = err
+            if attempt < self.max_retries:
+                backoff_secs = self._backoff(attempt, response)
+                self.logger.warning("newsapi call failed ({}), retrying in {:.1f}s".format(error, backoff_secs))
+                self._count("retries")
+                time.sleep(backoff_secs)
+
+        if response.status_code == requests.codes.ok:
+            self._store(key, response.text)
+        return response
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
+        self.session.close()
+
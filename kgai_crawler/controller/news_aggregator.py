@@ -1,6 +1,9 @@
 """
 Collects, scraps and aggregates the news
 """
+import json
+from functools import partial
+from typing import Dict, Iterator, List, Tuple
 
 from kgai_py_commons.clients.kafka.producer.producer import TRAvroProducer
 from kgai_py_commons.logging.log import TRLogger
@@ -9,21 +12,136 @@ from kgai_py_commons.model.googlenews.news_article import NewsArticle
 from kgai_crawler.connector.common_crawl import CommonCrawl
 from kgai_crawler.connector.generic_news import GenericNews
 from kgai_crawler.connector.google_news import GoogNews
+from kgai_crawler.connector.news_api_client import QuotaSession
+from kgai_crawler.service.extraction_cache import ExtractionCache
+from kgai_crawler.service.http_cache import ConditionalCache
+from kgai_crawler.service.http_transport import HttpTransport
+from kgai_crawler.service.kafka_publisher import KafkaPublisher
+from kgai_crawler.service.near_duplicates import CLUSTER, OFF, NearDuplicateIndex
 from kgai_crawler.service.news_cleaner import NewsCleaner
+from kgai_crawler.service.source_scheduler import SourceScheduler
+from kgai_crawler.service.url_index import SeenUrlIndex
 from kgai_crawler.utils.common_utils import hash_article
 
+# kafka header of the google news articles, the json list of the news topics the article matches
+TOPICS_HEADER = "news_topics"
+
 
 class NewsAggregator(object):
 
-    def __init__(self, goog_api_key: str, kafka_broker: str, kafka_schema: str, avro_namespace: str):
+    def __init__(self, goog_api_key: str, kafka_broker: str, kafka_schema: str, avro_namespace: str,
+                 scrape_workers: int = 1, scrape_max_per_host: int = 2, news_download_workers: int = 1,
+                 news_parse_workers: int = 0, max_concurrent_sources: int = 1, source_stats_path: str = None,
+                 seen_url_index_path: str = None, seen_url_ttl_days: float = 30, kafka_linger_ms: int = 50,
+                 kafka_batch_size: int = 10000, kafka_compression: str = "lz4", extraction_cache_entries: int = 0,
+                 extraction_cache_path: str = None, near_duplicate_mode: str = OFF,
+                 near_duplicate_window_hours: float = 24, near_duplicate_threshold: float = 0.6,
+                 goog_max_results_per_query: int = 100, goog_max_calls: int = 50, goog_query_workers: int = 4,
+                 newsapi_requests_per_day: float = 100, newsapi_cache_path: str = None,
+                 newsapi_cache_ttl_secs: float = 3600, http_pool_maxsize: int = 10,
+                 http_connect_timeout_secs: float = 5, http_read_timeout_secs: float = 30,
+                 http_max_response_bytes: int = 10 * 1024 * 1024, http_dns_ttl_secs: float = 300,
+                 http_cache_path: str = None, http_cache_ttl_days: float = 30):
         self.logger = TRLogger.instance().get_logger(__name__)
-        self.goog_news = GoogNews(api_key=goog_api_key)
-        self.news_client = GenericNews()
-        self.news_cleaner = NewsCleaner()
-        self.kafka_producer = TRAvroProducer(bootstrap_servers=kafka_broker,
-                                             schema_registry=kafka_schema,
-                                             namespace=avro_namespace,
-                                             data_class=NewsArticle)
+        # html extracted before (syndicated stories, mirrors) is not parsed again, disabled without entries or a path.
+        # The memory tier is per process, the extraction processes of common crawl only share the disk tier
+        self.extraction_cache = ExtractionCache(max_entries=extraction_cache_entries, disk_path=extraction_cache_path) \
+            if extraction_cache_entries > 0 or extraction_cache_path else None
+        # near-duplicates (syndicated or re-scraped stories) are suppressed or clustered before publish, over all
+        # connectors, opt-in: by default every article is published
+        self.near_duplicates = NearDuplicateIndex(window_secs=near_duplicate_window_hours * 3600,
+                                                  threshold=near_duplicate_threshold, mode=near_duplicate_mode) \
+            if near_duplicate_mode != OFF else None
+        # urls published in previous runs are skipped before they are fetched (disabled without a path)
+        self.url_index = SeenUrlIndex(path=seen_url_index_path, ttl_days=seen_url_ttl_days) \
+            if seen_url_index_path else None
+        # validators of the downloaded articles, unchanged articles of the news sources are neither parsed nor
+        # published again (disabled without a path)
+        self.http_cache = ConditionalCache(path=http_cache_path, ttl_days=http_cache_ttl_days) \
+            if http_cache_path else None
+        # a single pooled http session for the newsapi calls and the article downloads of all connectors
+        self.transport = HttpTransport(pool_maxsize=max(http_pool_maxsize, scrape_max_per_host),
+                                       connect_timeout_secs=http_connect_timeout_secs,
+                                       read_timeout_secs=http_read_timeout_secs,
+                                       max_response_bytes=http_max_response_bytes, dns_ttl_secs=http_dns_ttl_secs,
+                                       conditional_cache=self.http_cache)
+        # newsapi calls are rate limited to the plan, retried and their responses cached (on disk with a path)
+        self.newsapi_session = QuotaSession(requests_per_day=newsapi_requests_per_day, cache_path=newsapi_cache_path,
+                                            ttl_secs=newsapi_cache_ttl_secs, session=self.transport)
+        # windows holding more articles than a newsapi query returns are split, within a budget of api calls
+        self.goog_news = GoogNews(api_key=goog_api_key, url_index=self.url_index,
+                                  max_results_per_query=goog_max_results_per_query, max_calls=goog_max_calls,
+                                  query_workers=goog_query_workers, session=self.newsapi_session)
+        self.news_client = GenericNews(download_workers=news_download_workers, parse_workers=news_parse_workers,
+                                       max_per_host=scrape_max_per_host, url_index=self.url_index,
+                                       extraction_cache=self.extraction_cache, transport=self.transport)
+        self.news_cleaner = NewsCleaner(max_workers=scrape_workers, max_per_host=scrape_max_per_host,
+                                        url_index=self.url_index, extraction_cache=self.extraction_cache,
+                                        transport=self.transport)
+        self.source_scheduler = SourceScheduler(max_concurrent_sources=max_concurrent_sources,
+                                                stats_path=source_stats_path)
+        # the batching settings only reach producers whose constructor takes a config
+        self.kafka_producer = KafkaPublisher.build_producer(
+            TRAvroProducer, KafkaPublisher.producer_config(linger_ms=kafka_linger_ms, batch_size=kafka_batch_size,
+                                                           compression=kafka_compression),
+            bootstrap_servers=kafka_broker, schema_registry=kafka_schema, namespace=avro_namespace,
+            data_class=NewsArticle)
+        self.kafka_publisher = KafkaPublisher(producer=self.kafka_producer)
+        if near_duplicate_mode == CLUSTER and not self.kafka_publisher.sends_headers:
+            raise ValueError("near_duplicate_mode {} needs a kafka producer sending headers".format(CLUSTER))
+
+    def _publish(self, kafka_topic: str, article: NewsArticle, headers: List[Tuple[str, bytes]] = None) -> bool:
+        """
+        publishes an article to kafka, once kafka acked it its url is remembered so it is not fetched again in later
+        runs, and the download validators of the article are committed (see _delivered)
+        Args:
+            kafka_topic:
+            article:
+            headers: kafka headers of the article
+
+        Returns: False if the article was suppressed as a near-duplicate
+
+        """
+        key = hash_article(article)
+        publish, duplicate_headers = self.near_duplicates.review(key, article.articleText) \
+            if self.near_duplicates else (True, None)
+        if publish:
+            self.kafka_publisher.publish(topic=kafka_topic, key=key, value=article,
+                                         headers=(headers or []) + (duplicate_headers or []),
+                                         on_delivered=partial(self._delivered, article.url) if article.url else None,
+                                         on_failed=partial(self._not_delivered, article.url) if article.url else None)
+        elif article.url:
+            if self.url_index:
+                self.url_index.mark_seen([article.url])
+            # a suppressed article is downloaded (and reviewed) again next run
+            self._not_delivered(article.url)
+        return publish
+
+    def _delivered(self, url: str):
+        """
+        kafka acked the article of the url: the url is skipped in later runs, and an unchanged page is not parsed again
+        Args:
+            url:
+
+        Returns:
+
+        """
+        if self.url_index:
+            self.url_index.mark_seen([url])
+        if self.http_cache:
+            self.http_cache.commit(url)
+
+    def _not_delivered(self, url: str):
+        """
+        the article of the url was not delivered, its page is downloaded in full again next run
+        Args:
+            url:
+
+        Returns:
+
+        """
+        if self.http_cache:
+            self.http_cache.discard(url)
 
     def aggregate_google(self, news_topic: str, kafka_topic: str, scrape_month: bool = False):
         """
@@ -39,20 +157,71 @@ class NewsAggregator(object):
         Returns:
 
         """
-        news_articles = self.news_cleaner.clean_scrape(
-            self.goog_news.get_news(topic=news_topic, scrape_month=scrape_month))
+        # the articles of a single topic need no topics header
+        news_articles = self.news_cleaner.iter_clean_scrape(
+            self.goog_news.iter_news(topic=news_topic, scrape_month=scrape_month))
 
-        self.logger.info("GOOG -- Publishing {} news articles to kafka".format(len(news_articles)))
+        self.logger.info("GOOG -- Publishing news articles to kafka as they are scraped")
 
+        published = 0
         for article in news_articles:
-            self.kafka_producer.produce(topic=kafka_topic, key=hash_article(article),
-                                        value=article)
+            published += self._publish(kafka_topic=kafka_topic, article=article)
 
-        self.logger.info("GOOG -- Published {} news articles to kafka".format(len(news_articles)))
+        self.logger.info("GOOG -- Published {} news articles to kafka".format(published))
+        self._log_extraction_stats()
+
+    def aggregate_google_topics(self, news_topics: List[str], kafka_topic: str, scrape_month: bool = False):
+        """
+        batch version of aggregate_google: the topics are queried together and every article is scraped once, its
+        kafka message has the topics it matches in the TOPICS_HEADER (a json list). The articles are scraped and
+        published once their topics are complete, see GoogNews.iter_news_batch
+        Args:
+            news_topics:
+            kafka_topic:
+            scrape_month:
+
+        Returns:
+
+        """
+        # the topics travel in a header, fail before spending the newsapi quota
+        if not self.kafka_publisher.sends_headers:
+            raise ValueError("The kafka producer cannot send the {} header of the articles".format(TOPICS_HEADER))
+        # articles are scraped in place, their topics are looked up (and popped) once they are scraped
+        topics_of = {}
+        news_articles = self.news_cleaner.iter_clean_scrape(self._untag(
+            self.goog_news.iter_news_batch(topics=news_topics, scrape_month=scrape_month), topics_of))
+
+        self.logger.info("GOOG -- Publishing news articles to kafka as they are scraped")
+
+        published = 0
+        for article in news_articles:
+            headers = [(TOPICS_HEADER, json.dumps(topics_of.pop(id(article))).encode("utf-8"))]
+            published += self._publish(kafka_topic=kafka_topic, article=article, headers=headers)
+
+        self.logger.info("GOOG -- Published {} news articles of {} topics to kafka".format(published,
+                                                                                          len(news_topics)))
+        self._log_extraction_stats()
+
+    @staticmethod
+    def _untag(tagged: Iterator[Tuple[NewsArticle, List[str]]],
+               topics_of: Dict[int, List[str]]) -> Iterator[NewsArticle]:
+        """
+        streams the articles of tagged articles, their topics go to topics_of by article id
+        Args:
+            tagged: the articles with their topics
+            topics_of: filled as the articles are consumed
+
+        Returns:
+
+        """
+        for article, topics in tagged:
+            topics_of[id(article)] = topics
+            yield article
 
     def aggregate_non_google(self, kafka_topic: str):
         """
         gathers news sorces from google and then gathers news from these sources
+        sources are crawled concurrently (most productive first), each article is published as soon as it is scraped
         method does not return anything, publishes to kafka
         as resulting object with all articles from all sources could be huge, keep the
         memory pressure low
@@ -62,23 +231,89 @@ class NewsAggregator(object):
         Returns:
 
         """
-        sources = self.goog_news.get_news_sources()
-
-        for source in sources:
-            news_articles = self.news_client.get_news(source)
+        sources = self.source_scheduler.order(self.goog_news.get_news_sources())
 
-            self.logger.debug("Publishing {} news articles from {} to kafka".format(len(news_articles), source.url))
+        published = 0
+        for source, article in self.source_scheduler.crawl(sources, self.news_client.iter_news):
             # publish to kafka
-            for article in news_articles:
-                self.kafka_producer.produce(topic=kafka_topic, key=hash_article(article),
-                                            value=article)
-            self.logger.debug(
-                "Finished publishing {} news articles from {} to kafka".format(len(news_articles), source.url))
+            published += self._publish(kafka_topic=kafka_topic, article=article)
+
+        self.logger.info("Published {} news articles from {} sources to kafka".format(published, len(sources)))
+        self._log_extraction_stats()
+
+    def _log_extraction_stats(self):
+        """
+        logs the hit rate of the extraction cache (to size it), the newsapi calls, the connection reuse and time to
+        first byte of the downloads and the near-duplicates found
+        Returns:
+
+        """
+        if self.extraction_cache:
+            self.logger.info("extraction cache stats: {}".format(self.extraction_cache.stats()))
+        self.logger.info("newsapi stats: {}".format(self.newsapi_session.stats))
+        self.logger.info("http transport stats: {}".format(self.transport.stats()))
+        if self.near_duplicates:
+            self.logger.info("near-duplicate stats: {}".format(self.near_duplicates.stats()))
+
+    def common_crawl_news(self, kafka_topic: str, download_dir_article: str, download_dir_warc: str,
+                          mode: str = "window", poll_interval_secs: float = 600, stream_warcs: bool = False,
+                          prefetch_warcs: int = 0, warc_disk_budget_bytes: int = None, split_warcs: bool = False,
+                          extraction_processes: int = 1, work_queue_path: str = None):
+        """
+        extracts news from the common crawl news archives and publishes to kafka
+        Args:
+            kafka_topic:
+            download_dir_article:
+            download_dir_warc:
+            mode: "window" crawls the default date window, "tail" only the WARCs published since the last tail run
+                  and "follow" keeps tailing every poll interval, "replay" publishes the archived articles again
+            poll_interval_secs:
+            stream_warcs: extract the WARCs while streaming them instead of downloading them first
+            prefetch_warcs: number of WARCs downloaded ahead of the extraction
+            warc_disk_budget_bytes: max bytes of prefetched WARCs on disk, None is unbounded
+            split_warcs: extract the records of each WARC in parallel across the extraction processes
+            extraction_processes: number of extraction processes, the articles are published from this process
+            work_queue_path: WARC work queue shared with other crawler nodes (sqlite file on a shared volume)
 
-    def common_crawl_news(self, kafka_topic: str, download_dir_article: str, download_dir_warc: str):
+        Returns:
+
+        """
         # prepare the common crawl connector
         # this connector takes the kafka producer and the topic and produces directly
         # to keep the memory footprint low
         common_crawl = CommonCrawl(download_dir_article=download_dir_article, download_dir_warc=download_dir_warc,
-                                   kafka_producer=self.kafka_producer, kafka_topic=kafka_topic)
-        common_crawl.crawl_news()
+                                   kafka_publisher=self.kafka_publisher, kafka_topic=kafka_topic,
+                                   stream_warcs=stream_warcs, prefetch_warcs=prefetch_warcs,
+                                   warc_disk_budget_bytes=warc_disk_budget_bytes, split_warcs=split_warcs,
+                                   number_of_extraction_processes=extraction_processes,
+                                   work_queue_path=work_queue_path, extraction_cache=self.extraction_cache,
+                                   near_duplicates=self.near_duplicates)
+        try:
+            if mode == "tail":
+                common_crawl.tail_news()
+            elif mode == "follow":
+                common_crawl.follow_news(poll_interval_secs=poll_interval_secs)
+            elif mode == "replay":
+                common_crawl.replay_archive()
+            else:
+                common_crawl.crawl_news()
+        finally:
+            common_crawl.close()
+            self._log_extraction_stats()
+
+    def close(self):
+        """
+        flushes all pending kafka messages and shuts down the scrape pools, call before the app exits
+        Returns:
+
+        """
+        self.news_client.close()
+        self.kafka_publisher.close()
+        if self.url_index:
+            self.url_index.close()
+        if self.extraction_cache:
+            self.extraction_cache.close()
+        self.newsapi_session.close()
+        self.transport.close()
+        if self.http_cache:
+            self.http_cache.close()
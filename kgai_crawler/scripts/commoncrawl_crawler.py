@@ -13,16 +13,21 @@ not otherwise specified.
 import datetime
 import logging
 import os
-import subprocess
-import time
+from contextlib import contextmanager
 from functools import partial
 from multiprocessing import Pool
-from typing import List
 
 from dateutil import parser
 from newsplease.crawler.commoncrawl_extractor import CommonCrawlExtractor
 from scrapy.utils.log import configure_logging
 
+from kgai_crawler.connector.cc_news_index import CCNewsIndex
+from kgai_crawler.scripts import crawl_metrics
+from kgai_crawler.scripts.commoncrawl_stream_extractor import StreamingCommonCrawlExtractor
+from kgai_crawler.scripts.crawl_checkpoint import CrawlCheckpoint, filter_fingerprint
+from kgai_crawler.scripts.warc_prefetcher import WarcPrefetcher
+from kgai_crawler.service import extraction_cache as extraction_cache_module
+
 __author__ = "Felix Hamborg"
 __adapted_by__ = "Ritaja Sengupta"
 
@@ -39,13 +44,6 @@ __logger = logging.getLogger(__name__)
 __number_of_warc_files_on_cc = 0
 
 __extern_callback_on_warc_completed = None
-__counter_article_passed = 0
-__counter_article_discarded = 0
-__counter_article_error = 0
-__counter_article_total = 0
-__counter_warc_skipped = 0
-__counter_warc_processed = 0
-__start_time = time.time()
 
 
 def __setup(local_download_dir_warc, log_level):
@@ -75,6 +73,22 @@ def __setup(local_download_dir_warc, log_level):
     __logger.setLevel(log_level)
 
 
+def __get_list_of_fully_extracted_warc_urls():
+    """
+    Reads in the log file that contains a list of all previously, fully extracted WARC urls
+    :return:
+    """
+    if not os.path.isfile(__log_pathname_fully_extracted_warcs):
+        return []
+
+    with open(__log_pathname_fully_extracted_warcs) as log_file:
+        list_warcs = log_file.readlines()
+    # remove break lines
+    list_warcs = [x.strip() for x in list_warcs]
+
+    return [x for x in list_warcs if x]
+
+
 def __get_publishing_date(warc_record, article):
     """
     Extracts the publishing date from the article
@@ -96,73 +110,6 @@ def __get_download_url(name):
     return __cc_base_url + name
 
 
-def __execute_subcommand(year: int = None, month: int = None) -> List[str]:
-    """
-    executes the aws storage retrieval of WARC links for given month and year, else gets all
-    __adapted_by__="Ritaja"
-    Args:
-        year:
-        month:
-
-    Returns:
-
-    """
-    # cleanup
-    subprocess.getoutput("rm tmpaws.txt")
-    base_cmd = "aws s3 ls --recursive s3://commoncrawl/crawl-data/CC-NEWS/ --no-sign-request"
-    # if year and month defined
-    if year and month:
-        base_cmd = "aws s3 ls --recursive s3://commoncrawl/crawl-data/CC-NEWS/{}/{:02d} --no-sign-request".format(year,
-                                                                                                                  month)
-    full_cmd = base_cmd + "> .tmpaws.txt && awk '{ print $4 }' .tmpaws.txt && rm .tmpaws.txt"
-    __logger.info("executing: {}".format(full_cmd))
-    stdout_data = subprocess.getoutput(full_cmd)
-    return stdout_data.splitlines()
-
-
-def __get_remote_index(start_date: datetime, end_date: datetime) -> List[str]:
-    """
-    Gets the index of news crawl files from commoncrawl.org and returns an array of names
-    __adapted_by__="Ritaja"
-    Args:
-        start_date:
-        end_date:
-
-    Returns:
-
-    """
-
-    lines = []
-    for year in range(start_date.year, end_date.year + 1):
-        # for start year and all years where we need complete scrape
-        if start_date.year == year < end_date.year:
-            for month in range(start_date.month, 13):
-                lines.extend(__execute_subcommand(year=year, month=month))
-        elif start_date.year < year < end_date.year:
-            for month in range(1, 13):
-                lines.extend(__execute_subcommand(year=year, month=month))
-        else:
-            for month in range(start_date.month, end_date.month + 1):
-                lines.extend(__execute_subcommand(year=year, month=month))
-    return lines
-
-
-def __get_list_of_fully_extracted_warc_urls():
-    """
-    Reads in the log file that contains a list of all previously, fully extracted WARC urls
-    :return:
-    """
-    if not os.path.isfile(__log_pathname_fully_extracted_warcs):
-        return []
-
-    with open(__log_pathname_fully_extracted_warcs) as log_file:
-        list_warcs = log_file.readlines()
-    # remove break lines
-    list_warcs = [x.strip() for x in list_warcs]
-
-    return list_warcs
-
-
 def __callback_on_warc_completed(warc_path, counter_article_passed, counter_article_discarded, counter_article_error,
                                  counter_article_total):
     """
@@ -174,36 +121,47 @@ def __callback_on_warc_completed(warc_path, counter_article_passed, counter_arti
     :param counter_article_total:
     :return:
     """
-    # have to use the global keyword in order to assign a value to a global variable (see https://stackoverflow.com/a/9936482)
-    global __counter_article_passed
-    global __counter_article_discarded
-    global __counter_article_error
-    global __counter_article_total
-    global __counter_warc_processed
-    # global __counter_warc_skipped
-
-    elapsed_secs = time.time() - __start_time
-
-    __counter_article_discarded += counter_article_discarded
-    __counter_article_error += counter_article_error
-    __counter_article_passed += counter_article_passed
-    __counter_article_total += counter_article_total
-    __counter_warc_processed += 1
-
-    sec_per_article = elapsed_secs / counter_article_total
-    h_per_warc = elapsed_secs / __counter_warc_processed / 3600
-    remaining_warcs = __number_of_warc_files_on_cc - (__counter_warc_processed + __counter_warc_skipped)
+    # the counters are shared by all extraction processes
+    metrics = crawl_metrics.current()
+    metrics.inc("article_passed", counter_article_passed)
+    metrics.inc("article_discarded", counter_article_discarded)
+    metrics.inc("article_error", counter_article_error)
+    metrics.inc("article_total", counter_article_total)
+    metrics.inc("warc_processed")
+    stats = metrics.snapshot()
+    counters = stats["counters"]
 
     __logger.info("warc processing statistics")
-    __logger.info("warc files skipped = %i, processed = %i, remaining = %i, total = %i", __counter_warc_skipped,
-                  __counter_warc_processed, remaining_warcs, __number_of_warc_files_on_cc)
-    __logger.info("global [s/article] = %f", sec_per_article)
-    __logger.info("global [h/warc] = %.3f", h_per_warc)
-    __logger.info("estimated remaining time [h] = %f", remaining_warcs / h_per_warc)
+    __logger.info("warc files skipped = %i, processed = %i, remaining = %i, total = %i", counters["warc_skipped"],
+                  counters["warc_processed"], stats["remaining_warcs"], metrics.total_warcs)
+    __logger.info("global [s/article] = %f", stats["sec_per_article"] or 0.0)
+    __logger.info("global [h/warc] = %.3f", stats["h_per_warc"])
+    __logger.info("estimated remaining time [h] = %f", stats["eta_h"])
 
     # invoke the external callback
-    __extern_callback_on_warc_completed(warc_path, __counter_article_passed, __counter_article_discarded,
-                                        __counter_article_error, __counter_article_total, __counter_warc_processed)
+    if __extern_callback_on_warc_completed:
+        __extern_callback_on_warc_completed(warc_path, counters["article_passed"], counters["article_discarded"],
+                                            counters["article_error"], counters["article_total"],
+                                            counters["warc_processed"])
+
+
+@contextmanager
+def __claimed(work_queue, warc_download_url):
+    """
+    Completes a WARC claimed from the work queue once it is extracted, gives it back to the queue on errors
+    :param work_queue: None outside of the work queue mode
+    :param warc_download_url:
+    :return:
+    """
+    if work_queue is None:
+        yield
+        return
+    try:
+        yield
+    except BaseException:
+        work_queue.release(warc_download_url)
+        raise
+    work_queue.complete(warc_download_url)
 
 
 def __start_commoncrawl_extractor(warc_download_url, callback_on_article_extracted=None,
@@ -215,7 +173,13 @@ def __start_commoncrawl_extractor(warc_download_url, callback_on_article_extract
                                   log_level=logging.ERROR,
                                   delete_warc_after_extraction=True,
                                   continue_process=True,
-                                  log_pathname_fully_extracted_warcs=None):
+                                  log_pathname_fully_extracted_warcs=None,
+                                  stream_warcs=False,
+                                  local_warc_path=None,
+                                  record_pool=None,
+                                  checkpoint_store=None,
+                                  work_queue=None,
+                                  fast_extraction_confidence=0.7):
     """
     Starts a single CommonCrawlExtractor
     :param warc_download_url:
@@ -230,28 +194,87 @@ def __start_commoncrawl_extractor(warc_download_url, callback_on_article_extract
     :param continue_after_error:
     :param show_download_progress:
     :param log_level:
+    :param stream_warcs: extract while streaming the WARC instead of downloading it to disk first
+    :param local_warc_path: an already downloaded copy of the WARC, read by the streaming extractor
+    :param record_pool: process pool extracting the records of the local copy in parallel
+    :param checkpoint_store: the CrawlCheckpoint recording the progress
+    :param work_queue: the WarcWorkQueue the WARC was claimed from, completed once the WARC is extracted
+    :param fast_extraction_confidence: min confidence of the lxml fast path of the streaming extractor
+    :return:
+    """
+    if stream_warcs or local_warc_path:
+        commoncrawl_extractor = StreamingCommonCrawlExtractor()
+        extractor_kwargs = {"local_warc_path": local_warc_path, "record_pool": record_pool,
+                            "checkpoint_store": checkpoint_store,
+                            "fast_extraction_confidence": fast_extraction_confidence}
+    else:
+        commoncrawl_extractor = CommonCrawlExtractor()
+        extractor_kwargs = {}
+    with crawl_metrics.timed("warc"), __claimed(work_queue, warc_download_url):
+        commoncrawl_extractor.extract_from_commoncrawl(warc_download_url, callback_on_article_extracted,
+                                                       callback_on_warc_completed=callback_on_warc_completed,
+                                                       valid_hosts=valid_hosts,
+                                                       start_date=start_date, end_date=end_date,
+                                                       strict_date=strict_date,
+                                                       reuse_previously_downloaded_files=reuse_previously_downloaded_files,
+                                                       local_download_dir_warc=local_download_dir_warc,
+                                                       continue_after_error=continue_after_error,
+                                                       show_download_progress=show_download_progress,
+                                                       log_level=log_level,
+                                                       delete_warc_after_extraction=delete_warc_after_extraction,
+                                                       log_pathname_fully_extracted_warcs=__log_pathname_fully_extracted_warcs,
+                                                       **extractor_kwargs)
+    if checkpoint_store is not None:
+        checkpoint_store.mark_completed(warc_download_url)
+
+
+def __extract_downloaded(downloaded, extract):
+    """
+    Extraction stage of the download/extract pipeline, extracts an already downloaded WARC
+    :param downloaded: (warc_download_url, local_path) as yielded by the WarcPrefetcher
+    :param extract: __start_commoncrawl_extractor with the crawl config bound
+    :return: the downloaded tuple, so the caller can release the file
+    """
+    warc_download_url, local_path = downloaded
+    try:
+        extract(warc_download_url, local_warc_path=local_path)
+    except Exception as err:
+        __logger.error('error while extracting %s: %s', warc_download_url, err)
+    return downloaded
+
+
+def __install_worker_state(metrics, extraction_cache):
+    """
+    initializer of the extraction processes
+    :param metrics:
+    :param extraction_cache:
+    :return:
+    """
+    crawl_metrics.install(metrics)
+    extraction_cache_module.install(extraction_cache)
+
+
+def __extraction_pool(number_of_extraction_processes, metrics, extraction_cache):
+    """
+    A process pool whose workers add to the shared crawl metrics and keep an extraction cache across their tasks
+    :param number_of_extraction_processes:
+    :param metrics:
+    :param extraction_cache:
     :return:
     """
-    commoncrawl_extractor = CommonCrawlExtractor()
-    commoncrawl_extractor.extract_from_commoncrawl(warc_download_url, callback_on_article_extracted,
-                                                   callback_on_warc_completed=callback_on_warc_completed,
-                                                   valid_hosts=valid_hosts,
-                                                   start_date=start_date, end_date=end_date,
-                                                   strict_date=strict_date,
-                                                   reuse_previously_downloaded_files=reuse_previously_downloaded_files,
-                                                   local_download_dir_warc=local_download_dir_warc,
-                                                   continue_after_error=continue_after_error,
-                                                   show_download_progress=show_download_progress,
-                                                   log_level=log_level,
-                                                   delete_warc_after_extraction=delete_warc_after_extraction,
-                                                   log_pathname_fully_extracted_warcs=__log_pathname_fully_extracted_warcs)
+    return Pool(number_of_extraction_processes, initializer=__install_worker_state,
+                initargs=(metrics, extraction_cache))
 
 
 def crawl_from_commoncrawl(callback_on_article_extracted, callback_on_warc_completed=None, valid_hosts=None,
                            start_date=None, end_date=None, strict_date=True, reuse_previously_downloaded_files=True,
                            local_download_dir_warc=None, continue_after_error=True, show_download_progress=False,
                            number_of_extraction_processes=4, log_level=logging.ERROR,
-                           delete_warc_after_extraction=True, continue_process=True):
+                           delete_warc_after_extraction=True, continue_process=True, cc_news_index=None,
+                           warc_names=None, stream_warcs=False, prefetch_warcs=0, warc_disk_budget_bytes=None,
+                           split_warcs=False, metrics_interval_secs=60, checkpoint_interval_records=1000,
+                           work_queue=None, fast_extraction_confidence=0.7, extraction_cache=None,
+                           checkpoint_dates=None):
     """
     Crawl and extract articles form the news crawl provided by commoncrawl.org. For each article that was extracted
     successfully the callback function callback_on_article_extracted is invoked where the first parameter is the
@@ -269,32 +292,75 @@ def crawl_from_commoncrawl(callback_on_article_extracted, callback_on_warc_compl
     :param continue_after_error:
     :param show_download_progress:
     :param log_level:
-    :return:
+    :param cc_news_index: lists the WARC files, defaults to a CCNewsIndex over S3 keeping its manifests next to the WARCs
+    :param warc_names: WARC files to process instead of listing all the files of the date range
+    :param stream_warcs: extract the WARCs while streaming them, nothing is written to local_download_dir_warc
+    :param prefetch_warcs: if > 0 (and not streaming), WARCs are downloaded in the background while others are
+    extracted, with up to this many downloaded WARCs waiting for extraction
+    :param warc_disk_budget_bytes: max bytes of prefetched WARCs on disk, None is unbounded
+    :param split_warcs: extract the records of one WARC at a time across all extraction processes instead of one WARC
+    per process, keeps all cores busy when only a few WARCs match. The WARCs are downloaded (prefetched) first
+    :param metrics_interval_secs: interval of the crawl_metrics log line (throughput, latencies and ETA)
+    :param checkpoint_interval_records: records between two resume checkpoints within a WARC (streaming extractor)
+    :param work_queue: a WarcWorkQueue shared with other nodes: the WARCs to crawl are added to the queue, and only
+    the WARCs claimed from it are processed (the resume checkpoints are kept next to the queue)
+    :param fast_extraction_confidence: the streaming extractor extracts the records with an lxml fast path and only
+    hands the ones below this confidence to news-please, None always uses news-please
+    :param extraction_cache: an ExtractionCache, the streaming extractor does not extract html again that it
+    extracted before (hits and misses are part of the crawl metrics)
+    :param checkpoint_dates: the (start_date, end_date) the resume checkpoints belong to, defaults to start_date and
+    end_date. A default window ending now is left out (None), else its checkpoints would change with every run
+    :return: the names of the WARC files that are fully extracted (by this run or before), a WARC that failed is not
+    part of them
     """
     __setup(local_download_dir_warc, log_level)
 
     global __extern_callback_on_warc_completed
     __extern_callback_on_warc_completed = callback_on_warc_completed
 
-    cc_news_crawl_names = __get_remote_index(start_date, end_date)
+    if cc_news_index is None:
+        cc_news_index = CCNewsIndex(manifest_dir=local_download_dir_warc)
+    global __cc_base_url
+    __cc_base_url = cc_news_index.base_url
+
+    if warc_names is None:
+        cc_news_crawl_names = cc_news_index.get_names(start_date, end_date)
+    else:
+        cc_news_crawl_names = warc_names
     global __number_of_warc_files_on_cc
     __number_of_warc_files_on_cc = len(cc_news_crawl_names)
     __logger.info('found %i files at commoncrawl.org', __number_of_warc_files_on_cc)
 
+    # shared with the extraction processes through the pool initializer
+    metrics = crawl_metrics.CrawlMetrics(total_warcs=__number_of_warc_files_on_cc)
+    crawl_metrics.install(metrics)
+    extraction_cache_module.install(extraction_cache)
+
     # multiprocessing (iterate the list of crawl_names, and for each: download and process it)
     __logger.info('creating extraction process pool with %i processes', number_of_extraction_processes)
     warc_download_urls = []
-    fully_extracted_warc_urls = __get_list_of_fully_extracted_warc_urls()
+    # resume checkpoints only count for the same filters
+    checkpoint_dir = os.path.dirname(os.path.abspath(work_queue.path)) if work_queue else local_download_dir_warc
+    checkpoint_start_date, checkpoint_end_date = checkpoint_dates or (start_date, end_date)
+    checkpoint_store = CrawlCheckpoint(os.path.join(checkpoint_dir, 'crawl-checkpoints.sqlite'),
+                                       filter_fingerprint(valid_hosts, checkpoint_start_date, checkpoint_end_date,
+                                                          strict_date),
+                                       interval_records=checkpoint_interval_records)
+    if not continue_process:
+        checkpoint_store.clear()
+    else:
+        # the WARCs completed before the checkpoints existed are not extracted again
+        seeded = checkpoint_store.seed_completed(__get_list_of_fully_extracted_warc_urls())
+        if seeded:
+            __logger.info('seeded the checkpoints with %i WARCs of %s', seeded, __log_pathname_fully_extracted_warcs)
+    fully_extracted_warc_urls = checkpoint_store.completed_urls()
     for name in cc_news_crawl_names:
         warc_download_url = __get_download_url(name)
         if continue_process:
-            # check if the current WARC has already been fully extracted (assuming that the filter criteria have not
-            # been changed!)
+            # check if the current WARC has already been fully extracted with the same filter criteria
             if warc_download_url in fully_extracted_warc_urls:
                 __logger.info('skipping WARC because fully extracted: %s' % warc_download_url)
-                global __counter_warc_skipped
-                __counter_warc_skipped += 1
-                pass
+                metrics.inc("warc_skipped")
             else:
                 warc_download_urls.append(warc_download_url)
 
@@ -302,35 +368,72 @@ def crawl_from_commoncrawl(callback_on_article_extracted, callback_on_warc_compl
             # if not continue process, then always add
             warc_download_urls.append(warc_download_url)
 
-    # run the crawler in the current, single process if number of extraction processes is set to 1
-    if number_of_extraction_processes > 1:
-        with Pool(number_of_extraction_processes) as extraction_process_pool:
-            extraction_process_pool.map(partial(__start_commoncrawl_extractor,
-                                                callback_on_article_extracted=callback_on_article_extracted,
-                                                callback_on_warc_completed=__callback_on_warc_completed,
-                                                valid_hosts=valid_hosts,
-                                                start_date=start_date, end_date=end_date,
-                                                strict_date=strict_date,
-                                                reuse_previously_downloaded_files=reuse_previously_downloaded_files,
-                                                local_download_dir_warc=local_download_dir_warc,
-                                                continue_after_error=continue_after_error,
-                                                show_download_progress=show_download_progress,
-                                                log_level=log_level,
-                                                delete_warc_after_extraction=delete_warc_after_extraction,
-                                                log_pathname_fully_extracted_warcs=__log_pathname_fully_extracted_warcs),
-                                        warc_download_urls)
-    else:
-        for warc_download_url in warc_download_urls:
-            __start_commoncrawl_extractor(warc_download_url,
-                                          callback_on_article_extracted=callback_on_article_extracted,
-                                          callback_on_warc_completed=__callback_on_warc_completed,
-                                          valid_hosts=valid_hosts,
-                                          start_date=start_date, end_date=end_date,
-                                          strict_date=strict_date,
-                                          reuse_previously_downloaded_files=reuse_previously_downloaded_files,
-                                          local_download_dir_warc=local_download_dir_warc,
-                                          continue_after_error=continue_after_error,
-                                          show_download_progress=show_download_progress,
-                                          log_level=log_level,
-                                          delete_warc_after_extraction=delete_warc_after_extraction,
-                                          log_pathname_fully_extracted_warcs=__log_pathname_fully_extracted_warcs)
+    extract = partial(__start_commoncrawl_extractor,
+                      callback_on_article_extracted=callback_on_article_extracted,
+                      callback_on_warc_completed=__callback_on_warc_completed,
+                      valid_hosts=valid_hosts,
+                      start_date=start_date, end_date=end_date,
+                      strict_date=strict_date,
+                      reuse_previously_downloaded_files=reuse_previously_downloaded_files,
+                      local_download_dir_warc=local_download_dir_warc,
+                      continue_after_error=continue_after_error,
+                      show_download_progress=show_download_progress,
+                      log_level=log_level,
+                      delete_warc_after_extraction=delete_warc_after_extraction,
+                      log_pathname_fully_extracted_warcs=__log_pathname_fully_extracted_warcs,
+                      stream_warcs=stream_warcs,
+                      checkpoint_store=checkpoint_store,
+                      work_queue=work_queue,
+                      fast_extraction_confidence=fast_extraction_confidence)
+
+    split_warcs = split_warcs and number_of_extraction_processes > 1
+    prefetch = split_warcs or (prefetch_warcs > 0 and not stream_warcs)
+    extraction_pool = partial(__extraction_pool, number_of_extraction_processes, metrics, extraction_cache)
+    if work_queue is not None:
+        # every node adds the same WARCs, then they share the work through claims: a lease for every WARC in the
+        # pipeline (downloaded ahead or being extracted)
+        __logger.info('added %i WARCs to the work queue %s', work_queue.enqueue(warc_download_urls), work_queue.path)
+        extraction_slots = 1 if split_warcs else number_of_extraction_processes
+        warc_download_urls = work_queue.iter_claims(
+            max_held=extraction_slots + (max(1, prefetch_warcs) if prefetch else 0))
+
+    reporter = crawl_metrics.MetricsReporter(metrics, interval_secs=metrics_interval_secs)
+    reporter.start()
+    try:
+        if prefetch:
+            # two stage pipeline: a background download stage prefetches the next WARCs while they are extracted
+            prefetcher = WarcPrefetcher(local_download_dir_warc, prefetch_count=max(1, prefetch_warcs),
+                                        disk_budget_bytes=warc_disk_budget_bytes,
+                                        reuse_previously_downloaded_files=reuse_previously_downloaded_files,
+                                        delete_after_release=delete_warc_after_extraction,
+                                        extraction_slots=1 if split_warcs else number_of_extraction_processes,
+                                        on_download_failed=work_queue.release if work_queue else None)
+            downloaded = prefetcher.iter_downloaded(warc_download_urls)
+            extract_downloaded = partial(__extract_downloaded, extract=extract)
+            if split_warcs:
+                # one WARC at a time, its record ranges are fanned out across the pool
+                with extraction_pool() as record_pool:
+                    extract_downloaded = partial(__extract_downloaded, extract=partial(extract, record_pool=record_pool))
+                    for _, local_path in map(extract_downloaded, downloaded):
+                        prefetcher.release(local_path)
+            elif number_of_extraction_processes > 1:
+                with extraction_pool() as extraction_process_pool:
+                    for _, local_path in extraction_process_pool.imap_unordered(extract_downloaded, downloaded):
+                        prefetcher.release(local_path)
+            else:
+                for _, local_path in map(extract_downloaded, downloaded):
+                    prefetcher.release(local_path)
+        # run the crawler in the current, single process if number of extraction processes is set to 1
+        elif number_of_extraction_processes > 1:
+            with extraction_pool() as extraction_process_pool:
+                # lazily, claims from the work queue are only made as the workers get free
+                for _ in extraction_process_pool.imap_unordered(extract, warc_download_urls):
+                    pass
+        else:
+            for warc_download_url in warc_download_urls:
+                extract(warc_download_url)
+    finally:
+        reporter.stop()
+
+    fully_extracted_warc_urls = checkpoint_store.completed_urls()
+    return [name for name in cc_news_crawl_names if __get_download_url(name) in fully_extracted_warc_urls]
@@ -0,0 +1,375 @@
+#!/usr/bin/env python
+"""
+Streaming counterpart of news-please's CommonCrawlExtractor: the WARC records are decompressed and extracted straight
+from the HTTP response (or a local file / file:// url), nothing is written to disk. Extraction starts on the first
+record instead of after a ~1GB download. Records are prefiltered on their WARC headers (host, crawl date, content type)
+before any HTML is parsed; the publishing date filter is the same as in CommonCrawlExtractor.
+A downloaded WARC can also be split into record ranges that are extracted in parallel by a process pool.
+Records are first extracted by the lxml fast path, news-please only extracts the ones it is not confident about.
+"""
+import copy
+import logging
+import sys
+import time
+from contextlib import contextmanager
+from functools import partial
+from urllib.parse import quote_plus, urlparse
+from urllib.request import url2pathname
+
+import requests
+from dateutil import parser
+from newsplease import NewsPlease
+from newsplease.NewsArticle import NewsArticle
+from warcio.archiveiterator import ArchiveIterator
+from warcio.limitreader import LimitReader
+
+from kgai_crawler.scripts import crawl_metrics
+from kgai_crawler.scripts.warc_prefilter import WarcPrefilter
+from kgai_crawler.scripts.warc_record_index import build_record_index, split_record_ranges
+from kgai_crawler.service import extraction_cache
+from kgai_crawler.service.article_extractor import LxmlArticleExtractor, ParsedArticle
+from kgai_crawler.service.http_transport import decode_html
+
+
+class _ReadOnlyStream(object):
+    """
+    hides seek/tell of a stream
+    """
+
+    def __init__(self, stream):
+        self.read = stream.read
+
+
+class StreamingCommonCrawlExtractor(object):
+    # read timeout between two chunks of the WARC stream
+    __read_timeout_secs = 120
+
+    def __init__(self):
+        self.__logger = logging.getLogger(__name__)
+        self.__warc_url = None
+        self.__prefilter = WarcPrefilter()
+        self.__filter_start_date = None
+        self.__filter_end_date = None
+        self.__filter_strict_date = True
+        self.__continue_after_error = True
+        self.__callback_on_article_extracted = None
+        self.__callback_on_warc_completed = None
+        self.__log_pathname_fully_extracted_warcs = None
+        self.__checkpoint_interval = 1000
+        self.__fast_extractor = LxmlArticleExtractor()
+        self.__fast_extraction_confidence = 0.7
+
+    @contextmanager
+    def _open_stream(self, warc_url: str, offset: int = 0):
+        """
+        opens the (gzipped) WARC as a binary stream: http(s) is streamed, file:// urls and paths are read locally
+        :param warc_url:
+        :param offset: where to start reading, a record boundary
+        :return:
+        """
+        scheme = urlparse(warc_url).scheme
+        if scheme in ("http", "https"):
+            headers = {"Range": "bytes={}-".format(offset)} if offset else None
+            with requests.get(warc_url, stream=True, headers=headers,
+                              timeout=(30, self.__read_timeout_secs)) as response:
+                response.raise_for_status()
+                if offset and response.status_code != 206:
+                    # the server ignored the range, skip to the offset
+                    remaining = offset
+                    while remaining > 0:
+                        chunk = response.raw.read(min(remaining, 1024 * 1024))
+                        if not chunk:
+                            break
+                        remaining -= len(chunk)
+                # the body is the raw .warc.gz, warcio takes care of the gzip members
+                yield response.raw
+        else:
+            path = url2pathname(urlparse(warc_url).path) if scheme == "file" else warc_url
+            with open(path, "rb") as stream:
+                stream.seek(offset)
+                yield stream
+
+    def __register_fully_extracted_warc_file(self, warc_url):
+        if self.__log_pathname_fully_extracted_warcs is not None:
+            with open(self.__log_pathname_fully_extracted_warcs, 'a') as log_file:
+                log_file.write(warc_url + '\n')
+
+    @staticmethod
+    def __get_publishing_date(article):
+        date_publish = getattr(article, 'date_publish', None)
+        if isinstance(date_publish, str):
+            return parser.parse(date_publish)
+        return date_publish
+
+    def _date_passes(self, article) -> bool:
+        if not (self.__filter_start_date or self.__filter_end_date):
+            return True
+        publishing_date = self.__get_publishing_date(article)
+        if not publishing_date:
+            return not self.__filter_strict_date
+        if self.__filter_start_date and publishing_date < self.__filter_start_date:
+            return False
+        if self.__filter_end_date and publishing_date > self.__filter_end_date:
+            return False
+        return True
+
+    @staticmethod
+    def _record_html(record) -> str:
+        """
+        decodes the payload of a response record like NewsPlease.from_warc does
+        :param record:
+        :return:
+        """
+        content_type = record.http_headers.get_header("Content-Type") if record.http_headers else None
+        return decode_html(record.raw_stream.read(), content_type)
+
+    @staticmethod
+    def _to_newsplease_article(parsed: ParsedArticle, download_date) -> NewsArticle:
+        """
+        the fast path result in the shape of a news-please article
+        :param parsed:
+        :param download_date: WARC-Date of the record
+        :return:
+        """
+        article = NewsArticle()
+        article.authors = parsed.authors
+        article.date_download = parser.parse(download_date) if download_date else None
+        article.date_modify = None
+        # news-please dates are naive, like the filter dates they are compared with
+        article.date_publish = parsed.publish_date.replace(tzinfo=None) if parsed.publish_date else None
+        article.description = parsed.description or None
+        article.filename = quote_plus(parsed.url) + ".json"
+        article.image_url = None
+        article.language = parsed.language
+        article.localpath = None
+        article.title = parsed.title or None
+        article.title_page = None
+        article.title_rss = None
+        article.source_domain = urlparse(parsed.url).hostname or None
+        article.maintext = parsed.text
+        article.url = parsed.url
+        return article
+
+    def _extract_html(self, html, url, download_date):
+        """
+        extracts the article with the fast path, news-please is used when its confidence is too low
+        :param html:
+        :param url:
+        :param download_date:
+        :return:
+        """
+        if self.__fast_extraction_confidence is not None:
+            parsed, confidence = self.__fast_extractor.extract(url, html)
+            if parsed is not None and confidence >= self.__fast_extraction_confidence:
+                crawl_metrics.inc("article_fast_extracted")
+                return self._to_newsplease_article(parsed, download_date)
+        return NewsPlease.from_html(html, url=url, download_date=download_date)
+
+    def _extract(self, record):
+        """
+        extracts the article of a record, html extracted before (e.g. a syndicated story) is taken from the
+        extraction cache of the process
+        :param record:
+        :return:
+        """
+        html = self._record_html(record)
+        if not html:
+            return None
+        url = record.rec_headers.get_header("WARC-Target-URI")
+        download_date = record.rec_headers.get_header("WARC-Date")
+        cache = extraction_cache.current()
+        if cache is None:
+            return self._extract_html(html, url, download_date)
+
+        key = cache.key(html, "news-please")
+        cached = cache.get(key)
+        if cached is not None:
+            crawl_metrics.inc("extraction_cache_hit")
+            # the cached article may come from another url (mirror) or crawl
+            article = copy.copy(cached)
+            article.url = url
+            article.filename = quote_plus(url) + ".json"
+            article.source_domain = urlparse(url).hostname or None
+            article.date_download = parser.parse(download_date) if download_date else None
+            return article
+        crawl_metrics.inc("extraction_cache_miss")
+        article = self._extract_html(html, url, download_date)
+        if article:
+            cache.put(key, article)
+        return article
+
+    def _process_record(self, record):
+        """
+        extracts a single response record
+        :param record:
+        :return: the article if it passed all filters, else None
+        """
+        if not self.__prefilter.accept(record):
+            return None
+        try:
+            with crawl_metrics.timed("extract"):
+                article = self._extract(record)
+        except UnicodeDecodeError:
+            return None
+        if not article or not self._date_passes(article):
+            return None
+        return article
+
+    def _process_stream(self, stream, base_offset=0, checkpoint=None):
+        """
+        extracts the response records of a WARC stream
+        :param stream: positioned at a record boundary
+        :param base_offset: offset of the stream start in the WARC file
+        :param checkpoint: invoked with the offset of the next record every checkpoint interval
+        :return: (passed, discarded, error, total) counters
+        """
+        counter_article_total = 0
+        counter_article_passed = 0
+        counter_article_discarded = 0
+        counter_article_error = 0
+        start_time = time.time()
+
+        # without tell() warcio counts the record offsets from the start of the stream
+        records = ArchiveIterator(_ReadOnlyStream(stream) if checkpoint else stream)
+        for record in records:
+            if record.rec_type != 'response':
+                continue
+            counter_article_total += 1
+            try:
+                article = self._process_record(record)
+            except Exception:
+                if not self.__continue_after_error:
+                    raise
+                self.__logger.error('Unexpected error: %s (%s)', *sys.exc_info()[0:2])
+                article = None
+                counter_article_error += 1
+            else:
+                if article is None:
+                    counter_article_discarded += 1
+
+            if article is not None:
+                counter_article_passed += 1
+                self.__logger.info('article pass (%s; %s; %s)', article.source_domain, article.date_publish,
+                                   article.title)
+                self.__callback_on_article_extracted(article)
+
+            if counter_article_total % 100 == 0:
+                self.__logger.info('pass = %i, discard = %i, error = %i, total = %i, %f s/article',
+                                   counter_article_passed, counter_article_discarded, counter_article_error,
+                                   counter_article_total, (time.time() - start_time) / counter_article_total)
+            if checkpoint and counter_article_total % self.__checkpoint_interval == 0:
+                checkpoint(base_offset + records.get_record_offset() + records.get_record_length())
+
+        # the extraction results of the stream reach the other processes before this worker is recycled
+        if extraction_cache.current() is not None:
+            extraction_cache.current().flush()
+        return counter_article_passed, counter_article_discarded, counter_article_error, counter_article_total
+
+    @property
+    def prefilter_counters(self):
+        return self.__prefilter.counters
+
+    def _configure(self, callback_on_article_extracted, valid_hosts=None, start_date=None, end_date=None,
+                   strict_date=True, continue_after_error=True, log_level=logging.ERROR,
+                   fast_extraction_confidence=0.7):
+        self.__prefilter = WarcPrefilter(valid_hosts=valid_hosts, start_date=start_date, strict_date=strict_date)
+        self.__filter_start_date = start_date
+        self.__filter_end_date = end_date
+        self.__filter_strict_date = strict_date
+        self.__continue_after_error = continue_after_error
+        self.__callback_on_article_extracted = callback_on_article_extracted
+        self.__fast_extraction_confidence = fast_extraction_confidence
+        self.__logger.setLevel(log_level)
+
+    def _process_in_parallel(self, warc_path, record_pool, records_per_range, settings):
+        """
+        splits a local WARC into record ranges and extracts them across the pool
+        :param warc_path:
+        :param record_pool: a multiprocessing pool
+        :param records_per_range: records passing the prefilter per task
+        :param settings: the arguments of _configure, for the workers
+        :return: the counters summed over all ranges
+        """
+        with open(warc_path, "rb") as stream:
+            index = build_record_index(stream, self.__prefilter)
+        record_ranges = split_record_ranges(index, records_per_range)
+        self.__logger.info('split %s into %i record ranges', warc_path, len(record_ranges))
+
+        counters = (0, 0, 0, 0)
+        worker = partial(_extract_record_range, warc_path=warc_path, settings=settings)
+        for range_counters in record_pool.imap_unordered(worker, record_ranges):
+            counters = tuple(total + count for total, count in zip(counters, range_counters))
+        return counters
+
+    def extract_from_commoncrawl(self, warc_download_url, callback_on_article_extracted,
+                                 callback_on_warc_completed=None, valid_hosts=None, start_date=None, end_date=None,
+                                 strict_date=True, continue_after_error=True, log_level=logging.ERROR,
+                                 log_pathname_fully_extracted_warcs=None, local_warc_path=None, record_pool=None,
+                                 records_per_range=50, checkpoint_store=None, fast_extraction_confidence=0.7, **_):
+        """
+        Streams one WARC and extracts its articles, takes the same arguments as CommonCrawlExtractor (download
+        related ones are ignored, nothing is downloaded)
+        :param warc_download_url:
+        :param callback_on_article_extracted:
+        :param callback_on_warc_completed:
+        :param valid_hosts:
+        :param start_date:
+        :param end_date:
+        :param strict_date:
+        :param continue_after_error:
+        :param log_level:
+        :param log_pathname_fully_extracted_warcs:
+        :param local_warc_path: an already downloaded copy of the WARC to read instead of the url
+        :param record_pool: a multiprocessing pool to extract the records of the local copy in parallel, the
+        completion callback is still invoked once with the counters of the whole WARC
+        :param records_per_range: records passing the prefilter per parallel task
+        :param checkpoint_store: a CrawlCheckpoint, the extraction resumes from the last record offset saved in it and
+        saves the offset every checkpoint interval (not in parallel mode, which only resumes whole WARCs)
+        :param fast_extraction_confidence: min confidence of the lxml fast path, below it the record is extracted by
+        news-please, None extracts every record with news-please
+        :return:
+        """
+        settings = {"callback_on_article_extracted": callback_on_article_extracted, "valid_hosts": valid_hosts,
+                    "start_date": start_date, "end_date": end_date, "strict_date": strict_date,
+                    "continue_after_error": continue_after_error, "log_level": log_level,
+                    "fast_extraction_confidence": fast_extraction_confidence}
+        self.__warc_url = warc_download_url
+        self._configure(**settings)
+        self.__callback_on_warc_completed = callback_on_warc_completed
+        self.__log_pathname_fully_extracted_warcs = log_pathname_fully_extracted_warcs
+
+        if record_pool is not None and local_warc_path:
+            counters = self._process_in_parallel(local_warc_path, record_pool, records_per_range, settings)
+        elif checkpoint_store is not None:
+            self.__checkpoint_interval = checkpoint_store.interval_records
+            offset = checkpoint_store.record_offset(warc_download_url)
+            self.__logger.info('streaming %s from offset %i', warc_download_url, offset)
+            with self._open_stream(local_warc_path or warc_download_url, offset=offset) as stream:
+                counters = self._process_stream(
+                    stream, base_offset=offset,
+                    checkpoint=partial(checkpoint_store.save_offset, warc_download_url))
+        else:
+            self.__logger.info('streaming %s', warc_download_url)
+            with self._open_stream(local_warc_path or warc_download_url) as stream:
+                counters = self._process_stream(stream)
+        self.__logger.info('prefilter counters for %s: %s', warc_download_url, dict(self.__prefilter.counters))
+
+        self.__register_fully_extracted_warc_file(warc_download_url)
+        if self.__callback_on_warc_completed:
+            self.__callback_on_warc_completed(warc_download_url, *counters)
+
+
+def _extract_record_range(record_range, warc_path, settings):
+    """
+    worker of the record level parallelism: extracts the records of one byte range of a local WARC
+    :param record_range: (offset, length), starting at a record boundary
+    :param warc_path:
+    :param settings: the arguments of StreamingCommonCrawlExtractor._configure
+    :return: (passed, discarded, error, total) of the range
+    """
+    extractor = StreamingCommonCrawlExtractor()
+    extractor._configure(**settings)
+    offset, length = record_range
+    with open(warc_path, "rb") as warc_file:
+        warc_file.seek(offset)
+        return extractor._process_stream(LimitReader(warc_file, length))
@@ -0,0 +1,123 @@
+#!/usr/bin/env python
+"""
+Resume checkpoints of a crawl: the completed WARC files and, for the WARC files in progress, the offset of the next
+record to extract. Every checkpoint belongs to a fingerprint of the filters it was made with, a run with other filters
+does not resume from it.
+"""
+import datetime
+import hashlib
+import json
+import os
+import sqlite3
+import time
+from typing import Iterable, Optional, Set
+
+
+def filter_fingerprint(valid_hosts: Optional[Iterable[str]], start_date: Optional[datetime.datetime],
+                       end_date: Optional[datetime.datetime], strict_date: bool) -> str:
+    """
+    fingerprint of the filters of a run. Only pass the dates configured explicitly, a default window moving with the
+    run date would give every run other checkpoints. The dates count by day
+    :param valid_hosts:
+    :param start_date:
+    :param end_date:
+    :param strict_date:
+    :return:
+    """
+    filters = {"valid_hosts": sorted(valid_hosts or []), "strict_date": strict_date,
+               "start_date": start_date.date().isoformat() if start_date else None,
+               "end_date": end_date.date().isoformat() if end_date else None}
+    return hashlib.sha256(json.dumps(filters, sort_keys=True).encode("utf-8")).hexdigest()[:16]
+
+
+class CrawlCheckpoint(object):
+    """
+    SQLite backed, usable from several processes (each opens its own connection, also after being pickled into a
+    pool worker)
+    """
+
+    def __init__(self, path: str, fingerprint: str, interval_records: int = 1000):
+        """
+        :param path: sqlite file of the checkpoints
+        :param fingerprint: of the filters of the run, see filter_fingerprint
+        :param interval_records: records extracted between two offset checkpoints of a WARC
+        """
+        self.path = path
+        self.fingerprint = fingerprint
+        self.interval_records = interval_records
+        self.__conn = None
+        self.__conn_pid = None
+
+    def __getstate__(self):
+        state = self.__dict__.copy()
+        state["_CrawlCheckpoint__conn"] = None
+        state["_CrawlCheckpoint__conn_pid"] = None
+        return state
+
+    def _conn(self) -> sqlite3.Connection:
+        # a connection must not be used across a fork
+        if self.__conn is None or self.__conn_pid != os.getpid():
+            self.__conn = sqlite3.connect(self.path, timeout=30)
+            self.__conn.execute("PRAGMA journal_mode=WAL")
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS checkpoints (warc_url TEXT NOT NULL, "
+                                "fingerprint TEXT NOT NULL, record_offset INTEGER NOT NULL, "
+                                "completed INTEGER NOT NULL, updated_at REAL NOT NULL, "
+                                "PRIMARY KEY (warc_url, fingerprint))")
+            self.__conn.commit()
+            self.__conn_pid = os.getpid()
+        return self.__conn
+
+    def __save(self, warc_url: str, record_offset: int, completed: bool):
+        conn = self._conn()
+        conn.execute("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)",
+                     (warc_url, self.fingerprint, record_offset, int(completed), time.time()))
+        conn.commit()
+
+    def completed_urls(self) -> Set[str]:
+        """
+        the WARC files fully extracted with the same filters
+        :return:
+        """
+        rows = self._conn().execute("SELECT warc_url FROM checkpoints WHERE fingerprint = ? AND completed = 1",
+                                    (self.fingerprint,))
+        return {row[0] for row in rows}
+
+    def record_offset(self, warc_url: str) -> int:
+        """
+        :param warc_url:
+        :return: offset of the first record not extracted yet, 0 if the WARC was not started with the same filters
+        """
+        row = self._conn().execute("SELECT record_offset FROM checkpoints WHERE warc_url = ? AND fingerprint = ? "
+                                   "AND completed = 0", (warc_url, self.fingerprint)).fetchone()
+        return row[0] if row else 0
+
+    def save_offset(self, warc_url: str, record_offset: int):
+        self.__save(warc_url, record_offset, completed=False)
+
+    def mark_completed(self, warc_url: str):
+        self.__save(warc_url, 0, completed=True)
+
+    def seed_completed(self, warc_urls: Iterable[str]) -> int:
+        """
+        marks the WARC files listed as fully extracted by the crawls made before the checkpoints existed (the legacy
+        fullyextractedwarcs.list) completed. Only a store without any checkpoint is seeded, the legacy list does not
+        tell the filters the WARC files were extracted with
+        :param warc_urls:
+        :return: number of WARC files seeded
+        """
+        conn = self._conn()
+        with conn:
+            if conn.execute("SELECT 1 FROM checkpoints LIMIT 1").fetchone() is not None:
+                return 0
+            rows = [(warc_url, self.fingerprint, 0, 1, time.time()) for warc_url in set(warc_urls)]
+            conn.executemany("INSERT OR REPLACE INTO checkpoints VALUES (?, ?, ?, ?, ?)", rows)
+        return len(rows)
+
+    def clear(self):
+        """
+        forgets the checkpoints of this fingerprint, for a run that does not continue the previous one
+        :return:
+        """
+        conn = self._conn()
+        conn.execute("DELETE FROM checkpoints WHERE fingerprint = ?", (self.fingerprint,))
+        conn.commit()
@@ -0,0 +1,187 @@
+#!/usr/bin/env python
+"""
+Crawl metrics shared by all extraction processes: counters and latency histograms live in one shared memory array
+created by the parent, the pool workers attach to it (pool initializer), so every process adds to the same totals.
+A reporter thread of the parent logs throughput and ETA as a periodic structured (json) log line.
+"""
+import json
+import logging
+import multiprocessing
+import threading
+import time
+from contextlib import contextmanager
+from typing import Dict, Optional
+
+COUNTERS = ("warc_processed", "warc_skipped", "warc_bytes_downloaded", "article_passed", "article_discarded",
+            "article_error", "article_total", "article_published", "article_fast_extracted",
+            "extraction_cache_hit", "extraction_cache_miss", "article_near_duplicate")
+# download: one WARC, extract: one record, warc: extraction of one whole WARC, publish: one article
+STAGES = ("download", "extract", "warc", "publish")
+# upper bounds of the latency buckets in seconds, the last bucket takes everything above
+BUCKETS = (0.001, 0.005, 0.01, 0.05, 0.1, 0.5, 1.0, 5.0, 30.0, 120.0, 600.0, float("inf"))
+
+# the metrics of this process, see install
+__metrics = None
+
+
+class CrawlMetrics(object):
+
+    def __init__(self, total_warcs: int = 0):
+        """
+        :param total_warcs: number of WARC files to crawl, for the ETA
+        """
+        self.total_warcs = total_warcs
+        self.start_time = time.time()
+        # per stage: the bucket counts, then the sum of the latencies and the number of observations
+        self.__stage_width = len(BUCKETS) + 2
+        self.__values = multiprocessing.Array('d', len(COUNTERS) + len(STAGES) * self.__stage_width)
+
+    def __stage_offset(self, stage: str) -> int:
+        return len(COUNTERS) + STAGES.index(stage) * self.__stage_width
+
+    def inc(self, counter: str, amount: float = 1):
+        with self.__values.get_lock():
+            self.__values[COUNTERS.index(counter)] += amount
+
+    def observe(self, stage: str, secs: float):
+        """
+        adds a latency observation to the histogram of the stage
+        :param stage:
+        :param secs:
+        :return:
+        """
+        offset = self.__stage_offset(stage)
+        bucket = next(i for i, upper_bound in enumerate(BUCKETS) if secs <= upper_bound)
+        with self.__values.get_lock():
+            self.__values[offset + bucket] += 1
+            self.__values[offset + len(BUCKETS)] += secs
+            self.__values[offset + len(BUCKETS) + 1] += 1
+
+    @contextmanager
+    def timed(self, stage: str):
+        started = time.time()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.time() - started)
+
+    @staticmethod
+    def _quantile(buckets, count: float, quantile: float) -> Optional[float]:
+        """
+        upper bound of the bucket holding the quantile
+        """
+        if not count:
+            return None
+        seen = 0
+        for upper_bound, bucket_count in zip(BUCKETS, buckets):
+            seen += bucket_count
+            if seen >= quantile * count:
+                return upper_bound
+        return BUCKETS[-1]
+
+    def snapshot(self) -> Dict:
+        """
+        consistent view of all counters and latencies, with the derived throughput and ETA (the pull interface)
+        :return:
+        """
+        with self.__values.get_lock():
+            values = list(self.__values)
+        counters = {name: int(values[i]) for i, name in enumerate(COUNTERS)}
+        latencies = {}
+        for stage in STAGES:
+            offset = self.__stage_offset(stage)
+            buckets = values[offset:offset + len(BUCKETS)]
+            total_secs, count = values[offset + len(BUCKETS)], values[offset + len(BUCKETS) + 1]
+            latencies[stage] = {"count": int(count), "mean_secs": total_secs / count if count else None,
+                                "p50_secs": self._quantile(buckets, count, 0.5),
+                                "p95_secs": self._quantile(buckets, count, 0.95)}
+
+        elapsed_secs = max(time.time() - self.start_time, 1e-6)
+        processed = counters["warc_processed"]
+        remaining_warcs = max(0, self.total_warcs - processed - counters["warc_skipped"])
+        h_per_warc = elapsed_secs / processed / 3600 if processed else None
+        cache_lookups = counters["extraction_cache_hit"] + counters["extraction_cache_miss"]
+        return {"counters": counters, "latencies": latencies, "elapsed_secs": elapsed_secs,
+                "articles_per_sec": counters["article_total"] / elapsed_secs,
+                "published_per_sec": counters["article_published"] / elapsed_secs,
+                "download_mb_per_sec": counters["warc_bytes_downloaded"] / elapsed_secs / 1024 / 1024,
+                "sec_per_article": elapsed_secs / counters["article_total"] if counters["article_total"] else None,
+                "extraction_cache_hit_rate":
+                    counters["extraction_cache_hit"] / cache_lookups if cache_lookups else None,
+                "h_per_warc": h_per_warc, "remaining_warcs": remaining_warcs,
+                "eta_h": remaining_warcs * h_per_warc if h_per_warc is not None else None}
+
+
+class MetricsReporter(object):
+    """
+    Logs a snapshot of the metrics as one json line every interval, from a daemon thread
+    """
+
+    def __init__(self, metrics: CrawlMetrics, interval_secs: float = 60):
+        self.__logger = logging.getLogger(__name__)
+        self.metrics = metrics
+        self.interval_secs = interval_secs
+        self.__stop = threading.Event()
+        self.__thread = None
+
+    def log(self):
+        self.__logger.info('crawl_metrics %s', json.dumps(self.metrics.snapshot(), sort_keys=True))
+
+    def __run(self):
+        while not self.__stop.wait(self.interval_secs):
+            self.log()
+
+    def start(self):
+        self.__stop.clear()
+        self.__thread = threading.Thread(target=self.__run, daemon=True)
+        self.__thread.start()
+
+    def stop(self):
+        """
+        stops the reporter and logs the final snapshot
+        :return:
+        """
+        self.__stop.set()
+        if self.__thread is not None:
+            self.__thread.join()
+            self.__thread = None
+        self.log()
+
+
+def install(metrics: Optional[CrawlMetrics]):
+    """
+    makes the metrics the ones of this process, used as pool initializer to attach the workers
+    :param metrics:
+    :return:
+    """
+    global __metrics
+    __metrics = metrics
+
+
+def current() -> Optional[CrawlMetrics]:
+    """
+    the metrics of this process, None outside of a crawl
+    :return:
+    """
+    return __metrics
+
+
+@contextmanager
+def timed(stage: str):
+    """
+    times a stage into the metrics of this process, if any
+    :param stage:
+    :return:
+    """
+    metrics = current()
+    if metrics is None:
+        yield
+    else:
+        with metrics.timed(stage):
+            yield
+
+
+def inc(counter: str, amount: float = 1):
+    metrics = current()
+    if metrics is not None:
+        metrics.inc(counter, amount)
@@ -0,0 +1,105 @@
+#!/usr/bin/env python
+"""
+Benchmarks the article extractors on a corpus of html files: documents per second of every extractor, and how well the
+fast path agrees with newspaper (title, text, publishing date, authors).
+usage: python -m kgai_crawler.scripts.extractor_benchmark <corpus dir> [repeat]
+"""
+import json
+import logging
+import os
+import sys
+import time
+from typing import Dict, List, Optional, Tuple
+
+from kgai_crawler.service.article_extractor import (ArticleExtractor, FallbackArticleExtractor, LxmlArticleExtractor,
+                                                    NewspaperArticleExtractor, ParsedArticle)
+
+
+def load_corpus(directory: str) -> List[Tuple[str, str]]:
+    """
+    reads the *.html files of the directory, the url of a document is made up from its file name
+    :param directory:
+    :return: (url, html) pairs
+    """
+    corpus = []
+    for name in sorted(os.listdir(directory)):
+        if name.endswith(".html"):
+            with open(os.path.join(directory, name), encoding="utf-8") as html_file:
+                corpus.append(("https://news.example.com/{}".format(name[:-len(".html")]), html_file.read()))
+    return corpus
+
+
+def run_extractor(extractor: ArticleExtractor, corpus: List[Tuple[str, str]], repeat: int = 1) \
+        -> Tuple[List[Tuple[Optional[ParsedArticle], float]], float]:
+    """
+    extracts the corpus repeat times
+    :param extractor:
+    :param corpus:
+    :param repeat:
+    :return: the results of the last round and the documents per second
+    """
+    started = time.perf_counter()
+    for _ in range(repeat):
+        results = [extractor.extract(url, html) for url, html in corpus]
+    return results, len(corpus) * repeat / max(time.perf_counter() - started, 1e-9)
+
+
+def _words(text: Optional[str]) -> set:
+    return set((text or "").lower().split())
+
+
+def agreement(candidate: Optional[ParsedArticle], reference: Optional[ParsedArticle]) -> Dict[str, float]:
+    """
+    compares an extraction with the reference one
+    :param candidate:
+    :param reference:
+    :return: title, date and authors match (0 or 1), text similarity (jaccard of the words)
+    """
+    if candidate is None or reference is None:
+        both = float(candidate is None and reference is None)
+        return {"title": both, "text": both, "date": both, "authors": both}
+    candidate_words, reference_words = _words(candidate.text), _words(reference.text)
+    union = candidate_words | reference_words
+    candidate_date = candidate.publish_date.date() if candidate.publish_date else None
+    reference_date = reference.publish_date.date() if reference.publish_date else None
+    return {"title": float(candidate.title.strip().lower() == reference.title.strip().lower()),
+            "text": len(candidate_words & reference_words) / len(union) if union else 1.0,
+            "date": float(candidate_date == reference_date),
+            "authors": float({a.lower() for a in candidate.authors} == {a.lower() for a in reference.authors})}
+
+
+def benchmark(corpus: List[Tuple[str, str]], repeat: int = 1, min_confidence: float = 0.7) -> Dict:
+    """
+    :param corpus: (url, html) pairs
+    :param repeat: rounds over the corpus, for a stable docs/sec on small corpora
+    :param min_confidence: of the fast path in the fallback extractor
+    :return: the report, per extractor: docs/sec and the mean agreement with newspaper
+    """
+    fallback = FallbackArticleExtractor(min_confidence=min_confidence)
+    extractors = [NewspaperArticleExtractor(), LxmlArticleExtractor(), fallback]
+    report = {"documents": len(corpus), "extractors": {}}
+    reference = None
+    for extractor in extractors:
+        results, docs_per_sec = run_extractor(extractor, corpus, repeat)
+        articles = [article for article, _ in results]
+        if reference is None:
+            reference = articles
+        scores = [agreement(article, expected) for article, expected in zip(articles, reference)]
+        report["extractors"][extractor.name] = {
+            "docs_per_sec": docs_per_sec,
+            "agreement": {field: sum(score[field] for score in scores) / len(scores) if scores else None
+                          for field in ("title", "text", "date", "authors")},
+            "mean_confidence": sum(confidence for _, confidence in results) / len(results) if results else None}
+    # the counters span all rounds
+    report["extractors"][fallback.name]["fast_path_share"] = \
+        fallback.counters[fallback.fast.name] / max(1, sum(fallback.counters.values()))
+    return report
+
+
+if __name__ == '__main__':
+    logging.basicConfig(level=logging.INFO)
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    print(json.dumps(benchmark(load_corpus(sys.argv[1]), repeat=int(sys.argv[2]) if len(sys.argv) > 2 else 1),
+                     indent=2, sort_keys=True))
@@ -0,0 +1,165 @@
+#!/usr/bin/env python
+"""
+Download stage of the WARC pipeline: prefetches the next WARC files in a background thread while the current ones are
+extracted, bounded by a number of files and a disk budget. Throughput becomes max(download, extract) instead of their
+sum.
+"""
+import logging
+import os
+import queue
+import threading
+import time
+from typing import Iterable, Iterator, Optional, Tuple
+from urllib.parse import quote_plus, urlparse
+from urllib.request import url2pathname
+
+import requests
+
+from kgai_crawler.scripts import crawl_metrics
+
+
+class WarcPrefetcher(object):
+    # marks the end of the download stage in the queue
+    __done = object()
+
+    def __init__(self, local_download_dir_warc: str, prefetch_count: int = 2, disk_budget_bytes: Optional[int] = None,
+                 reuse_previously_downloaded_files: bool = True, delete_after_release: bool = True,
+                 timeout_secs: float = 120, extraction_slots: int = 1, on_download_failed=None):
+        """
+        :param local_download_dir_warc: where the WARCs are downloaded to
+        :param prefetch_count: number of downloaded WARCs waiting for extraction at most
+        :param extraction_slots: number of WARCs extracted concurrently, they stay on disk until released
+        :param disk_budget_bytes: max bytes of WARCs on disk (downloaded or downloading), None is unbounded
+        :param reuse_previously_downloaded_files: use a WARC already in the download dir instead of downloading
+        :param delete_after_release: delete a downloaded WARC once it is released after its extraction
+        :param timeout_secs: connect/read timeout of the downloads
+        :param on_download_failed: invoked with the url of a WARC that could not be downloaded (and is skipped)
+        """
+        self.__logger = logging.getLogger(__name__)
+        self.local_download_dir_warc = local_download_dir_warc
+        self.prefetch_count = max(1, prefetch_count)
+        self.disk_budget_bytes = disk_budget_bytes
+        self.reuse_previously_downloaded_files = reuse_previously_downloaded_files
+        self.delete_after_release = delete_after_release
+        self.timeout_secs = timeout_secs
+        self.on_download_failed = on_download_failed
+        self.max_files_on_disk = self.prefetch_count + max(1, extraction_slots)
+        # bytes on disk per local path, and whether we own (may delete) the file
+        self.__reserved = {}
+        self.__budget = threading.Condition()
+        self.__stop = threading.Event()
+
+    def __used_bytes(self) -> int:
+        return sum(size for size, _ in self.__reserved.values())
+
+    def __reserve(self, local_path: str, size: int, owned: bool):
+        """
+        blocks until the file fits into the disk budget (a single file always fits when nothing else is on disk)
+        and the number of files on disk is below prefetch_count + extraction_slots
+        """
+        with self.__budget:
+            while self.__reserved and not self.__stop.is_set() and (
+                    len(self.__reserved) >= self.max_files_on_disk or
+                    (self.disk_budget_bytes is not None and
+                     self.__used_bytes() + size > self.disk_budget_bytes)):
+                self.__budget.wait(timeout=1.0)
+            self.__reserved[local_path] = (size, owned)
+
+    def release(self, local_path: str):
+        """
+        called once a WARC is extracted: frees its disk budget and deletes it if it was downloaded by the prefetcher
+        :param local_path:
+        :return:
+        """
+        with self.__budget:
+            _, owned = self.__reserved.pop(local_path, (0, False))
+            self.__budget.notify_all()
+        if owned and self.delete_after_release and os.path.isfile(local_path):
+            os.remove(local_path)
+
+    def _download(self, warc_download_url: str) -> str:
+        """
+        downloads one WARC (via a .part file, so a crash never leaves a truncated WARC behind)
+        :param warc_download_url:
+        :return: the local path
+        """
+        parsed_url = urlparse(warc_download_url)
+        if parsed_url.scheme == "file":
+            # a local mirror, nothing to download and nothing we may delete
+            local_path = url2pathname(parsed_url.path)
+            self.__reserve(local_path, 0, owned=False)
+            return local_path
+
+        local_path = os.path.join(self.local_download_dir_warc, quote_plus(parsed_url.path.lstrip("/")))
+        if self.reuse_previously_downloaded_files and os.path.isfile(local_path):
+            self.__logger.info('found local file %s, not downloading again', local_path)
+            self.__reserve(local_path, os.path.getsize(local_path), owned=True)
+            return local_path
+
+        with requests.get(warc_download_url, stream=True, timeout=(30, self.timeout_secs)) as response:
+            response.raise_for_status()
+            self.__reserve(local_path, int(response.headers.get("Content-Length", 0)), owned=True)
+            # time the transfer only, not the wait for disk budget
+            started = time.time()
+            self.__logger.info('downloading %s (local: %s)', warc_download_url, local_path)
+            try:
+                with open(local_path + ".part", "wb") as local_file:
+                    for chunk in response.iter_content(chunk_size=1024 * 1024):
+                        if self.__stop.is_set():
+                            raise InterruptedError("prefetch stopped")
+                        local_file.write(chunk)
+            except BaseException:
+                if os.path.isfile(local_path + ".part"):
+                    os.remove(local_path + ".part")
+                self.release(local_path)
+                raise
+        os.replace(local_path + ".part", local_path)
+        crawl_metrics.inc("warc_bytes_downloaded", os.path.getsize(local_path))
+        metrics = crawl_metrics.current()
+        if metrics is not None:
+            metrics.observe("download", time.time() - started)
+        return local_path
+
+    def __run(self, warc_download_urls: Iterable[str], downloaded: queue.Queue):
+        try:
+            for warc_download_url in warc_download_urls:
+                if self.__stop.is_set():
+                    break
+                try:
+                    local_path = self._download(warc_download_url)
+                except Exception as err:
+                    self.__logger.error('could not download %s: %s', warc_download_url, err)
+                    if self.on_download_failed:
+                        self.on_download_failed(warc_download_url)
+                    continue
+                while not self.__stop.is_set():
+                    try:
+                        downloaded.put((warc_download_url, local_path), timeout=1.0)
+                        break
+                    except queue.Full:
+                        continue
+        finally:
+            if not self.__stop.is_set():
+                downloaded.put(self.__done)
+
+    def iter_downloaded(self, warc_download_urls: Iterable[str]) -> Iterator[Tuple[str, str]]:
+        """
+        downloads the WARCs in the background and yields (warc_download_url, local_path) as they are ready.
+        Every yielded path has to be released once it is extracted
+        :param warc_download_urls:
+        :return:
+        """
+        downloaded = queue.Queue(maxsize=self.prefetch_count)
+        self.__stop.clear()
+        downloader = threading.Thread(target=self.__run, args=(warc_download_urls, downloaded), daemon=True)
+        downloader.start()
+        try:
+            while True:
+                item = downloaded.get()
+                if item is self.__done:
+                    break
+                yield item
+        finally:
+            self.__stop.set()
+            with self.__budget:
+                self.__budget.notify_all()
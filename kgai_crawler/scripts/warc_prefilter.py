@@ -0,0 +1,112 @@
+"""
+Cheap prefilters on the headers of WARC records, run before any HTML of a record is parsed
+"""
+import datetime
+from collections import Counter
+from typing import Iterable, Optional
+
+from dateutil import parser
+
+from kgai_crawler.utils.url_utils import get_host
+
+HTML_CONTENT_TYPES = ("text/html", "application/xhtml+xml")
+
+
+class HostSuffixMatcher(object):
+    """
+    Matches a host against a set of hosts, sub domains included ("www.bbc.co.uk" matches "bbc.co.uk").
+    A lookup costs one set probe per label of the host, independent of the number of valid hosts
+    """
+
+    def __init__(self, hosts: Iterable[str]):
+        self.hosts = {host.lower().strip(".") for host in hosts if host}
+
+    def __bool__(self):
+        return bool(self.hosts)
+
+    def matches(self, host: str) -> bool:
+        labels = host.lower().split(".")
+        return any(".".join(labels[i:]) in self.hosts for i in range(len(labels)))
+
+
+class WarcPrefilter(object):
+    """
+    Rejects response records from their headers alone: target host, crawl date and content type.
+    Counts the passed records and the rejects per filter
+    """
+
+    def __init__(self, valid_hosts: Iterable[str] = None, start_date: datetime.datetime = None,
+                 max_crawl_date: datetime.datetime = None, content_types: Optional[Iterable[str]] = HTML_CONTENT_TYPES,
+                 strict_date: bool = True):
+        """
+        Args:
+            valid_hosts: hosts (and their sub domains) to keep, None or empty keeps all
+            start_date: an article cannot be published after it was crawled, so records crawled before the start
+                        date are rejected. Naive dates are taken as UTC
+            max_crawl_date: records crawled after this date are rejected (opt in, articles can be crawled late)
+            content_types: http content types to keep, None keeps all
+            strict_date: the start date reject only applies in strict mode, like the date filter of the extractor
+                         it keeps articles without a publishing date (which can have been crawled at any time)
+        """
+        self.host_matcher = HostSuffixMatcher(valid_hosts or [])
+        self.start_date = self._naive_utc(start_date)
+        self.max_crawl_date = self._naive_utc(max_crawl_date)
+        self.content_types = tuple(content_types) if content_types else None
+        self.strict_date = strict_date
+        self.counters = Counter()
+
+    @staticmethod
+    def _naive_utc(date: Optional[datetime.datetime]) -> Optional[datetime.datetime]:
+        """
+        naive dates are taken as UTC, dates with an offset are converted to UTC
+        """
+        if date is not None and date.tzinfo is not None:
+            return date.astimezone(datetime.timezone.utc).replace(tzinfo=None)
+        return date
+
+    def _crawl_date(self, record) -> Optional[datetime.datetime]:
+        """
+        the WARC-Date of the record in naive UTC, None if it is missing or malformed
+        """
+        warc_date = record.rec_headers.get_header('WARC-Date')
+        if not warc_date:
+            return None
+        try:
+            return self._naive_utc(parser.isoparse(warc_date))
+        except (ValueError, OverflowError):
+            return None
+
+    def _reject(self, reason: str) -> bool:
+        self.counters["rejected_" + reason] += 1
+        return False
+
+    def accept(self, record) -> bool:
+        """
+        checks a warcio record against the filters
+        Args:
+            record:
+
+        Returns: True if the record should be extracted
+
+        """
+        if self.host_matcher:
+            if not self.host_matcher.matches(get_host(record.rec_headers.get_header('WARC-Target-URI') or '')):
+                return self._reject("host")
+
+        start_date = self.start_date if self.strict_date else None
+        if start_date or self.max_crawl_date:
+            # an undated record is left to the date filter of the extractor
+            crawl_date = self._crawl_date(record)
+            if crawl_date is not None:
+                if start_date and crawl_date < start_date:
+                    return self._reject("date")
+                if self.max_crawl_date and crawl_date > self.max_crawl_date:
+                    return self._reject("date")
+
+        if self.content_types and record.http_headers is not None:
+            content_type = (record.http_headers.get_header('Content-Type') or '').lower()
+            if content_type and not content_type.startswith(self.content_types):
+                return self._reject("content_type")
+
+        self.counters["passed"] += 1
+        return True
@@ -0,0 +1,53 @@
+#!/usr/bin/env python
+"""
+Record level parallelism within a single WARC file: a .warc.gz is a series of gzip members, one per record, so it can
+be split at member boundaries. One pass over the record headers builds an offset index of the members, which is then
+cut into contiguous ranges holding about the same number of records to extract.
+"""
+from typing import BinaryIO, List, Tuple
+
+from warcio.archiveiterator import ArchiveIterator
+
+from kgai_crawler.scripts.warc_prefilter import WarcPrefilter
+
+
+def build_record_index(stream: BinaryIO, prefilter: WarcPrefilter = None) -> List[Tuple[int, int, bool]]:
+    """
+    indexes the response records of a WARC, payloads are skipped without being parsed
+    :param stream: the (gzipped) WARC, positioned at its start
+    :param prefilter: marks the records passing the header prefilter, None marks all records as passing
+    :return: (offset, length, passes prefilter) of every response record, in file order
+    """
+    index = []
+    records = ArchiveIterator(stream)
+    for record in records:
+        if record.rec_type != 'response':
+            continue
+        passes = prefilter is None or prefilter.accept(record)
+        index.append((records.get_record_offset(), records.get_record_length(), passes))
+    return index
+
+
+def split_record_ranges(index: List[Tuple[int, int, bool]], records_per_range: int = 50) -> List[Tuple[int, int]]:
+    """
+    cuts the index into contiguous byte ranges with records_per_range records passing the prefilter each, so the
+    ranges cost about the same to extract (rejected records are cheap and ride along)
+    :param index: as built by build_record_index
+    :param records_per_range:
+    :return: (offset, length) of each range
+    """
+    ranges = []
+    start = end = None
+    passing = 0
+    for offset, length, passes in index:
+        if start is None:
+            start = offset
+        end = offset + length
+        passing += passes
+        if passing >= records_per_range:
+            ranges.append((start, end - start))
+            start = None
+            passing = 0
+    if start is not None:
+        ranges.append((start, end - start))
+    return ranges
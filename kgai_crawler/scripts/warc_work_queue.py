@@ -0,0 +1,220 @@
+#!/usr/bin/env python
+"""
+Work queue of WARC files shared by several crawler nodes (SQLite on a shared volume). Every node feeds the same
+manifest into the queue (idempotent), then claims WARCs one by one with a lease. The leases of the claimed WARCs are
+renewed in the background while they are downloaded and extracted, the lease of a crashed node expires and its WARCs
+are claimed again by the other nodes.
+"""
+import logging
+import os
+import socket
+import sqlite3
+import threading
+import time
+import uuid
+from typing import Dict, Iterable, Iterator, Optional
+
+QUEUED = "queued"
+LEASED = "leased"
+DONE = "done"
+
+
+class WarcWorkQueue(object):
+
+    def __init__(self, path: str, worker_id: str = None, lease_secs: float = 600, max_attempts: int = 3,
+                 poll_secs: float = 5):
+        """
+        :param path: sqlite file of the queue, on a volume shared by all nodes
+        :param worker_id: identifies the leases of this node, defaults to host, pid and a random suffix
+        :param lease_secs: a claim not renewed within this time is given to another node
+        :param max_attempts: claims of a WARC before it is given up (a WARC that keeps failing)
+        :param poll_secs: wait between two checks while this node holds as many leases as it may
+        """
+        self.__logger = logging.getLogger(__name__)
+        self.path = path
+        self.worker_id = worker_id or "{}-{}-{}".format(socket.gethostname(), os.getpid(), uuid.uuid4().hex[:8])
+        self.lease_secs = lease_secs
+        self.max_attempts = max_attempts
+        self.poll_secs = poll_secs
+        self.__conn = None
+        self.__conn_pid = None
+        # the connection is shared with the lease renewing thread
+        self.__db_lock = threading.RLock()
+        # WARCs claimed by this node and not completed or released yet, renewed in the background
+        self.__held = set()
+        self.__held_lock = threading.Lock()
+
+    def __getstate__(self):
+        # pool workers get the queue to complete their WARCs, with their own connection
+        state = self.__dict__.copy()
+        state["_WarcWorkQueue__logger"] = None
+        state["_WarcWorkQueue__conn"] = None
+        state["_WarcWorkQueue__conn_pid"] = None
+        state["_WarcWorkQueue__held"] = set()
+        state["_WarcWorkQueue__held_lock"] = None
+        state["_WarcWorkQueue__db_lock"] = None
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self.__logger = logging.getLogger(__name__)
+        self.__held_lock = threading.Lock()
+        self.__db_lock = threading.RLock()
+
+    def _conn(self) -> sqlite3.Connection:
+        if self.__conn is None or self.__conn_pid != os.getpid():
+            # autocommit mode, claims run in explicit immediate transactions
+            self.__conn = sqlite3.connect(self.path, timeout=60, isolation_level=None, check_same_thread=False)
+            self.__conn.execute("PRAGMA journal_mode=WAL")
+            self.__conn.execute("CREATE TABLE IF NOT EXISTS warc_queue (warc_url TEXT PRIMARY KEY, "
+                                "state TEXT NOT NULL, owner TEXT, lease_expires REAL, "
+                                "attempts INTEGER NOT NULL DEFAULT 0, updated_at REAL NOT NULL)")
+            self.__conn_pid = os.getpid()
+        return self.__conn
+
+    def enqueue(self, warc_urls: Iterable[str]) -> int:
+        """
+        adds WARCs to the queue, the ones already known (queued, leased or done) are left as they are
+        :param warc_urls:
+        :return: number of WARCs added
+        """
+        now = time.time()
+        with self.__db_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                added = conn.executemany("INSERT OR IGNORE INTO warc_queue (warc_url, state, updated_at) "
+                                         "VALUES (?, ?, ?)", [(url, QUEUED, now) for url in warc_urls]).rowcount
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        return added
+
+    def claim(self) -> Optional[str]:
+        """
+        leases the next queued WARC, or one whose lease expired
+        :return: the WARC url, None if there is nothing to claim
+        """
+        now = time.time()
+        with self.__db_lock:
+            conn = self._conn()
+            conn.execute("BEGIN IMMEDIATE")
+            try:
+                row = conn.execute("SELECT warc_url FROM warc_queue WHERE attempts < ? AND (state = ? OR "
+                                   "(state = ? AND lease_expires < ?)) ORDER BY warc_url LIMIT 1",
+                                   (self.max_attempts, QUEUED, LEASED, now)).fetchone()
+                if row is not None:
+                    conn.execute("UPDATE warc_queue SET state = ?, owner = ?, lease_expires = ?, "
+                                 "attempts = attempts + 1, updated_at = ? WHERE warc_url = ?",
+                                 (LEASED, self.worker_id, now + self.lease_secs, now, row[0]))
+                conn.execute("COMMIT")
+            except Exception:
+                conn.execute("ROLLBACK")
+                raise
+        if row is None:
+            return None
+        with self.__held_lock:
+            self.__held.add(row[0])
+        return row[0]
+
+    def __update_own(self, warc_url: str, state: str, lease_expires: Optional[float]) -> bool:
+        with self.__db_lock:
+            cursor = self._conn().execute("UPDATE warc_queue SET state = ?, lease_expires = ?, updated_at = ? "
+                                          "WHERE warc_url = ? AND owner = ? AND state = ?",
+                                          (state, lease_expires, time.time(), warc_url, self.worker_id, LEASED))
+            return cursor.rowcount > 0
+
+    def renew(self, warc_url: str) -> bool:
+        """
+        extends the lease of a claimed WARC
+        :param warc_url:
+        :return: False if the lease is no longer held (completed, released or lost)
+        """
+        return self.__update_own(warc_url, LEASED, time.time() + self.lease_secs)
+
+    def complete(self, warc_url: str):
+        self.__update_own(warc_url, DONE, None)
+        self.__forget(warc_url)
+
+    def release(self, warc_url: str):
+        """
+        gives a claimed WARC back to the queue (e.g. after its download failed)
+        :param warc_url:
+        :return:
+        """
+        self.__update_own(warc_url, QUEUED, None)
+        self.__forget(warc_url)
+
+    def __forget(self, warc_url: str):
+        with self.__held_lock:
+            self.__held.discard(warc_url)
+
+    def __renew_held(self):
+        """
+        renews the leases held, forgets the ones completed or released by the pool workers
+        """
+        with self.__held_lock:
+            held = list(self.__held)
+        for warc_url in held:
+            if not self.renew(warc_url):
+                self.__forget(warc_url)
+
+    def __renew_while_held(self, exhausted: threading.Event):
+        """
+        renews the leases held until the claims are exhausted and every claimed WARC is completed or released, the
+        WARCs claimed last are still extracted after the last claim
+        :param exhausted: set once nothing more is claimed
+        :return:
+        """
+        while True:
+            time.sleep(self.lease_secs / 3)
+            with self.__held_lock:
+                if exhausted.is_set() and not self.__held:
+                    return
+            try:
+                self.__renew_held()
+            except sqlite3.Error as err:
+                self.__logger.error('could not renew the WARC leases: %s', err)
+
+    def iter_claims(self, max_held: int = 1, wait_for_peers: bool = True) -> Iterator[str]:
+        """
+        claims WARCs until the queue is drained, holding at most max_held leases at a time (the WARCs in the
+        pipeline), their leases are renewed in the background until they are completed or released, also after the
+        iterator is exhausted
+        :param max_held:
+        :param wait_for_peers: once nothing is left to claim, wait while other nodes hold leases, to take over the
+        WARCs of a node that dies
+        :return:
+        """
+        exhausted = threading.Event()
+        renewer = threading.Thread(target=self.__renew_while_held, args=(exhausted,), daemon=True)
+        renewer.start()
+        try:
+            while True:
+                while len(self.__held) >= max_held:
+                    time.sleep(self.poll_secs)
+                    self.__renew_held()
+                warc_url = self.claim()
+                if warc_url is not None:
+                    yield warc_url
+                elif wait_for_peers and self.__leased_by_peers():
+                    time.sleep(self.poll_secs)
+                else:
+                    return
+        finally:
+            exhausted.set()
+
+    def __leased_by_peers(self) -> int:
+        with self.__db_lock:
+            return self._conn().execute("SELECT COUNT(*) FROM warc_queue WHERE state = ? AND owner != ? AND "
+                                        "attempts < ?", (LEASED, self.worker_id, self.max_attempts)).fetchone()[0]
+
+    def counts(self) -> Dict[str, int]:
+        """
+        number of WARCs per state, over all nodes
+        :return:
+        """
+        with self.__db_lock:
+            rows = self._conn().execute("SELECT state, COUNT(*) FROM warc_queue GROUP BY state").fetchall()
+        return {state: count for state, count in rows}
@@ -0,0 +1,202 @@
+"""
+Append only archive of extracted articles: rolling segment files of gzip compressed json lines instead of one file per
+article. Every batch is written as one gzip member (a segment stays a valid .jsonl.gz), and a small index per segment
+maps the article hash to its member for lookups
+"""
+import gzip
+import json
+import os
+import re
+import threading
+from typing import Any, Callable, Dict, Iterator, List, Optional, Tuple
+
+from kgai_py_commons.logging.log import TRLogger
+
+SEGMENT_PATTERN = re.compile(r"^articles-(\d{6})\.jsonl\.gz$")
+
+
+def segment_name(number: int) -> str:
+    return "articles-{:06d}.jsonl.gz".format(number)
+
+
+def index_path(segment_path: str) -> str:
+    return segment_path[:-len(".jsonl.gz")] + ".idx"
+
+
+def list_segments(directory: str) -> List[str]:
+    """
+    paths of the segments of an archive, oldest first
+    Args:
+        directory:
+
+    Returns:
+
+    """
+    if not os.path.isdir(directory):
+        return []
+    return [os.path.join(directory, name) for name in sorted(os.listdir(directory)) if SEGMENT_PATTERN.match(name)]
+
+
+class ArticleArchive(object):
+    """
+    Writer of the archive, buffers articles and appends them a batch at a time. A new segment is started on every
+    open and once a segment exceeds its max size, so a crash can only lose the unflushed batch
+    """
+
+    def __init__(self, directory: str, batch_size: int = 500, segment_max_bytes: int = 256 * 1024 * 1024):
+        """
+        Args:
+            directory: where the segments and their indexes are written
+            batch_size: articles buffered before they are written (one gzip member per batch)
+            segment_max_bytes: size after which the next batch goes to a new segment
+        """
+        self.logger = TRLogger.instance().get_logger(__name__)
+        self.directory = directory
+        self.batch_size = batch_size
+        self.segment_max_bytes = segment_max_bytes
+        if not os.path.exists(directory):
+            os.makedirs(directory)
+        self._lock = threading.Lock()
+        self._batch = []
+        self._segment_number = max([int(SEGMENT_PATTERN.match(os.path.basename(path)).group(1))
+                                    for path in list_segments(directory)] + [0])
+        self._segment_file = None
+        self._index_file = None
+        self.archived = 0
+
+    def _roll(self):
+        self._close_segment()
+        self._segment_number += 1
+        path = os.path.join(self.directory, segment_name(self._segment_number))
+        self._segment_file = open(path, "ab")
+        self._index_file = open(index_path(path), "a", encoding="utf-8")
+        self.logger.info("Archiving articles to {}".format(path))
+
+    def _close_segment(self):
+        if self._segment_file is not None:
+            self._segment_file.close()
+            self._index_file.close()
+            self._segment_file = None
+            self._index_file = None
+
+    def append(self, key: str, article: Dict[str, Any]):
+        """
+        buffers an article, the batch is written once it is full
+        Args:
+            key: the article hash, as used for the kafka key
+            article: the attributes of the article, values that are not json are stored as strings
+
+        Returns:
+
+        """
+        line = json.dumps(article, default=str, ensure_ascii=False, separators=(",", ":"))
+        with self._lock:
+            self._batch.append((key, line))
+            if len(self._batch) >= self.batch_size:
+                self._write_batch()
+
+    def _write_batch(self):
+        if not self._batch:
+            return
+        if self._segment_file is None or self._segment_file.tell() >= self.segment_max_bytes:
+            self._roll()
+        member = gzip.compress("".join(line + "\n" for _, line in self._batch).encode("utf-8"))
+        offset = self._segment_file.tell()
+        self._segment_file.write(member)
+        self._segment_file.flush()
+        # the index is written after the data, it never points to a partially written member
+        self._index_file.write("".join("{}\t{}\t{}\t{}\n".format(key, offset, len(member), position)
+                                       for position, (key, _) in enumerate(self._batch)))
+        self._index_file.flush()
+        self.archived += len(self._batch)
+        self._batch = []
+
+    def flush(self):
+        """
+        writes the buffered articles
+        Returns:
+
+        """
+        with self._lock:
+            self._write_batch()
+
+    def close(self):
+        with self._lock:
+            self._write_batch()
+            self._close_segment()
+
+
+class ArticleArchiveReader(object):
+    """
+    Reads an archive: in write order (for replays) or by article hash
+    """
+
+    def __init__(self, directory: str):
+        self.directory = directory
+        self._lookup = None
+
+    @staticmethod
+    def _read_index(segment_path: str) -> Iterator[Tuple[str, int, int, int]]:
+        path = index_path(segment_path)
+        if not os.path.isfile(path):
+            return
+        with open(path, encoding="utf-8") as index_file:
+            for line in index_file:
+                fields = line.rstrip("\n").split("\t")
+                if len(fields) == 4:
+                    yield fields[0], int(fields[1]), int(fields[2]), int(fields[3])
+
+    @staticmethod
+    def _read_member(segment_file, offset: int, length: int) -> List[str]:
+        segment_file.seek(offset)
+        return gzip.decompress(segment_file.read(length)).decode("utf-8").splitlines()
+
+    def iter_articles(self) -> Iterator[Tuple[str, Dict[str, Any]]]:
+        """
+        yields (article hash, article) of all indexed articles, oldest first
+        Returns:
+
+        """
+        for segment_path in list_segments(self.directory):
+            with open(segment_path, "rb") as segment_file:
+                member, lines = None, []
+                for key, offset, length, position in self._read_index(segment_path):
+                    if member != offset:
+                        member, lines = offset, self._read_member(segment_file, offset, length)
+                    yield key, json.loads(lines[position])
+
+    def get(self, key: str) -> Optional[Dict[str, Any]]:
+        """
+        looks an article up by its hash, the indexes are loaded on the first lookup
+        Args:
+            key:
+
+        Returns: the article, None if it is not archived
+
+        """
+        if self._lookup is None:
+            self._lookup = {}
+            for segment_path in list_segments(self.directory):
+                for entry_key, offset, length, position in self._read_index(segment_path):
+                    self._lookup[entry_key] = (segment_path, offset, length, position)
+        entry = self._lookup.get(key)
+        if entry is None:
+            return None
+        segment_path, offset, length, position = entry
+        with open(segment_path, "rb") as segment_file:
+            return json.loads(self._read_member(segment_file, offset, length)[position])
+
+    def replay(self, callback: Callable[[str, Dict[str, Any]], None]) -> int:
+        """
+        hands every archived article to the callback (e.g. to publish it to kafka again)
+        Args:
+            callback: invoked with the article hash and the article
+
+        Returns: number of replayed articles
+
+        """
+        replayed = 0
+        for key, article in self.iter_articles():
+            callback(key, article)
+            replayed += 1
+        return replayed
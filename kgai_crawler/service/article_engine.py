@@ -0,0 +1,186 @@
+"""
+Downloads and parses articles in pools: threads for the network bound download, processes for the CPU bound parse
+"""
+import threading
+from concurrent.futures import Executor, ProcessPoolExecutor, ThreadPoolExecutor
+from typing import Iterable, Iterator, Optional, Tuple
+
+from kgai_py_commons.logging.log import TRLogger
+
+from kgai_crawler.service.article_extractor import ArticleExtractor, FallbackArticleExtractor, ParsedArticle
+from kgai_crawler.service.extraction_cache import CachingArticleExtractor, ExtractionCache
+from kgai_crawler.service.http_transport import HttpTransport
+from kgai_crawler.utils.concurrency_utils import HostThrottle, ordered_map
+
+# the extractor of a parse process, see _install_extractor
+_extractor = None
+
+
+def _install_extractor(extractor: ArticleExtractor):
+    """
+    initializer of the parse processes, the extractor (and its cache) is handed over once instead of with every task
+    Args:
+        extractor:
+
+    Returns:
+
+    """
+    global _extractor
+    _extractor = extractor
+
+
+def _parse_downloaded(downloaded: Tuple[str, str], extractor: ArticleExtractor = None) \
+        -> Tuple[str, Optional[ParsedArticle], Optional[str]]:
+    """
+    parses a (url, html) pair, errors are returned instead of raised so one article cannot break the pool
+    Args:
+        downloaded:
+        extractor: defaults to the one installed in the parse process
+
+    Returns:
+
+    """
+    url, html = downloaded
+    try:
+        return url, (extractor or _extractor).extract_article(url=url, html=html), None
+    except Exception as err:
+        return url, None, str(err)
+
+
+class ArticleEngine(object):
+    """
+    Pooled download and parse of newspaper articles
+    """
+
+    def __init__(self, download_workers: int = 1, parse_workers: int = 0, max_per_host: int = 2,
+                 extractor: ArticleExtractor = None, extraction_cache: ExtractionCache = None,
+                 transport: HttpTransport = None):
+        """
+        the pools are created lazily and shared by all concurrent scrape calls, so the sizes are global budgets
+        Args:
+            download_workers: number of threads downloading articles
+            parse_workers: number of processes parsing articles, 0 parses in the download threads
+            max_per_host: max concurrent downloads against a single domain
+            extractor: parses the html, defaults to the lxml fast path with newspaper as fallback
+            extraction_cache: results of already extracted html are taken from the cache
+            transport: the pooled http session the articles are downloaded with
+        """
+        self.logger = TRLogger.instance().get_logger(__name__)
+        self.download_workers = max(1, download_workers)
+        self.parse_workers = parse_workers
+        self.host_throttle = HostThrottle(max_per_host=max_per_host)
+        self.transport = transport or HttpTransport(pool_maxsize=max(10, max_per_host))
+        self.extractor = extractor or FallbackArticleExtractor()
+        if extraction_cache is not None:
+            self.extractor = CachingArticleExtractor(self.extractor, extraction_cache)
+        self._download_pool = None
+        self._parse_pool = None
+        self._pool_lock = threading.Lock()
+
+    def _pools(self) -> Tuple[Executor, Optional[Executor]]:
+        """
+        creates the download and parse pools on first use
+        Returns:
+
+        """
+        with self._pool_lock:
+            if self._download_pool is None:
+                self._download_pool = ThreadPoolExecutor(max_workers=self.download_workers)
+            if self._parse_pool is None and self.parse_workers > 0:
+                self._parse_pool = ProcessPoolExecutor(max_workers=self.parse_workers, initializer=_install_extractor,
+                                                       initargs=(self.extractor,))
+            return self._download_pool, self._parse_pool
+
+    def close(self):
+        """
+        shuts down the pools, the engine can be used again afterwards (pools are recreated)
+        Returns:
+
+        """
+        with self._pool_lock:
+            for pool in (self._download_pool, self._parse_pool):
+                if pool is not None:
+                    pool.shutdown(wait=True)
+            self._download_pool = self._parse_pool = None
+
+    def _download(self, url: str) -> Tuple[str, Optional[str]]:
+        """
+        downloads a single article politely, returns the url and html (None if download failed or the article did not
+        change since the last run, see HttpTransport.download_if_changed)
+        Args:
+            url:
+
+        Returns:
+
+        """
+        try:
+            with self.host_throttle.limit(url):
+                changed, html = self.transport.download_if_changed(url)
+        except Exception as err:
+            self.logger.error("Error while downloading article from: {}, error: {}".format(url, err))
+            return url, None
+
+        if not changed:
+            self.logger.debug("Skipping unchanged article from: {}".format(url))
+            return url, None
+        if not html:
+            self.logger.error("Could not download article from: {}".format(url))
+            return url, None
+        return url, html
+
+    def _download_parse(self, url: str) -> Tuple[str, Optional[ParsedArticle], Optional[str]]:
+        """
+        downloads and parses in the calling thread, used when no parse processes are configured
+        Args:
+            url:
+
+        Returns:
+
+        """
+        url, html = self._download(url)
+        if html is None:
+            return url, None, None
+        return _parse_downloaded((url, html), self.extractor)
+
+    def scrape(self, urls: Iterable[str]) -> Iterator[ParsedArticle]:
+        """
+        downloads and parses the article urls lazily, yields every article that could be parsed (in input order)
+        at most a bounded window of articles is in flight, independent of the number of urls
+        Args:
+            urls:
+
+        Returns:
+
+        """
+        download_pool, parse_pool = self._pools()
+        if parse_pool is not None:
+            downloaded = (item for item in
+                          ordered_map(download_pool, self._download, urls, window=self.download_workers * 2)
+                          if item[1] is not None)
+            results = ordered_map(parse_pool, _parse_downloaded, downloaded, window=self.parse_workers * 2)
+        else:
+            results = ordered_map(download_pool, self._download_parse, urls, window=self.download_workers * 2)
+
+        yield from self._successful(results)
+
+    def _successful(self, results: Iterable[Tuple[str, Optional[ParsedArticle], Optional[str]]]) \
+            -> Iterator[ParsedArticle]:
+        """
+        logs the failed results and passes on the parsed ones. The download validators of a parsed article stay staged
+        in the conditional cache: commit them once the article is delivered (else it would never be downloaded again),
+        the ones of a failed article are discarded
+        Args:
+            results:
+
+        Returns:
+
+        """
+        conditional_cache = self.transport.conditional_cache
+        for url, parsed, error in results:
+            if error:
+                self.logger.error("Error while parsing article from: {}, error: {}".format(url, error))
+            if parsed is not None:
+                yield parsed
+            elif conditional_cache is not None:
+                # an article that failed is downloaded again next run
+                conditional_cache.discard(url)
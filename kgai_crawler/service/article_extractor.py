@@ -0,0 +1,259 @@
+"""
+Article extractors: a lightweight lxml fast path for title, text, publish date and authors, and the newspaper library
+as fallback for the documents the fast path is not confident about
+"""
+import json
+from collections import Counter
+from dataclasses import dataclass
+from datetime import datetime
+from typing import Iterator, List, Optional, Tuple
+
+import lxml.html
+from dateutil import parser
+from newspaper import Article
+
+# schema.org types of a json-ld article
+ARTICLE_TYPES = {"Article", "NewsArticle", "ReportageNewsArticle", "AnalysisNewsArticle", "BlogPosting",
+                 "OpinionNewsArticle", "ReportageArticle"}
+BOILERPLATE_XPATH = "//script|//style|//noscript|//nav|//header|//footer|//aside|//form|//iframe|//svg"
+DATE_XPATHS = ("//meta[@property='article:published_time']/@content",
+               "//meta[@name='pubdate' or @name='publishdate' or @name='date' or @name='dc.date']/@content",
+               "//meta[@itemprop='datePublished']/@content",
+               "//*[@itemprop='datePublished']/@datetime",
+               "//time[@datetime]/@datetime")
+AUTHOR_XPATHS = ("//meta[@name='author']/@content",
+                 "//meta[@property='article:author']/@content",
+                 "//*[@itemprop='author']//*[@itemprop='name']//text()",
+                 "//a[@rel='author']//text()")
+
+
+@dataclass
+class ParsedArticle:
+    """
+    Plain (picklable) result of parsing an article, independent of the newspaper Article object
+    """
+    url: str
+    title: str
+    text: str
+    publish_date: Optional[datetime]
+    authors: List[str]
+    article_html: str
+    description: str = ""
+    language: Optional[str] = None
+
+
+def parse_article_html(url: str, html: str) -> ParsedArticle:
+    """
+    parses an already downloaded article with newspaper, module level so that it can run in a process pool
+    Args:
+        url:
+        html:
+
+    Returns:
+
+    """
+    article = Article(url)
+    article.download(input_html=html)
+    article.parse()
+    return ParsedArticle(url=article.url, title=article.title, text=article.text, publish_date=article.publish_date,
+                         authors=article.authors, article_html=article.article_html,
+                         description=article.meta_description, language=article.meta_lang or None)
+
+
+class ArticleExtractor(object):
+    """
+    Interface of the extractors
+    """
+    name = "base"
+
+    def extract(self, url: str, html: str) -> Tuple[Optional[ParsedArticle], float]:
+        """
+        Args:
+            url:
+            html:
+
+        Returns: the article (None if nothing could be extracted) and the confidence in it, between 0 and 1
+
+        """
+        raise NotImplementedError
+
+    def extract_article(self, url: str, html: str) -> Optional[ParsedArticle]:
+        return self.extract(url, html)[0]
+
+
+class NewspaperArticleExtractor(ArticleExtractor):
+    """
+    The newspaper library, slow but thorough
+    """
+    name = "newspaper"
+
+    def extract(self, url: str, html: str) -> Tuple[Optional[ParsedArticle], float]:
+        return parse_article_html(url, html), 1.0
+
+
+class LxmlArticleExtractor(ArticleExtractor):
+    """
+    Single pass over the lxml tree: json-ld and meta tags for title, date and authors, the text of the paragraphs
+    of the main content block (article / articleBody, else the element holding most paragraph text)
+    """
+    name = "lxml"
+
+    def __init__(self, min_text_chars: int = 500):
+        """
+        Args:
+            min_text_chars: texts shorter than this lower the confidence (teasers, index pages)
+        """
+        self.min_text_chars = min_text_chars
+
+    @staticmethod
+    def _json_ld_articles(doc) -> Iterator[dict]:
+        for script in doc.xpath("//script[@type='application/ld+json']/text()"):
+            try:
+                data = json.loads(script)
+            except ValueError:
+                continue
+            stack = data if isinstance(data, list) else [data]
+            while stack:
+                item = stack.pop(0)
+                if not isinstance(item, dict):
+                    continue
+                stack.extend(item.get("@graph", []))
+                types = item.get("@type")
+                types = set(types) if isinstance(types, list) else {types}
+                if types & ARTICLE_TYPES:
+                    yield item
+
+    @staticmethod
+    def _first(doc, *xpaths) -> str:
+        for xpath in xpaths:
+            for value in doc.xpath(xpath):
+                value = " ".join(str(value).split())
+                if value:
+                    return value
+        return ""
+
+    @staticmethod
+    def _parse_date(value) -> Optional[datetime]:
+        try:
+            return parser.parse(value) if value else None
+        except (ValueError, OverflowError):
+            return None
+
+    @staticmethod
+    def _json_ld_authors(item: dict) -> List[str]:
+        authors = item.get("author") or []
+        authors = authors if isinstance(authors, list) else [authors]
+        return [author.get("name", "") if isinstance(author, dict) else str(author) for author in authors]
+
+    def _authors(self, doc, json_ld: List[dict]) -> List[str]:
+        names = [name for item in json_ld for name in self._json_ld_authors(item)]
+        for xpath in AUTHOR_XPATHS:
+            names.extend(str(value) for value in doc.xpath(xpath))
+        authors = []
+        for name in names:
+            name = " ".join(name.split())
+            if name.lower().startswith("by "):
+                name = name[3:]
+            # article:author is often a profile url
+            if name and not name.startswith("http") and name not in authors:
+                authors.append(name)
+        return authors
+
+    @staticmethod
+    def _paragraphs(element) -> List[str]:
+        paragraphs = []
+        for paragraph in element.iter("p"):
+            text = " ".join(paragraph.text_content().split())
+            link_text = sum(len(link.text_content()) for link in paragraph.iter("a"))
+            # navigation, teaser and share blocks are mostly links
+            if text and link_text < len(text) / 2:
+                paragraphs.append(text)
+        return paragraphs
+
+    def _content(self, doc) -> Tuple[List[str], Optional[lxml.html.HtmlElement], bool]:
+        """
+        Returns: the paragraphs of the main content, the element holding them, and whether the block was marked up as
+                 the article
+
+        """
+        marked = doc.xpath("//*[@itemprop='articleBody']|//article")
+        if marked:
+            paragraphs, element = max(((self._paragraphs(element), element) for element in marked),
+                                      key=lambda candidate: sum(map(len, candidate[0])))
+            if paragraphs:
+                return paragraphs, element, True
+        text_per_parent = Counter()
+        for paragraph in doc.iter("p"):
+            parent = paragraph.getparent()
+            if parent is not None:
+                text_per_parent[parent] += len(paragraph.text_content())
+        if not text_per_parent:
+            return [], None, False
+        element = text_per_parent.most_common(1)[0][0]
+        return self._paragraphs(element), element, False
+
+    def extract(self, url: str, html: str) -> Tuple[Optional[ParsedArticle], float]:
+        if not html or not html.strip():
+            return None, 0.0
+        try:
+            doc = lxml.html.fromstring(html.encode("utf-8") if isinstance(html, str) else html)
+        except (ValueError, lxml.etree.ParserError):
+            return None, 0.0
+        json_ld = list(self._json_ld_articles(doc))
+
+        title = (self._first(doc, "//meta[@property='og:title']/@content") or
+                 next((" ".join(item["headline"].split()) for item in json_ld
+                       if isinstance(item.get("headline"), str)), "") or
+                 self._first(doc, "//h1//text()", "//title/text()"))
+        publish_date = self._parse_date(
+            next((item["datePublished"] for item in json_ld if isinstance(item.get("datePublished"), str)), None) or
+            self._first(doc, *DATE_XPATHS))
+        authors = self._authors(doc, json_ld)
+        description = self._first(doc, "//meta[@name='description']/@content",
+                                  "//meta[@property='og:description']/@content")
+        language = (doc.get("lang") or "").split("-")[0].lower() or None
+
+        for element in doc.xpath(BOILERPLATE_XPATH):
+            element.drop_tree()
+        paragraphs, content, marked = self._content(doc)
+        text = "\n\n".join(paragraphs)
+        if not text:
+            return None, 0.0
+        # like newspaper, the html of the main content (the boilerplate dropped)
+        article_html = lxml.html.tostring(content, encoding="unicode")
+
+        confidence = 0.5 * min(1.0, len(text) / self.min_text_chars)
+        confidence += 0.2 if title else 0.0
+        confidence += 0.2 if marked else 0.1
+        confidence += 0.1 if publish_date else 0.0
+        return ParsedArticle(url=url, title=title, text=text, publish_date=publish_date, authors=authors,
+                             article_html=article_html, description=description, language=language), min(1.0, confidence)
+
+
+class FallbackArticleExtractor(ArticleExtractor):
+    """
+    Runs the fast extractor and falls back to the thorough one when the fast one is not confident enough
+    """
+    name = "fallback"
+
+    def __init__(self, fast: ArticleExtractor = None, fallback: ArticleExtractor = None,
+                 min_confidence: float = 0.7):
+        """
+        Args:
+            fast: defaults to the lxml extractor
+            fallback: defaults to newspaper
+            min_confidence: below this confidence of the fast extractor the fallback is used
+        """
+        self.fast = fast or LxmlArticleExtractor()
+        self.fallback = fallback or NewspaperArticleExtractor()
+        self.min_confidence = min_confidence
+        # documents extracted by the fast path and by the fallback (per process)
+        self.counters = Counter()
+
+    def extract(self, url: str, html: str) -> Tuple[Optional[ParsedArticle], float]:
+        article, confidence = self.fast.extract(url, html)
+        if article is not None and confidence >= self.min_confidence:
+            self.counters[self.fast.name] += 1
+            return article, confidence
+        self.counters[self.fallback.name] += 1
+        return self.fallback.extract(url, html)
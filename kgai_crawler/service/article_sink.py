@@ -0,0 +1,96 @@
+"""
+Single writer sink for multiprocess extraction: extraction workers never touch the kafka producer or the article
+files, they serialize each article and hand it over a bounded queue to one consumer thread in the parent process
+"""
+import json
+import multiprocessing
+import threading
+from typing import Any, Callable, Dict
+
+from kgai_py_commons.logging.log import TRLogger
+
+
+class ArticleQueueWriter(object):
+    """
+    The picklable article callback given to the extraction workers
+    """
+
+    def __init__(self, queue):
+        self.queue = queue
+
+    def __call__(self, article):
+        """
+        serializes the article (its attributes, as json) and queues it, blocks while the queue is full
+        Args:
+            article: a news-please article
+
+        Returns:
+
+        """
+        self.queue.put(json.dumps(article.__dict__, default=str, ensure_ascii=False).encode("utf-8"))
+
+
+class ArticleSink(object):
+    """
+    Drains the articles queued by the workers into a handler, in a thread of the process that owns the producer
+    """
+
+    def __init__(self, handler: Callable[[Dict[str, Any]], None], max_queued_articles: int = 1000):
+        """
+        Args:
+            handler: invoked with the attributes of every article, only ever from the consumer thread
+            max_queued_articles: bound of the queue, the workers wait once the handler falls behind
+        """
+        self.logger = TRLogger.instance().get_logger(__name__)
+        self.handler = handler
+        self.max_queued_articles = max_queued_articles
+        self.handled = 0
+        self.failed = 0
+        self._manager = None
+        self._queue = None
+        self._consumer = None
+
+    def start(self) -> ArticleQueueWriter:
+        """
+        starts the queue and the consumer thread
+        Returns: the callback to pass to the workers
+
+        """
+        # a manager queue can be passed to pool workers as a task argument, a plain multiprocessing queue cannot
+        self._manager = multiprocessing.Manager()
+        self._queue = self._manager.Queue(maxsize=self.max_queued_articles)
+        self._consumer = threading.Thread(target=self._consume, daemon=True)
+        self._consumer.start()
+        return ArticleQueueWriter(self._queue)
+
+    def _consume(self):
+        while True:
+            payload = self._queue.get()
+            if payload is None:
+                return
+            try:
+                self.handler(json.loads(payload.decode("utf-8")))
+                self.handled += 1
+            except Exception as err:
+                self.failed += 1
+                self.logger.error("Failed to handle an extracted article, error: {}".format(err))
+
+    def close(self):
+        """
+        handles everything still queued, then stops the consumer
+        Returns:
+
+        """
+        if self._consumer is None:
+            return
+        self._queue.put(None)
+        self._consumer.join()
+        self._manager.shutdown()
+        self._consumer = None
+        self.logger.info("Article sink handled {} articles, {} failed".format(self.handled, self.failed))
+
+    def __enter__(self) -> ArticleQueueWriter:
+        return self.start()
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
@@ -0,0 +1,240 @@
+"""
+Cache of extraction results keyed by a hash of the raw html: syndicated wire stories and mirror pages are extracted
+once. A bounded LRU in memory, optionally backed by a SQLite tier on disk that outlives the process (and is shared by
+the extraction processes). Hits and misses are counted in shared memory, so the pool workers add to the same stats.
+The memory tier is not shared: every pool worker starts with an empty one, across processes only the disk tier helps
+"""
+import dataclasses
+import multiprocessing
+import os
+import pickle
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+import xxhash
+
+from kgai_crawler.service.article_extractor import ArticleExtractor, ParsedArticle
+
+STATS = ("memory_hits", "disk_hits", "misses", "evictions")
+
+# the cache of this process, see install
+_cache = None
+
+
+class ExtractionCache(object):
+
+    def __init__(self, max_entries: int = 10000, disk_path: str = None, disk_max_entries: int = 1000000,
+                 commit_every: int = 100, commit_interval_secs: float = 5):
+        """
+        Args:
+            max_entries: results kept in memory (per process, an extraction process starts with an empty memory tier),
+                         the least recently used ones are evicted
+            disk_path: sqlite file of the disk tier, None keeps the results in memory only
+            disk_max_entries: results kept on disk, the oldest ones are evicted
+            commit_every: puts written to disk in one transaction, the other processes see them once committed
+            commit_interval_secs: max time the puts of this process stay uncommitted (checked on put)
+        """
+        self.max_entries = max_entries
+        self.disk_path = disk_path
+        self.disk_max_entries = disk_max_entries
+        self.commit_every = commit_every
+        self.commit_interval_secs = commit_interval_secs
+        self._entries = OrderedDict()
+        self._stats = multiprocessing.Array('d', len(STATS))
+        self._disk_puts = 0
+        self._uncommitted = 0
+        self._committed_at = time.time()
+        # the lock and the connection belong to a process, see _lock
+        self._pid = os.getpid()
+        self._thread_lock = threading.Lock()
+        self._conn = None
+
+    def __getstate__(self):
+        # a worker process starts with an empty memory tier and its own connection
+        state = self.__dict__.copy()
+        state["_entries"] = OrderedDict()
+        state["_pid"] = None
+        state["_thread_lock"] = None
+        state["_conn"] = None
+        state["_uncommitted"] = 0
+        return state
+
+    def _lock(self) -> threading.Lock:
+        # a forked pool worker must neither inherit a lock held by another thread nor the connection
+        if self._pid != os.getpid():
+            self._thread_lock = threading.Lock()
+            self._conn = None
+            self._uncommitted = 0
+            self._pid = os.getpid()
+        return self._thread_lock
+
+    @staticmethod
+    def key(html: str, namespace: str = "") -> str:
+        """
+        Args:
+            html: the raw html
+            namespace: separates the results of different extractors on the same html
+
+        Returns:
+
+        """
+        return namespace + ":" + xxhash.xxh64(html.encode("utf-8", errors="replace")).hexdigest()
+
+    def _disk(self) -> Optional[sqlite3.Connection]:
+        """
+        the connection of the disk tier, caller holds the lock
+        """
+        if self.disk_path is None:
+            return None
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.disk_path, timeout=30, check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute("CREATE TABLE IF NOT EXISTS extraction_cache (cache_key TEXT PRIMARY KEY, "
+                               "value BLOB NOT NULL, stored_at REAL NOT NULL)")
+            self._conn.commit()
+        return self._conn
+
+    def _count(self, stat: str):
+        with self._stats.get_lock():
+            self._stats[STATS.index(stat)] += 1
+
+    def _remember(self, key: str, value: Any):
+        """
+        adds to the memory tier, caller holds the lock
+        """
+        self._entries[key] = value
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+            self._count("evictions")
+
+    def get(self, key: str) -> Optional[Any]:
+        """
+        Args:
+            key: see key
+
+        Returns: the cached result, None on a miss
+
+        """
+        with self._lock():
+            if key in self._entries:
+                self._entries.move_to_end(key)
+                self._count("memory_hits")
+                return self._entries[key]
+            disk = self._disk()
+            row = disk.execute("SELECT value FROM extraction_cache WHERE cache_key = ?", (key,)).fetchone() \
+                if disk is not None else None
+            if row is None:
+                self._count("misses")
+                return None
+            value = pickle.loads(row[0])
+            self._remember(key, value)
+            self._count("disk_hits")
+            return value
+
+    def put(self, key: str, value: Any):
+        with self._lock():
+            self._remember(key, value)
+            disk = self._disk()
+            if disk is None:
+                return
+            disk.execute("INSERT OR REPLACE INTO extraction_cache VALUES (?, ?, ?)",
+                         (key, pickle.dumps(value, protocol=pickle.HIGHEST_PROTOCOL), time.time()))
+            self._disk_puts += 1
+            # the size of the disk tier is checked every thousand puts of this process
+            if self._disk_puts % 1000 == 0:
+                disk.execute("DELETE FROM extraction_cache WHERE cache_key IN (SELECT cache_key FROM "
+                             "extraction_cache ORDER BY stored_at DESC LIMIT -1 OFFSET ?)", (self.disk_max_entries,))
+            # the puts are committed in batches, a worker process killed with the pool loses its last ones
+            self._uncommitted += 1
+            if self._uncommitted >= self.commit_every or time.time() - self._committed_at >= self.commit_interval_secs:
+                self._commit()
+
+    def _commit(self):
+        """
+        commits the puts to the disk tier, caller holds the lock
+        """
+        if self._conn is not None and self._uncommitted:
+            self._conn.commit()
+        self._uncommitted = 0
+        self._committed_at = time.time()
+
+    def flush(self):
+        """
+        commits the pending puts to the disk tier
+        """
+        with self._lock():
+            self._commit()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        hits, misses and evictions over all processes sharing the cache, with the hit rate
+        Returns:
+
+        """
+        with self._stats.get_lock():
+            stats = {name: int(value) for name, value in zip(STATS, self._stats)}
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = (stats["memory_hits"] + stats["disk_hits"]) / lookups if lookups else None
+        stats["memory_entries"] = len(self._entries)
+        return stats
+
+    def close(self):
+        with self._lock():
+            self._commit()
+            if self._conn is not None:
+                self._conn.close()
+            self._conn = None
+
+
+class CachingArticleExtractor(ArticleExtractor):
+    """
+    Looks the html up in the cache before handing it to the wrapped extractor
+    """
+
+    def __init__(self, extractor: ArticleExtractor, cache: ExtractionCache):
+        self.extractor = extractor
+        self.cache = cache
+        self.name = extractor.name
+
+    def extract(self, url: str, html: str) -> Tuple[Optional[ParsedArticle], float]:
+        if not html:
+            return self.extractor.extract(url, html)
+        key = self.cache.key(html, self.extractor.name)
+        cached = self.cache.get(key)
+        if cached is not None:
+            article, confidence = cached
+            # the same html can be served under several urls
+            return (dataclasses.replace(article, url=url, authors=list(article.authors))
+                    if article is not None else None), confidence
+        result = self.extractor.extract(url, html)
+        self.cache.put(key, result)
+        return result
+
+
+def install(cache: Optional[ExtractionCache]):
+    """
+    makes the cache the one of this process, used as pool initializer so that the workers share the stats and keep
+    their memory tier across tasks
+    Args:
+        cache:
+
+    Returns:
+
+    """
+    global _cache
+    _cache = cache
+
+
+def current() -> Optional[ExtractionCache]:
+    """
+    the cache of this process, None if extraction results are not cached
+    Returns:
+
+    """
+    return _cache
+
@@ -0,0 +1,128 @@
+"""
+Persistent validators (ETag, Last-Modified and a digest of the body) of the pages downloaded before, so that repeat
+sweeps download them conditionally and skip the ones that did not change
+"""
+import sqlite3
+import threading
+import time
+from typing import Dict, Optional, Tuple
+
+import xxhash
+
+
+class ConditionalCache(object):
+    """
+    SQLite backed validators per url with a time to live, safe to share between threads. The validators of a download
+    are staged and only committed once the page was handled (parsed), a page that failed is downloaded again
+    """
+
+    def __init__(self, path: str, ttl_days: Optional[float] = 30):
+        """
+        Args:
+            path: sqlite file of the cache (":memory:" for a throw away cache)
+            ttl_days: validators of pages not downloaded for longer are forgotten, None keeps them forever
+        """
+        self.path = path
+        self.ttl_secs = ttl_days * 24 * 3600 if ttl_days is not None else None
+        self._lock = threading.Lock()
+        self._pending: Dict[str, Tuple[Optional[str], Optional[str], str]] = {}
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS validators (url_hash TEXT PRIMARY KEY, etag TEXT, "
+                           "last_modified TEXT, digest TEXT NOT NULL, fetched_at REAL NOT NULL)")
+        self._conn.commit()
+        self.evict_expired()
+
+    @staticmethod
+    def _key(url: str) -> str:
+        # validators belong to the exact url, not to its canonical form
+        return xxhash.xxh64(url.encode("utf-8")).hexdigest()
+
+    @staticmethod
+    def digest(body: bytes) -> str:
+        return xxhash.xxh64(body).hexdigest()
+
+    def _validators(self, url: str) -> Optional[Tuple[Optional[str], Optional[str], str]]:
+        oldest_valid = time.time() - self.ttl_secs if self.ttl_secs is not None else 0.0
+        with self._lock:
+            return self._conn.execute("SELECT etag, last_modified, digest FROM validators WHERE url_hash = ? AND "
+                                      "fetched_at >= ?", (self._key(url), oldest_valid)).fetchone()
+
+    def conditional_headers(self, url: str) -> Dict[str, str]:
+        """
+        Args:
+            url:
+
+        Returns: the If-None-Match and If-Modified-Since headers of the last download of the url
+
+        """
+        validators = self._validators(url)
+        headers = {}
+        if validators and validators[0]:
+            headers["If-None-Match"] = validators[0]
+        if validators and validators[1]:
+            headers["If-Modified-Since"] = validators[1]
+        return headers
+
+    def is_unchanged(self, url: str, digest: str) -> bool:
+        """
+        for servers ignoring the conditional headers
+        Args:
+            url:
+            digest: of the body just downloaded
+
+        Returns: whether the body is the one of the last download
+
+        """
+        validators = self._validators(url)
+        return validators is not None and validators[2] == digest
+
+    def stage(self, url: str, etag: Optional[str], last_modified: Optional[str], digest: str):
+        """
+        keeps the validators of a download until it is committed or discarded
+        """
+        with self._lock:
+            self._pending[url] = (etag, last_modified, digest)
+
+    def commit(self, url: str):
+        """
+        stores the staged validators of the url, its next download is conditional
+        """
+        with self._lock:
+            validators = self._pending.pop(url, None)
+            if validators is None:
+                return
+            self._conn.execute("INSERT OR REPLACE INTO validators VALUES (?, ?, ?, ?, ?)",
+                               (self._key(url),) + validators + (time.time(),))
+            self._conn.commit()
+
+    def discard(self, url: str):
+        with self._lock:
+            self._pending.pop(url, None)
+
+    def refresh(self, url: str):
+        """
+        restarts the ttl of the validators of an unchanged url
+        """
+        with self._lock:
+            self._conn.execute("UPDATE validators SET fetched_at = ? WHERE url_hash = ?", (time.time(), self._key(url)))
+            self._conn.commit()
+
+    def evict_expired(self) -> int:
+        """
+        deletes the validators older than the ttl
+        Returns: the number of evicted urls
+
+        """
+        if self.ttl_secs is None:
+            return 0
+        with self._lock:
+            evicted = self._conn.execute("DELETE FROM validators WHERE fetched_at < ?",
+                                         (time.time() - self.ttl_secs,)).rowcount
+            self._conn.commit()
+        return evicted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
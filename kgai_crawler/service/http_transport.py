@@ -0,0 +1,289 @@
+"""
+The HTTP transport shared by the connectors: a requests session with keep-alive connection pools per host, a DNS
+cache, compressed responses (gzip, deflate and brotli/zstd when their packages are installed), timeouts and a bound
+on the size of a response. Connection reuse and time to first byte are counted to size the pools
+"""
+import socket
+import threading
+import time
+from collections import deque
+from typing import Any, Callable, Dict, Optional, Tuple
+
+import requests
+from bs4.dammit import EncodingDetector
+from newspaper import Config
+from requests.adapters import HTTPAdapter
+from urllib3.connection import HTTPConnection, HTTPSConnection
+from urllib3.connectionpool import HTTPConnectionPool, HTTPSConnectionPool
+from urllib3.util.request import ACCEPT_ENCODING
+
+from kgai_crawler.service.http_cache import ConditionalCache
+
+CHUNK_BYTES = 64 * 1024
+# time to first byte samples the percentiles are computed over
+TTFB_SAMPLES = 1000
+
+
+class ResponseTooLarge(IOError):
+    pass
+
+
+def decode_html(payload: bytes, content_type: Optional[str] = None) -> str:
+    """
+    decodes an html payload with the charset of the content type, else the one declared in the html, else utf-8
+    Args:
+        payload:
+        content_type: the Content-Type header
+
+    Returns:
+
+    """
+    encoding = None
+    if content_type and "charset=" in content_type:
+        encoding = content_type.split("charset=")[1].split(";")[0].strip().strip('"')
+    encoding = encoding or EncodingDetector.find_declared_encoding(payload, is_html=True) or "utf-8"
+    try:
+        return payload.decode(encoding, errors="replace")
+    except LookupError:
+        return payload.decode("utf-8", errors="replace")
+
+
+class DnsCache(object):
+    """
+    Addresses of the hosts resolved within the TTL
+    """
+
+    def __init__(self, ttl_secs: float = 300):
+        self.ttl_secs = ttl_secs
+        self._addresses: Dict[Tuple[str, int], Tuple[str, float]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def resolve(self, host: str, port: int) -> str:
+        """
+        Args:
+            host:
+            port:
+
+        Returns: the address of the host, from cache within the TTL
+
+        """
+        now = time.time()
+        with self._lock:
+            cached = self._addresses.get((host, port))
+            if cached is not None and cached[1] > now:
+                self.hits += 1
+                return cached[0]
+            self.misses += 1
+        address = socket.getaddrinfo(host, port, 0, socket.SOCK_STREAM)[0][4][0]
+        with self._lock:
+            self._addresses[(host, port)] = (address, now + self.ttl_secs)
+        return address
+
+    def forget(self, host: str, port: int):
+        """
+        drops the address of a host, e.g. after a connection to it failed
+        """
+        with self._lock:
+            self._addresses.pop((host, port), None)
+
+
+class _TransportConnectionMixin(object):
+    """
+    connects through the DNS cache of the transport and counts the new connections
+    """
+    transport = None
+
+    def _new_conn(self) -> socket.socket:
+        return self.transport.connect(self, super()._new_conn)
+
+
+class HttpTransport(object):
+    """
+    One session for all downloads, safe to share between the download threads
+    """
+
+    def __init__(self, pool_connections: int = 200, pool_maxsize: int = 10, connect_timeout_secs: float = 5,
+                 read_timeout_secs: float = 30, max_response_bytes: int = 10 * 1024 * 1024,
+                 dns_ttl_secs: float = 300, user_agent: str = None, conditional_cache: ConditionalCache = None):
+        """
+        Args:
+            pool_connections: hosts a connection pool is kept for, the least recently used pools are closed
+            pool_maxsize: keep-alive connections kept per host, should not be below the max concurrent requests of a
+                          host (see HostThrottle)
+            connect_timeout_secs:
+            read_timeout_secs: max time between two bytes of the response
+            max_response_bytes: bigger (decompressed) responses are abandoned
+            dns_ttl_secs: time a resolved address is reused, 0 resolves on every new connection
+            user_agent: defaults to the one newspaper downloads with
+            conditional_cache: validators of the pages downloaded before, see download_if_changed
+        """
+        self.timeout = (connect_timeout_secs, read_timeout_secs)
+        self.max_response_bytes = max_response_bytes
+        self.dns_cache = DnsCache(ttl_secs=dns_ttl_secs) if dns_ttl_secs > 0 else None
+        self.conditional_cache = conditional_cache
+        self._lock = threading.Lock()
+        self._ttfb_secs = deque(maxlen=TTFB_SAMPLES)
+        self._stats = {"requests": 0, "connections": 0, "errors": 0, "too_large": 0, "bytes": 0, "not_modified": 0,
+                       "unchanged": 0}
+
+        adapter = HTTPAdapter(pool_connections=pool_connections, pool_maxsize=pool_maxsize, max_retries=0)
+        adapter.poolmanager.pool_classes_by_scheme = {"http": self._pool_class(HTTPConnectionPool, HTTPConnection),
+                                                      "https": self._pool_class(HTTPSConnectionPool, HTTPSConnection)}
+        self.session = requests.Session()
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+        # ACCEPT_ENCODING holds the encodings urllib3 can decode with the installed packages
+        self.session.headers.update({"User-Agent": user_agent or Config().browser_user_agent,
+                                     "Accept-Encoding": ACCEPT_ENCODING})
+
+    def _pool_class(self, pool_class: type, connection_class: type) -> type:
+        connection = type(connection_class.__name__, (_TransportConnectionMixin, connection_class),
+                          {"transport": self})
+        return type(pool_class.__name__, (pool_class,), {"ConnectionCls": connection})
+
+    def connect(self, connection: HTTPConnection, new_conn: Callable[[], socket.socket]) -> socket.socket:
+        """
+        opens the socket of a new connection, the host is resolved through the DNS cache
+        Args:
+            connection: the urllib3 connection
+            new_conn: opens the socket
+
+        Returns:
+
+        """
+        self._count("connections")
+        if self.dns_cache is None:
+            return new_conn()
+        host = connection._dns_host
+        # only the address the socket connects to changes, TLS (SNI and the certificate) still uses the host name
+        connection._dns_host = self.dns_cache.resolve(host, connection.port)
+        try:
+            return new_conn()
+        except Exception:
+            self.dns_cache.forget(host, connection.port)
+            raise
+        finally:
+            connection._dns_host = host
+
+    def _count(self, stat: str, value: int = 1):
+        with self._lock:
+            self._stats[stat] += value
+
+    def get(self, url: str, **kwargs: Any) -> requests.Response:
+        """
+        a GET through the shared session, the response body is not bounded
+        Args:
+            url:
+            **kwargs: of requests
+
+        Returns:
+
+        """
+        kwargs.setdefault("timeout", self.timeout)
+        try:
+            response = self.session.get(url, **kwargs)
+        except requests.RequestException:
+            self._count("errors")
+            raise
+        with self._lock:
+            self._stats["requests"] += 1 + len(response.history)
+            # until the headers are parsed, the first byte of a streamed response
+            self._ttfb_secs.append(response.elapsed.total_seconds())
+        return response
+
+    def _too_large(self, response: requests.Response):
+        response.close()
+        self._count("too_large")
+        raise ResponseTooLarge("{} is larger than {} bytes".format(response.url, self.max_response_bytes))
+
+    def read(self, response: requests.Response) -> bytes:
+        """
+        reads the body of a streamed response, up to max_response_bytes
+        Args:
+            response:
+
+        Returns:
+
+        """
+        length = response.headers.get("Content-Length")
+        # the length of a compressed body says nothing about the decompressed one
+        if length and length.isdigit() and "Content-Encoding" not in response.headers and \
+                int(length) > self.max_response_bytes:
+            self._too_large(response)
+        chunks = []
+        size = 0
+        for chunk in response.iter_content(chunk_size=CHUNK_BYTES):
+            size += len(chunk)
+            if size > self.max_response_bytes:
+                self._too_large(response)
+            chunks.append(chunk)
+        self._count("bytes", size)
+        return b"".join(chunks)
+
+    def download_html(self, url: str) -> Optional[str]:
+        """
+        downloads a page
+        Args:
+            url:
+
+        Returns: the decoded html, None if the page did not answer with a 2XX
+
+        """
+        with self.get(url, stream=True) as response:
+            if not response.ok:
+                return None
+            return decode_html(self.read(response), response.headers.get("Content-Type"))
+
+    def download_if_changed(self, url: str) -> Tuple[bool, Optional[str]]:
+        """
+        downloads a page conditionally on the validators of its last download: a 304, or a body with the digest of
+        the last one, is unchanged. The validators of a changed page are staged in the conditional cache, commit them
+        once the page is handled
+        Args:
+            url:
+
+        Returns: whether the page changed (always without a conditional cache), the html of a changed page (None if
+                 it did not answer with a 2XX)
+
+        """
+        if self.conditional_cache is None:
+            return True, self.download_html(url)
+        with self.get(url, stream=True, headers=self.conditional_cache.conditional_headers(url)) as response:
+            if response.status_code == 304:
+                self.conditional_cache.refresh(url)
+                self._count("not_modified")
+                return False, None
+            if not response.ok:
+                return True, None
+            body = self.read(response)
+        digest = self.conditional_cache.digest(body)
+        if self.conditional_cache.is_unchanged(url, digest):
+            self.conditional_cache.refresh(url)
+            self._count("unchanged")
+            return False, None
+        self.conditional_cache.stage(url, response.headers.get("ETag"), response.headers.get("Last-Modified"), digest)
+        return True, decode_html(body, response.headers.get("Content-Type"))
+
+    def stats(self) -> Dict[str, Any]:
+        """
+        requests (redirects included), new connections, their reuse ratio, DNS cache hits, pages found unchanged
+        (not_modified by the server, unchanged by the digest) and the percentiles of the time to first byte of the
+        recent requests
+        Returns:
+
+        """
+        with self._lock:
+            stats = dict(self._stats)
+            ttfb = sorted(self._ttfb_secs)
+        stats["reuse_ratio"] = max(0.0, 1 - stats["connections"] / stats["requests"]) if stats["requests"] else None
+        if self.dns_cache is not None:
+            stats["dns_hits"], stats["dns_misses"] = self.dns_cache.hits, self.dns_cache.misses
+        for percentile in (50, 95):
+            stats["ttfb_p{}_ms".format(percentile)] = \
+                round(ttfb[min(len(ttfb) - 1, len(ttfb) * percentile // 100)] * 1000, 1) if ttfb else None
+        return stats
+
+    def close(self):
+        self.session.close()
@@ -0,0 +1,249 @@
+"""
+Publishing layer on top of the kafka producer: batching config, delivery tracking, backpressure and throughput stats
+"""
+import inspect
+import threading
+import time
+from functools import partial
+from typing import Any, Callable, Dict, List, Optional, Tuple
+
+from kgai_py_commons.logging.log import TRLogger
+
+
+def accepts_arg(func: Callable, name: str) -> bool:
+    """
+    Args:
+        func:
+        name:
+
+    Returns: whether func takes the keyword argument name (or any keyword argument)
+
+    """
+    try:
+        parameters = inspect.signature(func).parameters.values()
+    except (TypeError, ValueError):
+        return False
+    return any(parameter.name == name or parameter.kind == inspect.Parameter.VAR_KEYWORD for parameter in parameters)
+
+
+class KafkaPublisher(object):
+    """
+    Wraps a confluent-kafka style producer (produce with on_delivery, poll, flush and BufferError on a full local
+    queue), which is what TRAvroProducer builds on. The producer API is checked rather than assumed: a producer that
+    only has produce(topic, key, value), like the TRAvroProducer of the pinned kgai-py-commons, has no delivery
+    reports: its messages only count as delivered once a flush of the producer left nothing undelivered. Such a producer cannot send headers, publishing a message
+    with headers through it fails instead of dropping them
+    """
+
+    def __init__(self, producer: Any, queue_full_backoff_secs: float = 0.5, stats_interval_secs: float = 60.0,
+                 unreported_flush_every: int = 1000):
+        """
+        Args:
+            producer: the configured producer, see producer_config for the batching settings
+            queue_full_backoff_secs: time spent serving delivery reports before retrying on a full local queue
+            stats_interval_secs: interval of the throughput log line
+            unreported_flush_every: a producer without delivery reports is flushed every this many messages, which
+                                    then count as delivered
+        """
+        self.logger = TRLogger.instance().get_logger(__name__)
+        self.producer = producer
+        self._reports_delivery = accepts_arg(producer.produce, "on_delivery") and hasattr(producer, "poll")
+        self._takes_headers = accepts_arg(producer.produce, "headers")
+        if not self._reports_delivery:
+            self.logger.warning("The kafka producer has no delivery reports, messages count as delivered once flushed")
+        if not self._takes_headers:
+            self.logger.warning("The kafka producer cannot send headers, messages with headers are not published")
+        self.queue_full_backoff_secs = queue_full_backoff_secs
+        self.stats_interval_secs = stats_interval_secs
+        self.unreported_flush_every = unreported_flush_every
+        # delivery callbacks of the messages produced without a delivery report since the last flush
+        self._unflushed = []
+        self._lock = threading.Lock()
+        self.produced = 0
+        self.acked = 0
+        self.failed = 0
+        self._start_time = time.time()
+        self._last_stats_time = self._start_time
+
+    @staticmethod
+    def producer_config(linger_ms: int = 50, batch_size: int = 10000, compression: str = "lz4",
+                        queue_max_messages: int = 100000) -> Dict[str, Any]:
+        """
+        librdkafka settings for the producer wrapped by the publisher
+        Args:
+            linger_ms: time messages are held back to fill a batch
+            batch_size: max number of messages in a batch
+            compression: none, gzip, snappy, lz4 or zstd
+            queue_max_messages: size of the local queue, publish blocks once it is full
+
+        Returns:
+
+        """
+        return {"linger.ms": linger_ms, "batch.num.messages": batch_size, "compression.type": compression,
+                "queue.buffering.max.messages": queue_max_messages}
+
+    @property
+    def sends_headers(self) -> bool:
+        """
+        whether the producer can send kafka headers, publish raises for a message with headers otherwise
+        """
+        return self._takes_headers
+
+    @staticmethod
+    def build_producer(producer_class: type, config: Dict[str, Any], **kwargs: Any) -> Any:
+        """
+        builds a producer with the batching settings if its constructor takes a config, else with kwargs only
+        Args:
+            producer_class: e.g. TRAvroProducer
+            config: see producer_config
+            **kwargs: the arguments of the constructor
+
+        Returns:
+
+        """
+        if accepts_arg(producer_class.__init__, "config"):
+            return producer_class(config=config, **kwargs)
+        TRLogger.instance().get_logger(__name__).warning(
+            "{} takes no producer config, the batching settings are not applied".format(producer_class.__name__))
+        return producer_class(**kwargs)
+
+    def _on_delivery(self, err, msg, on_delivered: Callable[[], None] = None, on_failed: Callable[[], None] = None):
+        """
+        delivery report of a single message, served from poll/flush
+        Args:
+            err:
+            msg:
+            on_delivered: called once the message is delivered
+            on_failed: called if the message could not be delivered
+
+        Returns:
+
+        """
+        with self._lock:
+            if err is not None:
+                self.failed += 1
+            else:
+                self.acked += 1
+        if err is not None:
+            self.logger.error("Failed to deliver message to kafka, error: {}".format(err))
+            if on_failed is not None:
+                on_failed()
+        elif on_delivered is not None:
+            on_delivered()
+
+    def publish(self, topic: str, key: str, value: Any, headers: Optional[List[Tuple[str, bytes]]] = None,
+                on_delivered: Callable[[], None] = None, on_failed: Callable[[], None] = None):
+        """
+        queues a message, blocks while the local producer queue is full instead of dropping the message. A ValueError
+        is raised for headers the producer cannot send, see sends_headers
+        Args:
+            topic:
+            key:
+            value:
+            headers:
+            on_delivered: called from poll/flush once the broker acked the message, not for a failed delivery
+            on_failed: called from poll/flush if the message could not be delivered
+
+        Returns:
+
+        """
+        # headers are features of the message (e.g. its topics), they are never dropped
+        if headers and not self._takes_headers:
+            raise ValueError("The kafka producer {} cannot send the headers {} of a message to {}".format(
+                type(self.producer).__name__, [name for name, _ in headers], topic))
+        on_delivery = partial(self._on_delivery, on_delivered=on_delivered, on_failed=on_failed) \
+            if on_delivered or on_failed else self._on_delivery
+        if not self._reports_delivery:
+            self._produce_unreported(topic, key, value, on_delivery)
+            return
+        kwargs = {"headers": headers} if headers else {}
+        while True:
+            try:
+                self.producer.produce(topic=topic, key=key, value=value, on_delivery=on_delivery, **kwargs)
+                break
+            except BufferError:
+                self.logger.debug("Local kafka queue full, waiting for deliveries")
+                self.producer.poll(self.queue_full_backoff_secs)
+
+        with self._lock:
+            self.produced += 1
+        # serve delivery reports of earlier messages without blocking
+        self.producer.poll(0)
+        self._maybe_log_stats()
+
+    def _produce_unreported(self, topic: str, key: str, value: Any, on_delivery: Callable):
+        """
+        produces with a producer without delivery reports, the delivery of the message is reported by the next flush
+        """
+        try:
+            self.producer.produce(topic=topic, key=key, value=value)
+        except Exception as err:
+            with self._lock:
+                self.produced += 1
+            on_delivery(err, None)
+            return
+        with self._lock:
+            self.produced += 1
+            self._unflushed.append(on_delivery)
+            flush = len(self._unflushed) >= self.unreported_flush_every
+        if flush:
+            self.flush()
+        self._maybe_log_stats()
+
+    def stats(self) -> Dict[str, float]:
+        """
+        counters and throughput since the publisher was created
+        Returns:
+
+        """
+        with self._lock:
+            elapsed = max(time.time() - self._start_time, 1e-6)
+            return {"produced": self.produced, "acked": self.acked, "failed": self.failed,
+                    "pending": self.produced - self.acked - self.failed, "msgs_per_sec": self.produced / elapsed}
+
+    def _maybe_log_stats(self):
+        now = time.time()
+        if now - self._last_stats_time < self.stats_interval_secs:
+            return
+        self._last_stats_time = now
+        self.log_stats()
+
+    def log_stats(self):
+        stats = self.stats()
+        self.logger.info("kafka publisher produced: {}, acked: {}, failed: {}, pending: {}, msgs/sec: {:.2f}".format(
+            stats["produced"], stats["acked"], stats["failed"], stats["pending"], stats["msgs_per_sec"]))
+
+    def flush(self, timeout_secs: float = 30.0) -> int:
+        """
+        waits for all queued messages to be delivered
+        Args:
+            timeout_secs:
+
+        Returns: number of messages still undelivered after the timeout
+
+        """
+        if self._reports_delivery:
+            return self.producer.flush(timeout_secs)
+        # without delivery reports, an empty producer queue is the only ack: the messages produced since the last flush
+        # are all delivered, or none of them count as delivered
+        with self._lock:
+            unflushed, self._unflushed = self._unflushed, []
+        remaining = self.producer.flush(timeout_secs) if hasattr(self.producer, "flush") else len(unflushed)
+        err = "{} messages undelivered after the flush".format(remaining) if remaining else None
+        for on_delivery in unflushed:
+            on_delivery(err, None)
+        return remaining
+
+    def close(self, timeout_secs: float = 30.0):
+        """
+        flushes on shutdown and logs the final counters
+        Args:
+            timeout_secs:
+
+        Returns:
+
+        """
+        remaining = self.flush(timeout_secs=timeout_secs)
+        if remaining:
+            self.logger.error("{} messages were not delivered to kafka before shutdown".format(remaining))
+        self.log_stats()
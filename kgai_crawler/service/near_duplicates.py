@@ -0,0 +1,193 @@
+"""
+Near-duplicate detection of articles (the same story syndicated by many outlets, or scraped again with small changes):
+MinHash signatures over word shingles, looked up through LSH banding in a rolling time window
+"""
+import re
+import threading
+import time
+from array import array
+from collections import deque
+from typing import Dict, List, Optional, Tuple
+
+import xxhash
+
+WORD_PATTERN = re.compile(r"\w+")
+# signature values are the upper 32 bits of the shingle hash
+VALUE_SHIFT = 32
+EMPTY_BIN = 1 << 32
+
+# what happens to a near-duplicate before publish
+SUPPRESS = "suppress"
+CLUSTER = "cluster"
+OFF = "off"
+# kafka header of a clustered near-duplicate, holds the key of the first article of the cluster
+DUPLICATE_OF_HEADER = "near_duplicate_of"
+
+
+def shingle_hashes(text: str, shingle_size: int = 3) -> List[int]:
+    """
+    64 bit hashes of the distinct word shingles of a text
+    Args:
+        text:
+        shingle_size: words per shingle
+
+    Returns:
+
+    """
+    words = WORD_PATTERN.findall(text.lower())
+    return list({xxhash.xxh64_intdigest(" ".join(words[i:i + shingle_size]).encode("utf-8"))
+                 for i in range(len(words) - shingle_size + 1)})
+
+
+def minhash(hashes: List[int], num_perm: int = 64) -> array:
+    """
+    one permutation MinHash: a single hash per shingle, its low bits pick the bin and the min of the high bits is kept
+    per bin, so the signature costs one pass over the shingles instead of one per permutation. Empty bins take the
+    value of the next filled bin (densification), the signature of an empty text is all EMPTY_BIN
+    Args:
+        hashes: see shingle_hashes
+        num_perm: signature length, a power of two
+
+    Returns:
+
+    """
+    signature = [EMPTY_BIN] * num_perm
+    mask = num_perm - 1
+    for value in hashes:
+        position = value & mask
+        value >>= VALUE_SHIFT
+        if value < signature[position]:
+            signature[position] = value
+    if EMPTY_BIN in signature and any(value != EMPTY_BIN for value in signature):
+        densified = list(signature)
+        for position in range(num_perm):
+            distance = 0
+            while signature[(position + distance) % num_perm] == EMPTY_BIN:
+                distance += 1
+            # marked with the distance, so that empty bins do not agree by chance
+            densified[position] = (signature[(position + distance) % num_perm] + distance * 0x9E3779B1) & 0xFFFFFFFF
+        signature = densified
+    return array("Q", signature)
+
+
+def similarity(a: array, b: array) -> float:
+    """
+    estimated jaccard similarity of the shingles of two signatures
+    """
+    return sum(1 for x, y in zip(a, b) if x == y) / len(a)
+
+
+class NearDuplicateIndex(object):
+    """
+    Signatures of the articles seen within the window. A signature is cut into bands, articles agreeing on a whole
+    band are candidates, candidates at or above the similarity threshold are near-duplicates
+    """
+
+    def __init__(self, window_secs: float = 24 * 3600, threshold: float = 0.6, num_perm: int = 64, bands: int = 16,
+                 shingle_size: int = 3, min_shingles: int = 20, max_entries: int = 500000, mode: str = SUPPRESS):
+        """
+        Args:
+            window_secs: articles are compared with the ones seen within this time
+            threshold: min estimated jaccard similarity of the shingles of near-duplicates. With the default 16
+                       bands of 4 rows, articles at 0.6 are found with ~90% probability, at 0.8 with ~100%
+            num_perm: signature length, a power of two
+            bands: number of bands, divides num_perm
+            shingle_size: words per shingle
+            min_shingles: shorter texts (teasers, failed scrapes) are never taken for duplicates
+            max_entries: bound of the window, the oldest articles are dropped first
+            mode: SUPPRESS drops the near-duplicates before publish, CLUSTER publishes them with a header pointing to
+                  the first article of the cluster
+        """
+        self.window_secs = window_secs
+        self.threshold = threshold
+        self.num_perm = num_perm
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.shingle_size = shingle_size
+        self.min_shingles = min_shingles
+        self.max_entries = max_entries
+        self.mode = mode
+        # band key -> entries (signature, key, seen_at) sharing the band
+        self._buckets = {}
+        self._window = deque()
+        self._lock = threading.Lock()
+        self.checked = 0
+        self.duplicates = 0
+        self.too_short = 0
+
+    def signature(self, text: Optional[str]) -> Optional[array]:
+        """
+        Args:
+            text:
+
+        Returns: the MinHash signature, None for texts too short to compare
+
+        """
+        hashes = shingle_hashes(text or "", self.shingle_size)
+        return minhash(hashes, self.num_perm) if len(hashes) >= self.min_shingles else None
+
+    def _band_keys(self, signature: array) -> List[tuple]:
+        return [(band,) + tuple(signature[band * self.rows:(band + 1) * self.rows]) for band in range(self.bands)]
+
+    def _drop_oldest(self):
+        entry = self._window.popleft()
+        for band_key in self._band_keys(entry[0]):
+            entries = self._buckets[band_key]
+            entries.remove(entry)
+            if not entries:
+                del self._buckets[band_key]
+
+    def check(self, key: str, text: Optional[str], seen_at: float = None) -> Optional[str]:
+        """
+        looks the text up in the window, a text that is not a near-duplicate is added to the window
+        Args:
+            key: of the article, returned for the later near-duplicates of it
+            text: the article text
+            seen_at: defaults to now
+
+        Returns: the key of the article this one is a near-duplicate of, None if it is not one
+
+        """
+        signature = self.signature(text)
+        now = seen_at if seen_at is not None else time.time()
+        with self._lock:
+            self.checked += 1
+            if signature is None:
+                self.too_short += 1
+                return None
+            while self._window and (self._window[0][2] < now - self.window_secs or
+                                    len(self._window) >= self.max_entries):
+                self._drop_oldest()
+            band_keys = self._band_keys(signature)
+            for band_key in band_keys:
+                for entry in self._buckets.get(band_key, ()):
+                    if similarity(signature, entry[0]) >= self.threshold:
+                        self.duplicates += 1
+                        return entry[1]
+            entry = (signature, key, now)
+            self._window.append(entry)
+            for band_key in band_keys:
+                self._buckets.setdefault(band_key, []).append(entry)
+            return None
+
+    def review(self, key: str, text: Optional[str]) -> Tuple[bool, Optional[List[Tuple[str, bytes]]]]:
+        """
+        decides how an article is published
+        Args:
+            key: the kafka key of the article
+            text:
+
+        Returns: whether to publish the article, and the kafka headers to publish it with
+
+        """
+        original = self.check(key, text)
+        if original is None:
+            return True, None
+        if self.mode == SUPPRESS:
+            return False, None
+        return True, [(DUPLICATE_OF_HEADER, original.encode("utf-8"))]
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {"checked": self.checked, "duplicates": self.duplicates, "too_short": self.too_short,
+                    "window_size": len(self._window)}
@@ -1,17 +1,42 @@
 """
 Cleans up news articles so that clean text is remaining
 """
-from typing import List
+from concurrent.futures import ThreadPoolExecutor
+from typing import Iterable, Iterator, List
 
 from kgai_py_commons.logging.log import TRLogger
 from kgai_py_commons.model.googlenews.news_article import NewsArticle
-from newspaper import Article, ArticleException
+from newspaper import ArticleException
+
+from kgai_crawler.service.article_extractor import ArticleExtractor, FallbackArticleExtractor
+from kgai_crawler.service.extraction_cache import CachingArticleExtractor, ExtractionCache
+from kgai_crawler.service.http_transport import HttpTransport
+from kgai_crawler.service.url_index import SeenUrlIndex
+from kgai_crawler.utils.concurrency_utils import HostThrottle, ordered_map
 
 
 class NewsCleaner(object):
 
-    def __init__(self):
+    def __init__(self, max_workers: int = 1, max_per_host: int = 2, url_index: SeenUrlIndex = None,
+                 extractor: ArticleExtractor = None, extraction_cache: ExtractionCache = None,
+                 transport: HttpTransport = None):
+        """
+        Args:
+            max_workers: number of articles scraped concurrently, 1 scrapes serially
+            max_per_host: max concurrent downloads against a single host
+            url_index: articles with an already published url are dropped instead of scraped
+            extractor: gets the text out of the html, defaults to the lxml fast path with newspaper as fallback
+            extraction_cache: the text of already extracted html is taken from the cache
+            transport: the pooled http session the articles are downloaded with
+        """
         self.logger = TRLogger.instance().get_logger(__name__)
+        self.url_index = url_index
+        self.max_workers = max_workers
+        self.host_throttle = HostThrottle(max_per_host=max_per_host)
+        self.transport = transport or HttpTransport(pool_maxsize=max(10, max_per_host))
+        self.extractor = extractor or FallbackArticleExtractor()
+        if extraction_cache is not None:
+            self.extractor = CachingArticleExtractor(self.extractor, extraction_cache)
 
     def _scrape(self, url: str) -> str:
         """
@@ -25,15 +50,33 @@ class NewsCleaner(object):
         text = ""
 
         try:
-            article = Article(url)
-            article.download()
-            article.parse()
-            text = article.text
+            with self.host_throttle.limit(url):
+                html = self.transport.download_html(url)
+            if not html:
+                raise ArticleException("could not download {}".format(url))
+            parsed = self.extractor.extract_article(url, html)
+            text = parsed.text if parsed is not None else ""
         except ArticleException:
             self.logger.error("could not parse article in {}".format(url))
+        except Exception as err:
+            # one broken article must not take down the others scraped alongside it
+            self.logger.error("error while scraping article in {}, error: {}".format(url, err))
 
         return text
 
+    def _clean_article(self, article: NewsArticle) -> NewsArticle:
+        """
+        scrapes the text of a single article in place
+        Args:
+            article:
+
+        Returns:
+
+        """
+        if article.url:
+            article.articleText = self._scrape(article.url)
+        return article
+
     def clean_scrape(self, news_articles: List[NewsArticle]) -> List[NewsArticle]:
         """
         clean scrapes the news article text if it can be accessed
@@ -43,8 +86,27 @@ class NewsCleaner(object):
         Returns:
 
         """
-        for article in news_articles:
-            if article.url:
-                article.articleText = self._scrape(article.url)
+        return list(self.iter_clean_scrape(news_articles))
+
+    def iter_clean_scrape(self, news_articles: Iterable[NewsArticle]) -> Iterator[NewsArticle]:
+        """
+        streaming version of clean_scrape, yields each article as soon as it (and all before it) are scraped
+        articles already in the url index are dropped
+        with more than one worker the articles are scraped concurrently, the order of the input is kept
+        Args:
+            news_articles:
+
+        Returns:
+
+        """
+        if self.url_index:
+            news_articles = (article for article in news_articles
+                             if not article.url or not self.url_index.is_seen(article.url))
+
+        if self.max_workers <= 1:
+            for article in news_articles:
+                yield self._clean_article(article)
+            return
 
-        return news_articles
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            yield from ordered_map(executor, self._clean_article, news_articles, window=self.max_workers * 2)
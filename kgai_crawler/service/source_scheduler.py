@@ -0,0 +1,166 @@
+"""
+Schedules the crawl of many news sources concurrently, most productive sources first
+"""
+import json
+import os
+import queue
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Callable, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from kgai_py_commons.logging.log import TRLogger
+from kgai_py_commons.model.googlenews.news_article import NewsArticle
+from kgai_py_commons.model.googlenews.source_article import SourceArticle
+
+
+class SourceScheduler(object):
+    """
+    Crawls sources on a bounded pool and keeps per source yield/latency history (optionally persisted as json)
+    """
+
+    def __init__(self, max_concurrent_sources: int = 1, stats_path: Optional[str] = None,
+                 max_in_flight_articles: int = 100):
+        """
+        Args:
+            max_concurrent_sources: global budget of sources crawled at the same time
+            stats_path: json file the source history is persisted to, None keeps it in memory only
+            max_in_flight_articles: articles buffered between the crawlers and the consumer before crawlers block
+        """
+        self.logger = TRLogger.instance().get_logger(__name__)
+        self.max_concurrent_sources = max(1, max_concurrent_sources)
+        self.max_in_flight_articles = max(1, max_in_flight_articles)
+        self.stats_path = stats_path
+        self._stats_lock = threading.Lock()
+        self.stats = self._load_stats()
+
+    def _load_stats(self) -> Dict[str, Dict[str, float]]:
+        """
+        reads the source history, {source_url: {"runs": .., "articles": .., "seconds": ..}}
+        Returns:
+
+        """
+        if not self.stats_path or not os.path.isfile(self.stats_path):
+            return {}
+        try:
+            with open(self.stats_path, encoding="utf-8") as stats_file:
+                return json.load(stats_file)
+        except ValueError as err:
+            self.logger.error("Ignoring unreadable source stats in {}, error: {}".format(self.stats_path, err))
+            return {}
+
+    def save_stats(self):
+        """
+        persists the source history (atomically, a crash never leaves a half written file)
+        Returns:
+
+        """
+        if not self.stats_path:
+            return
+        tmp_path = self.stats_path + ".tmp"
+        with self._stats_lock:
+            with open(tmp_path, "w", encoding="utf-8") as stats_file:
+                json.dump(self.stats, stats_file)
+        os.replace(tmp_path, self.stats_path)
+
+    def _record(self, source: SourceArticle, articles: int, seconds: float):
+        with self._stats_lock:
+            stat = self.stats.setdefault(source.url, {"runs": 0, "articles": 0, "seconds": 0.0})
+            stat["runs"] += 1
+            stat["articles"] += articles
+            stat["seconds"] += seconds
+
+    def _score(self, source: SourceArticle) -> Optional[float]:
+        """
+        articles per second of crawling a source, None for sources without history
+        Args:
+            source:
+
+        Returns:
+
+        """
+        stat = self.stats.get(source.url)
+        if not stat or not stat["runs"]:
+            return None
+        return stat["articles"] / max(stat["seconds"], 1e-3)
+
+    def order(self, sources: List[SourceArticle]) -> List[SourceArticle]:
+        """
+        orders the sources by historical yield per second (highest first)
+        sources without history are scored at the mean so they are neither starved nor put ahead of proven ones
+        Args:
+            sources:
+
+        Returns:
+
+        """
+        scores = {source.url: self._score(source) for source in sources}
+        known = [score for score in scores.values() if score is not None]
+        default = sum(known) / len(known) if known else 0.0
+        return sorted(sources, key=lambda source: scores[source.url] if scores[source.url] is not None else default,
+                      reverse=True)
+
+    @staticmethod
+    def _put(results: queue.Queue, item: Tuple[SourceArticle, Optional[NewsArticle]], stop: threading.Event) -> bool:
+        """
+        blocks until the item is queued, gives up (False) once the consumer stopped
+        """
+        while not stop.is_set():
+            try:
+                results.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _crawl_one(self, source: SourceArticle, crawl_fn: Callable[[SourceArticle], Iterable[NewsArticle]],
+                   results: queue.Queue, stop: threading.Event):
+        if stop.is_set():
+            return
+        start = time.time()
+        articles = 0
+        try:
+            for article in crawl_fn(source):
+                if not self._put(results, (source, article), stop):
+                    break
+                articles += 1
+        except Exception as err:
+            self.logger.error("Error while crawling source: {}, error: {}".format(source.url, err))
+        finally:
+            self._record(source=source, articles=articles, seconds=time.time() - start)
+            self.logger.debug("Crawled {} news articles from {}".format(articles, source.url))
+            # None marks the source as done
+            self._put(results, (source, None), stop)
+
+    def crawl(self, sources: List[SourceArticle], crawl_fn: Callable[[SourceArticle], Iterable[NewsArticle]]) \
+            -> Iterator[Tuple[SourceArticle, NewsArticle]]:
+        """
+        crawls the sources (in the given order) concurrently, yields each article with its source as soon as it is
+        crawled. A bounded buffer sits between crawlers and consumer, so a slow consumer throttles the crawlers.
+        The history is persisted once all sources are done
+        Args:
+            sources:
+            crawl_fn: streams the articles of a source
+
+        Returns:
+
+        """
+        results = queue.Queue(maxsize=self.max_in_flight_articles)
+        stop = threading.Event()
+        try:
+            with ThreadPoolExecutor(max_workers=self.max_concurrent_sources) as executor:
+                for source in sources:
+                    executor.submit(self._crawl_one, source, crawl_fn, results, stop)
+                try:
+                    pending = len(sources)
+                    while pending:
+                        source, article = results.get()
+                        if article is None:
+                            pending -= 1
+                            continue
+                        yield source, article
+                finally:
+                    # releases the crawlers if the consumer stopped early
+                    stop.set()
+        finally:
+            self.save_stats()
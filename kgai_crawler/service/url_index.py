@@ -0,0 +1,86 @@
+"""
+Persistent index of article urls already published, consulted before any article is fetched
+"""
+import sqlite3
+import threading
+import time
+from typing import Iterable, Optional
+
+import xxhash
+
+from kgai_crawler.utils.url_utils import canonical_url
+
+
+class SeenUrlIndex(object):
+    """
+    SQLite backed set of canonical urls with a time to live, safe to share between threads
+    """
+
+    def __init__(self, path: str, ttl_days: Optional[float] = 30):
+        """
+        Args:
+            path: sqlite file of the index (":memory:" for a throw away index)
+            ttl_days: urls seen longer ago are forgotten (and fetched again), None keeps them forever
+        """
+        self.path = path
+        self.ttl_secs = ttl_days * 24 * 3600 if ttl_days is not None else None
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute("CREATE TABLE IF NOT EXISTS seen_urls (url_hash TEXT PRIMARY KEY, seen_at REAL NOT NULL)")
+        self._conn.commit()
+        self.evict_expired()
+
+    @staticmethod
+    def _key(url: str) -> str:
+        return xxhash.xxh64(canonical_url(url).encode("utf-8")).hexdigest()
+
+    def _oldest_valid(self) -> float:
+        return time.time() - self.ttl_secs if self.ttl_secs is not None else 0.0
+
+    def is_seen(self, url: str) -> bool:
+        """
+        checks if the (canonical) url was marked as seen within the ttl
+        Args:
+            url:
+
+        Returns:
+
+        """
+        with self._lock:
+            row = self._conn.execute("SELECT 1 FROM seen_urls WHERE url_hash = ? AND seen_at >= ?",
+                                     (self._key(url), self._oldest_valid())).fetchone()
+        return row is not None
+
+    def mark_seen(self, urls: Iterable[str]):
+        """
+        marks urls as seen (now), refreshing the ttl of already known ones
+        Args:
+            urls:
+
+        Returns:
+
+        """
+        now = time.time()
+        with self._lock:
+            self._conn.executemany("INSERT OR REPLACE INTO seen_urls (url_hash, seen_at) VALUES (?, ?)",
+                                   [(self._key(url), now) for url in urls])
+            self._conn.commit()
+
+    def evict_expired(self) -> int:
+        """
+        deletes the urls older than the ttl
+        Returns: the number of evicted urls
+
+        """
+        if self.ttl_secs is None:
+            return 0
+        with self._lock:
+            evicted = self._conn.execute("DELETE FROM seen_urls WHERE seen_at < ?", (self._oldest_valid(),)).rowcount
+            self._conn.commit()
+        return evicted
+
+    def close(self):
+        with self._lock:
+            self._conn.close()
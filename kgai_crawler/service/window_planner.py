@@ -0,0 +1,138 @@
+"""
+Plans the queries of a search API that caps the results of a query (newsapi returns at most 100 hits per query on the
+free plan): windows holding more hits than the cap are split until every window fits or reaches the min granularity
+"""
+import math
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+from datetime import datetime, timedelta
+from typing import Callable, Iterable, Iterator, List, Tuple
+
+from kgai_py_commons.logging.log import TRLogger
+
+# (from_date, to_date)
+Window = Tuple[datetime, datetime]
+EPOCH = datetime(1970, 1, 1)
+
+
+def floor_to(date: datetime, granularity: timedelta) -> datetime:
+    """
+    Args:
+        date: naive utc
+        granularity:
+
+    Returns: the date floored to a multiple of the granularity since the epoch, so that the windows (and the cache keys
+             of their queries) of repeated runs line up
+
+    """
+    return EPOCH + (date - EPOCH) // granularity * granularity
+
+
+class WindowPlanner(object):
+    """
+    Runs the queries of the windows concurrently within a budget of calls. The first page of a window tells its total
+    hits: a window the cap covers is paged through, a saturated window is split into as many parts as its hits need
+    (at least halved), down to min_window
+    """
+
+    def __init__(self, fetch: Callable[[datetime, datetime, int], Tuple[int, List]], max_results: int = 100,
+                 page_size: int = 100, min_window: timedelta = timedelta(hours=1), max_calls: int = 50,
+                 max_workers: int = 4):
+        """
+        Args:
+            fetch: (from_date, to_date, page) -> (total hits of the window, hits of the page)
+            max_results: hits a single query can return over all its pages (the cap of the plan)
+            page_size: hits per page
+            min_window: saturated windows are not split below this, their hits beyond the cap are lost
+            max_calls: budget of calls of a plan, windows left when it is spent are skipped
+            max_workers: calls in flight at the same time
+        """
+        self.logger = TRLogger.instance().get_logger(__name__)
+        self.fetch = fetch
+        self.max_results = max_results
+        self.page_size = page_size
+        self.max_pages = max(1, max_results // page_size)
+        self.min_window = min_window
+        self.max_calls = max_calls
+        self.max_workers = max(1, max_workers)
+        # calls, hits, split_windows, truncated_windows and skipped_calls of the last run
+        self.stats = {}
+
+    def _count(self, stat: str, value: int = 1):
+        self.stats[stat] = self.stats.get(stat, 0) + value
+
+    def split(self, window: Window, total: int) -> List[Window]:
+        """
+        Args:
+            window:
+            total: hits of the window
+
+        Returns: about equal parts of the window, each expected to fit the cap, no shorter than min_window. The split
+                 points are snapped to the min_window grid, so that repeated runs query the same windows
+
+        """
+        from_date, to_date = window
+        parts = max(2, math.ceil(total / self.max_results))
+        parts = int(max(1, min(parts, (to_date - from_date) // self.min_window)))
+        step = (to_date - from_date) / parts
+        inner = sorted({floor_to(from_date + step * part, self.min_window) for part in range(1, parts)})
+        bounds = [from_date] + [bound for bound in inner if from_date < bound < to_date] + [to_date]
+        return [(bounds[part], bounds[part + 1]) for part in range(len(bounds) - 1)]
+
+    def _plan(self, window: Window, total: int) -> Tuple[List[Tuple[Window, int]], bool]:
+        """
+        the follow-up calls of the first page of a window
+        Args:
+            window:
+            total: hits of the window
+
+        Returns: the (window, page) calls, whether the window is truncated at the min granularity
+
+        """
+        if total <= self.page_size:
+            return [], False
+        from_date, to_date = window
+        if total > self.max_results and to_date - from_date >= 2 * self.min_window:
+            return [(part, 1) for part in self.split(window, total)], False
+        pages = min(math.ceil(total / self.page_size), self.max_pages)
+        return [(window, page) for page in range(2, pages + 1)], total > self.max_results
+
+    def run(self, windows: Iterable[Window]) -> Iterator[List]:
+        """
+        Args:
+            windows: the windows to cover, queried in order
+
+        Returns: the hits of each call as soon as it completes, windows overlap at their bounds so the same hit can
+                 come more than once
+
+        """
+        self.stats = {}
+        pending = [(window, 1) for window in windows]
+        calls = 0
+        with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+            in_flight = {}
+            while pending or in_flight:
+                while pending and len(in_flight) < self.max_workers and calls < self.max_calls:
+                    window, page = pending.pop(0)
+                    in_flight[executor.submit(self.fetch, window[0], window[1], page)] = (window, page)
+                    calls += 1
+                if not in_flight:
+                    break
+                done, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+                for future in done:
+                    window, page = in_flight.pop(future)
+                    total, hits = future.result()
+                    self._count("hits", len(hits))
+                    if page == 1:
+                        follow_ups, truncated = self._plan(window, total)
+                        if truncated:
+                            self.logger.warning("Window {} - {} holds {} hits, only {} can be fetched".format(
+                                window[0], window[1], total, self.max_results))
+                            self._count("truncated_windows")
+                        if follow_ups and follow_ups[0][0] != window:
+                            self._count("split_windows")
+                        pending.extend(follow_ups)
+                    yield hits
+        self._count("calls", calls)
+        if pending:
+            self.logger.warning("Budget of {} calls spent, skipping {} queries".format(self.max_calls, len(pending)))
+            self._count("skipped_calls", len(pending))
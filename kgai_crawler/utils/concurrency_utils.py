@@ -0,0 +1,69 @@
+"""
+Helpers to run blocking network calls concurrently while staying polite to the hosts we crawl
+"""
+import threading
+from collections import deque
+from concurrent.futures import Executor
+from contextlib import contextmanager
+from typing import Callable, Dict, Iterable, Iterator, TypeVar
+
+from kgai_crawler.utils.url_utils import get_host
+
+T = TypeVar("T")
+R = TypeVar("R")
+
+
+class HostThrottle(object):
+    """
+    Caps the number of concurrent requests made against a single host
+    """
+
+    def __init__(self, max_per_host: int):
+        self.max_per_host = max(1, max_per_host)
+        self._semaphores: Dict[str, threading.BoundedSemaphore] = {}
+        self._lock = threading.Lock()
+
+    def _semaphore(self, host: str) -> threading.BoundedSemaphore:
+        with self._lock:
+            semaphore = self._semaphores.get(host)
+            if semaphore is None:
+                semaphore = threading.BoundedSemaphore(self.max_per_host)
+                self._semaphores[host] = semaphore
+            return semaphore
+
+    @contextmanager
+    def limit(self, url: str):
+        """
+        blocks until a slot for the host of the url is free and holds it for the duration of the context
+        Args:
+            url:
+
+        Returns:
+
+        """
+        semaphore = self._semaphore(get_host(url))
+        with semaphore:
+            yield
+
+
+def ordered_map(executor: Executor, fn: Callable[[T], R], items: Iterable[T], window: int) -> Iterator[R]:
+    """
+    lazily maps fn over items on the executor, yielding results in input order
+    at most `window` calls are in flight at any time, so arbitrarily long inputs can be streamed
+    Args:
+        executor:
+        fn:
+        items:
+        window:
+
+    Returns:
+
+    """
+    window = max(1, window)
+    pending = deque()
+    for item in items:
+        pending.append(executor.submit(fn, item))
+        if len(pending) >= window:
+            yield pending.popleft().result()
+    while pending:
+        yield pending.popleft().result()
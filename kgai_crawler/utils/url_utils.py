@@ -0,0 +1,48 @@
+"""
+Helpers to work with article urls
+"""
+from urllib.parse import parse_qsl, urlencode, urlparse, urlsplit, urlunsplit
+
+
+def get_host(url: str) -> str:
+    """
+    extracts the lower cased host (without port) of an url, empty string if there is none
+    Args:
+        url:
+
+    Returns:
+
+    """
+    return (urlparse(url).hostname or "").lower()
+
+
+# query parameters that only track the visitor and never change the article served
+TRACKING_QUERY_PARAMS = {"fbclid", "gclid", "dclid", "msclkid", "mc_cid", "mc_eid", "ocid", "cmpid", "ref", "ref_src",
+                         "smid", "sr_share", "igshid"}
+
+
+def canonical_url(url: str) -> str:
+    """
+    normalizes an url so that the same article reached through different links maps onto the same string:
+    lower cased scheme and host, no "www.", no default port, no fragment, no tracking parameters, sorted query
+    and no trailing slash
+    Args:
+        url:
+
+    Returns:
+
+    """
+    parts = urlsplit(url.strip())
+    scheme = parts.scheme.lower() or "http"
+    host = (parts.hostname or "").lower()
+    if host.startswith("www."):
+        host = host[len("www."):]
+    if parts.port and not ((scheme == "http" and parts.port == 80) or (scheme == "https" and parts.port == 443)):
+        host = "{}:{}".format(host, parts.port)
+
+    query = sorted((key, value) for key, value in parse_qsl(parts.query, keep_blank_values=True)
+                   if not key.lower().startswith("utm_") and key.lower() not in TRACKING_QUERY_PARAMS)
+    path = parts.path.rstrip("/") or "/"
+
+    # http and https serve the same article, the scheme does not take part in the identity
+    return urlunsplit(("https" if scheme == "http" else scheme, host, path, urlencode(query), ""))
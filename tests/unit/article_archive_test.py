@@ -0,0 +1,55 @@
+"""
+Tests the segment file article archive
+"""
+import datetime
+import gzip
+import os
+import shutil
+import tempfile
+
+from kgai_crawler.service.article_archive import ArticleArchive, ArticleArchiveReader, list_segments
+
+
+class TestArticleArchive(object):
+
+    def setup_method(self):
+        self.directory = tempfile.mkdtemp()
+
+    def teardown_method(self):
+        shutil.rmtree(self.directory)
+
+    def test_batches_segments_and_lookup(self):
+        archive = ArticleArchive(self.directory, batch_size=3, segment_max_bytes=1)
+        for i in range(7):
+            archive.append("hash{}".format(i), {"title": "Story {}".format(i),
+                                                "date_publish": datetime.datetime(2020, 5, i + 1)})
+        assert archive.archived == 6, "Expected only full batches written before the flush"
+        archive.close()
+
+        assert len(list_segments(self.directory)) == 3, "Expected a new segment once the max size is reached"
+        reader = ArticleArchiveReader(self.directory)
+        assert [key for key, _ in reader.iter_articles()] == ["hash{}".format(i) for i in range(7)], \
+            "Expected all articles in write order"
+        assert reader.get("hash4") == {"title": "Story 4", "date_publish": "2020-05-05 00:00:00"}, \
+            "Expected the lookup by hash"
+        assert reader.get("missing") is None, "Expected None for unknown hashes"
+
+    def test_segments_are_jsonl_gz_and_reopen_appends(self):
+        archive = ArticleArchive(self.directory)
+        archive.append("a", {"title": "First"})
+        archive.close()
+        archive = ArticleArchive(self.directory)
+        archive.append("b", {"title": "Second"})
+        archive.close()
+
+        segments = list_segments(self.directory)
+        assert [os.path.basename(path) for path in segments] == ["articles-000001.jsonl.gz",
+                                                                 "articles-000002.jsonl.gz"], \
+            "Expected a new segment per writer"
+        with gzip.open(segments[0], "rt", encoding="utf-8") as segment:
+            assert segment.read() == '{"title":"First"}\n', "Expected plain compressed json lines"
+
+        replayed = []
+        assert ArticleArchiveReader(self.directory).replay(lambda key, article: replayed.append(key)) == 2, \
+            "Expected the replay count"
+        assert replayed == ["a", "b"], "Expected the replay in write order"
@@ -0,0 +1,98 @@
+"""
+Tests the lxml fast path extractor, its fallback and the extractor benchmark on the fixture corpus
+"""
+import os
+
+from kgai_crawler.connector.generic_news import GenericNews
+from kgai_crawler.scripts.extractor_benchmark import benchmark, load_corpus
+from kgai_crawler.service.article_extractor import ArticleExtractor, FallbackArticleExtractor, LxmlArticleExtractor, \
+    ParsedArticle
+
+CORPUS_DIR = os.path.join(os.path.dirname(os.path.dirname(__file__)), "fixtures", "extractor_corpus")
+
+
+class StaticExtractor(ArticleExtractor):
+    name = "static"
+
+    def __init__(self):
+        self.calls = 0
+
+    def extract(self, url, html):
+        self.calls += 1
+        return ParsedArticle(url=url, title="static", text="static", publish_date=None, authors=[],
+                             article_html=""), 1.0
+
+
+class TestArticleExtractor(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.corpus = dict(load_corpus(CORPUS_DIR))
+
+    def _extract(self, name):
+        url = "https://news.example.com/{}".format(name)
+        return LxmlArticleExtractor().extract(url, self.corpus[url])
+
+    def test_json_ld(self):
+        article, confidence = self._extract("json_ld_article")
+        assert article.title == "Council approves transit plan", "Expected the json-ld headline"
+        assert article.authors == ["Jane Miller"], "Expected the json-ld author"
+        assert article.publish_date.date().isoformat() == "2021-03-02", "Expected the json-ld publishing date"
+        assert article.language == "en", "Expected the language of the html tag"
+        assert article.text.startswith("The city council approved"), "Expected the text of the article element"
+        assert "Most read" not in article.text and "Copyright" not in article.text, "Expected no boilerplate"
+        assert confidence > 0.99, "Expected full confidence in a marked up article"
+
+    def test_article_html(self):
+        article, _ = self._extract("json_ld_article")
+        news_article = GenericNews._map_articles(article, source_name="example", source_url="https://news.example.com")
+        assert news_article.content.startswith("<article") and "The city council approved" in news_article.content, \
+            "Expected the html of the article element as content"
+        assert "Copyright" not in news_article.content, "Expected no boilerplate in the content"
+
+    def test_close_shuts_the_pools(self):
+        news = GenericNews(download_workers=2, parse_workers=1)
+        download_pool, parse_pool = news.article_engine._pools()
+        news.close()
+        assert download_pool._shutdown and parse_pool._shutdown_thread, "Expected the scrape pools shut down"
+
+    def test_meta_tags(self):
+        article, confidence = self._extract("meta_tags_article_body")
+        assert article.title == "New battery keeps its charge after 2,000 cycles", "Expected the og:title"
+        assert article.authors == ["Tom Becker"], "Expected the meta author"
+        assert article.description == "A solid electrolyte makes the cell safer", "Expected the og:description"
+        assert "Related" not in article.text, "Expected the link paragraphs to be dropped"
+
+    def test_unmarked_content(self):
+        article, confidence = self._extract("plain_divs")
+        assert article.text.count("\n\n") == 3, "Expected the four paragraphs of the densest block"
+        assert "Great news" not in article.text, "Expected the comments to be left out"
+        assert article.publish_date.date().isoformat() == "2021-03-03", "Expected the date of the time element"
+
+    def test_byline(self):
+        article, _ = self._extract("blog_post")
+        assert article.authors == ["Ana Silva"], "Expected the rel=author link"
+
+    def test_low_confidence_falls_back(self):
+        fallback = StaticExtractor()
+        extractor = FallbackArticleExtractor(fallback=fallback, min_confidence=0.7)
+        index_page = self.corpus["https://news.example.com/index_page"]
+        article = extractor.extract_article("https://news.example.com/index_page", index_page)
+        assert article.title == "static" and fallback.calls == 1, "Expected the index page to fall back"
+
+        url = "https://news.example.com/json_ld_article"
+        article = extractor.extract_article(url, self.corpus[url])
+        assert article.title == "Council approves transit plan", "Expected the fast path for an article"
+        assert fallback.calls == 1, "Expected no fallback for a confident extraction"
+        assert extractor.counters == {"lxml": 1, "static": 1}, "Expected the extractions to be counted"
+
+    def test_empty(self):
+        assert LxmlArticleExtractor().extract("https://example.com", "  ") == (None, 0.0), "Expected nothing"
+
+    def test_benchmark(self):
+        report = benchmark(list(self.corpus.items()))
+        assert report["documents"] == 5, "Expected the whole corpus"
+        assert set(report["extractors"]) == {"newspaper", "lxml", "fallback"}, "Expected all extractors"
+        assert report["extractors"]["newspaper"]["agreement"]["text"] == 1.0, "Expected the reference to agree"
+        assert report["extractors"]["lxml"]["agreement"]["authors"] == 1.0, "Expected the fast path authors"
+        assert report["extractors"]["fallback"]["fast_path_share"] == 0.8, "Expected one fallback"
@@ -0,0 +1,44 @@
+"""
+Tests handing extracted articles from worker processes to the single writer
+"""
+import datetime
+from multiprocessing import Pool
+
+from kgai_crawler.service.article_sink import ArticleSink
+
+
+class Article(object):
+
+    def __init__(self, title):
+        self.title = title
+        self.date_publish = datetime.datetime(2020, 5, 10)
+
+
+def extract(title, article_writer):
+    article_writer(Article(title))
+
+
+class TestArticleSink(object):
+
+    def test_articles_reach_the_parent(self):
+        handled = []
+        sink = ArticleSink(handled.append, max_queued_articles=2)
+        article_writer = sink.start()
+        with Pool(2) as pool:
+            pool.starmap(extract, [("Story {}".format(i), article_writer) for i in range(10)])
+        sink.close()
+
+        assert sorted(article["title"] for article in handled) == sorted("Story {}".format(i) for i in range(10)), \
+            "Expected every article handled once"
+        assert handled[0]["date_publish"] == "2020-05-10 00:00:00", "Expected the attributes serialized like the files"
+
+    def test_handler_errors_do_not_stop_the_sink(self):
+        def handler(article):
+            if article["title"] == "bad":
+                raise ValueError("bad article")
+        sink = ArticleSink(handler)
+        with sink as article_writer:
+            article_writer(Article("bad"))
+            article_writer(Article("good"))
+
+        assert (sink.handled, sink.failed) == (1, 1), "Expected the sink to go on after a failing article"
@@ -0,0 +1,78 @@
+"""
+Tests the native CC-NEWS listing and its manifest cache
+"""
+import datetime
+import os
+
+from kgai_crawler.connector.cc_news_index import CCNewsIndex, HighWaterMark, LocalDirectoryBackend, iter_months, \
+    warc_timestamp
+
+
+class CountingBackend(LocalDirectoryBackend):
+
+    def __init__(self, root: str):
+        super().__init__(root)
+        self.calls = []
+
+    def list_month(self, year, month, start_after=None):
+        self.calls.append((year, month, start_after))
+        return super().list_month(year, month, start_after=start_after)
+
+
+def _add_warc(root, year, month, name):
+    month_dir = os.path.join(str(root), "crawl-data", "CC-NEWS", str(year), "{:02d}".format(month))
+    os.makedirs(month_dir, exist_ok=True)
+    open(os.path.join(month_dir, name), "wb").close()
+
+
+class TestCCNewsIndex(object):
+
+    def test_iter_months_across_years(self):
+        months = list(iter_months(datetime.datetime(2019, 11, 20), datetime.datetime(2020, 2, 1)))
+        assert months == [(2019, 11), (2019, 12), (2020, 1), (2020, 2)], "Expected every month of the range"
+
+    def test_past_months_listed_once_current_month_incrementally(self, tmp_path):
+        mirror = tmp_path / "mirror"
+        _add_warc(mirror, 2020, 4, "CC-NEWS-20200430000000-00001.warc.gz")
+        _add_warc(mirror, 2020, 5, "CC-NEWS-20200501000000-00001.warc.gz")
+        backend = CountingBackend(str(mirror))
+        index = CCNewsIndex(backend=backend, manifest_dir=str(tmp_path / "manifests"))
+
+        now = datetime.datetime(2020, 5, 10)
+        assert len(index.list_month(2020, 4, now=now)) == 1
+        assert len(index.list_month(2020, 5, now=now)) == 1
+
+        _add_warc(mirror, 2020, 5, "CC-NEWS-20200509000000-00002.warc.gz")
+        assert len(index.list_month(2020, 4, now=now)) == 1
+        assert len(index.list_month(2020, 5, now=now)) == 2, "Expected the new WARC of the running month"
+
+        assert backend.calls == [(2020, 4, None), (2020, 5, None),
+                                 (2020, 5, "crawl-data/CC-NEWS/2020/05/CC-NEWS-20200501000000-00001.warc.gz")], \
+            "Expected finished months to come from the manifest and the running month listed incrementally"
+        assert index.base_url.startswith("file://"), "Expected local mirror to be downloadable"
+
+    def test_high_water_mark(self, tmp_path):
+        names = ["crawl-data/CC-NEWS/2020/05/CC-NEWS-20200501000000-00001.warc.gz",
+                 "crawl-data/CC-NEWS/2020/05/CC-NEWS-20200502000000-00002.warc.gz"]
+        mark = HighWaterMark(path=str(tmp_path / "mark.json"))
+        assert mark.newer_names(names) == names, "Expected everything to be new without a mark"
+
+        mark.advance(names[:1])
+        assert mark.newer_names(names) == names[1:], "Expected only the WARC after the mark"
+        mark.advance(names[:1])
+        mark.advance(names)
+        assert mark.newer_names(names) == [], "Expected nothing new after advancing"
+        assert warc_timestamp(mark.read()) == datetime.datetime(2020, 5, 2), "Expected timestamp parsed from name"
+
+    def test_high_water_mark_stops_before_a_failed_warc(self, tmp_path):
+        names = ["crawl-data/CC-NEWS/2020/05/CC-NEWS-20200501000000-00001.warc.gz",
+                 "crawl-data/CC-NEWS/2020/05/CC-NEWS-20200502000000-00002.warc.gz",
+                 "crawl-data/CC-NEWS/2020/05/CC-NEWS-20200503000000-00003.warc.gz"]
+        mark = HighWaterMark(path=str(tmp_path / "mark.json"))
+
+        failed = mark.advance_completed(names, {names[0], names[2]})
+        assert failed == names[1:2], "Expected the WARC that did not complete reported"
+        assert mark.newer_names(names) == names[1:], "Expected the failed WARC and the ones after it listed again"
+
+        assert mark.advance_completed(names[1:], set(names[1:])) == [], "Expected no failure on the retry"
+        assert mark.newer_names(names) == [], "Expected the mark past all WARCs once the retry completed"
@@ -0,0 +1,73 @@
+"""
+Tests the streaming WARC extraction against a local stand-in file server
+"""
+import functools
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+from io import BytesIO
+
+from warcio.statusandheaders import StatusAndHeaders
+from warcio.warcwriter import WARCWriter
+
+from kgai_crawler.scripts.commoncrawl_stream_extractor import StreamingCommonCrawlExtractor
+
+ARTICLE_HTML = """<html><head><title>{title}</title>
+<meta property="article:published_time" content="2020-05-10T10:00:00Z"/></head>
+<body><article><h1>{title}</h1><p>{text}</p></article></body></html>"""
+
+
+def write_warc(path, pages):
+    with open(path, "wb") as output:
+        writer = WARCWriter(output, gzip=True)
+        for url, title in pages:
+            body = ARTICLE_HTML.format(title=title, text="A long enough paragraph of article text. " * 20)
+            http_headers = StatusAndHeaders("200 OK", [("Content-Type", "text/html; charset=utf-8")],
+                                            protocol="HTTP/1.1")
+            writer.write_record(writer.create_warc_record(url, "response", payload=BytesIO(body.encode("utf-8")),
+                                                          http_headers=http_headers))
+
+
+class TestStreamingExtractor(object):
+
+    @classmethod
+    def setup_class(cls):
+        """
+        serves a generated WARC from a local http server
+        """
+        cls.root = tempfile.mkdtemp()
+        write_warc(os.path.join(cls.root, "test.warc.gz"), [("https://www.bbc.co.uk/news/a", "First story"),
+                                                           ("https://example.com/b", "Second story")])
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=cls.root)
+        cls.server = http.server.HTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.warc_url = "http://127.0.0.1:{}/test.warc.gz".format(cls.server.server_port)
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        shutil.rmtree(cls.root)
+
+    def test_stream_extraction(self):
+        articles, completed = [], []
+        StreamingCommonCrawlExtractor().extract_from_commoncrawl(
+            self.warc_url, articles.append,
+            callback_on_warc_completed=lambda *counters: completed.append(counters),
+            valid_hosts=["bbc.co.uk"])
+
+        assert [article.title for article in articles] == ["First story"], "Expected only the valid host"
+        assert completed == [(self.warc_url, 1, 1, 0, 2)], "Expected passed, discarded, error and total counters"
+
+    def test_fast_path_matches_news_please(self):
+        fast, slow = [], []
+        StreamingCommonCrawlExtractor().extract_from_commoncrawl(self.warc_url, fast.append)
+        StreamingCommonCrawlExtractor().extract_from_commoncrawl(self.warc_url, slow.append,
+                                                                 fast_extraction_confidence=None)
+
+        assert len(fast) == len(slow) == 2, "Expected both records from either extractor"
+        for fast_article, slow_article in zip(fast, slow):
+            for attribute in ("url", "title", "maintext", "date_publish", "source_domain", "filename"):
+                assert getattr(fast_article, attribute) == getattr(slow_article, attribute), \
+                    "Expected the fast path to agree with news-please on {}".format(attribute)
@@ -0,0 +1,38 @@
+"""
+Tests the concurrency helpers used by the scrapers
+"""
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from kgai_crawler.utils.concurrency_utils import HostThrottle, ordered_map
+
+
+class TestConcurrencyUtils(object):
+
+    def test_ordered_map_keeps_input_order(self):
+        def slow_identity(value):
+            time.sleep(0.01 * (5 - value))
+            return value
+
+        with ThreadPoolExecutor(max_workers=5) as executor:
+            results = list(ordered_map(executor, slow_identity, range(5), window=5))
+        assert results == [0, 1, 2, 3, 4], "Expected results in input order"
+
+    def test_host_throttle_caps_concurrency(self):
+        throttle = HostThrottle(max_per_host=2)
+        lock = threading.Lock()
+        in_flight = {"now": 0, "max": 0}
+
+        def fetch(url):
+            with throttle.limit(url):
+                with lock:
+                    in_flight["now"] += 1
+                    in_flight["max"] = max(in_flight["max"], in_flight["now"])
+                time.sleep(0.02)
+                with lock:
+                    in_flight["now"] -= 1
+
+        with ThreadPoolExecutor(max_workers=8) as executor:
+            list(executor.map(fetch, ["http://a.com/{}".format(i) for i in range(8)]))
+        assert in_flight["max"] == 2, "Expected at most 2 concurrent requests per host"
@@ -0,0 +1,65 @@
+"""
+Tests the resume checkpoints, and resuming a streamed WARC mid-file
+"""
+import datetime
+import os
+import pickle
+import shutil
+import tempfile
+
+from kgai_crawler.scripts.commoncrawl_stream_extractor import StreamingCommonCrawlExtractor
+from kgai_crawler.scripts.crawl_checkpoint import CrawlCheckpoint, filter_fingerprint
+from tests.unit.commoncrawl_stream_extractor_test import write_warc
+
+
+class TestCrawlCheckpoint(object):
+
+    def setup_method(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "checkpoints.sqlite")
+
+    def teardown_method(self):
+        shutil.rmtree(self.directory)
+
+    def test_fingerprint_scopes_the_checkpoints(self):
+        start = datetime.datetime(2020, 5, 1, 10)
+        fingerprint = filter_fingerprint(["bbc.co.uk"], start, None, True)
+        assert fingerprint == filter_fingerprint(["bbc.co.uk"], start.replace(hour=18), None, True), \
+            "Expected the dates to count by day"
+        assert fingerprint != filter_fingerprint(["cnn.com"], start, None, True), "Expected other hosts to differ"
+
+        checkpoint = CrawlCheckpoint(self.path, fingerprint)
+        checkpoint.save_offset("warc-a", 1234)
+        checkpoint.mark_completed("warc-b")
+        # a pool worker gets a pickled copy with its own connection
+        copy = pickle.loads(pickle.dumps(checkpoint))
+        assert copy.record_offset("warc-a") == 1234, "Expected the saved offset"
+        assert copy.completed_urls() == {"warc-b"}, "Expected the completed WARCs"
+        other_filters = CrawlCheckpoint(self.path, "other")
+        assert other_filters.record_offset("warc-a") == 0, "Expected no resume with other filters"
+        assert not other_filters.completed_urls(), "Expected no completed WARCs with other filters"
+
+    def test_seed_from_the_legacy_list(self):
+        checkpoint = CrawlCheckpoint(self.path, "filters")
+        assert checkpoint.seed_completed(["warc-a", "warc-b", "warc-a"]) == 2, "Expected the legacy WARCs seeded"
+        assert checkpoint.completed_urls() == {"warc-a", "warc-b"}, "Expected the legacy WARCs completed"
+        other_filters = CrawlCheckpoint(self.path, "other")
+        assert other_filters.seed_completed(["warc-c"]) == 0, "Expected a store with checkpoints not to be seeded"
+        assert not other_filters.completed_urls(), "Expected no completed WARCs with other filters"
+
+    def test_resume_mid_file(self):
+        warc_path = os.path.join(self.directory, "test.warc.gz")
+        write_warc(warc_path, [("https://example.com/{}".format(i), "Story {}".format(i)) for i in range(5)])
+        checkpoint = CrawlCheckpoint(self.path, "filters", interval_records=2)
+
+        first_run = []
+        StreamingCommonCrawlExtractor().extract_from_commoncrawl(warc_path, first_run.append,
+                                                                 checkpoint_store=checkpoint)
+        assert len(first_run) == 5, "Expected all articles"
+        offset = checkpoint.record_offset(warc_path)
+        assert offset > 0, "Expected the offset after the 4th record to be saved"
+
+        resumed = []
+        StreamingCommonCrawlExtractor().extract_from_commoncrawl(warc_path, resumed.append,
+                                                                 checkpoint_store=checkpoint)
+        assert [article.title for article in resumed] == ["Story 4"], "Expected to resume after the checkpoint"
@@ -0,0 +1,36 @@
+"""
+Tests the crawl metrics shared across processes
+"""
+from multiprocessing import Pool
+
+from kgai_crawler.scripts import crawl_metrics
+from kgai_crawler.scripts.crawl_metrics import CrawlMetrics
+
+
+def complete_warc(_):
+    crawl_metrics.inc("warc_processed")
+    crawl_metrics.inc("article_total", 10)
+    crawl_metrics.current().observe("extract", 0.02)
+
+
+class TestCrawlMetrics(object):
+
+    def test_workers_add_to_shared_counters(self):
+        metrics = CrawlMetrics(total_warcs=10)
+        with Pool(2, initializer=crawl_metrics.install, initargs=(metrics,)) as pool:
+            pool.map(complete_warc, range(4))
+
+        snapshot = metrics.snapshot()
+        assert snapshot["counters"]["warc_processed"] == 4, "Expected the counts of all workers"
+        assert snapshot["counters"]["article_total"] == 40, "Expected the counts of all workers"
+        assert snapshot["latencies"]["extract"]["count"] == 4, "Expected the observations of all workers"
+        assert snapshot["latencies"]["extract"]["p50_secs"] == 0.05, "Expected the upper bound of the bucket"
+        assert snapshot["remaining_warcs"] == 6, "Expected the unprocessed WARCs"
+        assert abs(snapshot["eta_h"] - 6 * snapshot["h_per_warc"]) < 1e-9, "Expected remaining * h/warc as ETA"
+
+    def test_no_metrics_outside_a_crawl(self):
+        crawl_metrics.install(None)
+        crawl_metrics.inc("warc_processed")
+        with crawl_metrics.timed("publish"):
+            pass
+        assert crawl_metrics.current() is None, "Expected the helpers to be no-ops without metrics"
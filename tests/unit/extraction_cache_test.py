@@ -0,0 +1,110 @@
+"""
+Tests the extraction cache: LRU memory tier, disk tier, shared stats and the caching extractor
+"""
+import os
+import shutil
+import tempfile
+from multiprocessing import Pool
+
+from kgai_crawler.scripts.commoncrawl_stream_extractor import StreamingCommonCrawlExtractor
+from kgai_crawler.service import extraction_cache
+from kgai_crawler.service.extraction_cache import CachingArticleExtractor, ExtractionCache
+from tests.unit.article_extractor_test import StaticExtractor
+from tests.unit.commoncrawl_stream_extractor_test import write_warc
+
+
+def _lookup(key):
+    cache = extraction_cache.current()
+    if cache.get(key) is None:
+        cache.put(key, key.upper())
+    return key
+
+
+class TestExtractionCache(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.root = tempfile.mkdtemp()
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.root)
+
+    def test_lru(self):
+        cache = ExtractionCache(max_entries=2)
+        cache.put("a", 1)
+        cache.put("b", 2)
+        assert cache.get("a") == 1, "Expected a memory hit"
+        cache.put("c", 3)
+        assert cache.get("b") is None, "Expected the least recently used entry to be evicted"
+        assert cache.get("a") == 1 and cache.get("c") == 3, "Expected the recently used entries to be kept"
+        stats = cache.stats()
+        assert (stats["memory_hits"], stats["misses"], stats["evictions"]) == (3, 1, 1), "Expected the counts"
+        assert stats["hit_rate"] == 0.75, "Expected the hit rate"
+
+    def test_disk_tier(self):
+        path = os.path.join(self.root, "cache.sqlite")
+        cache = ExtractionCache(max_entries=10, disk_path=path)
+        cache.put("a", {"title": "First"})
+        cache.close()
+
+        reopened = ExtractionCache(max_entries=10, disk_path=path)
+        assert reopened.get("a") == {"title": "First"}, "Expected the result from the disk tier"
+        assert reopened.get("a") == {"title": "First"}, "Expected the result promoted to memory"
+        stats = reopened.stats()
+        assert (stats["disk_hits"], stats["memory_hits"]) == (1, 1), "Expected a disk, then a memory hit"
+        reopened.close()
+
+    def test_batched_disk_commits(self):
+        path = os.path.join(self.root, "batched.sqlite")
+        cache = ExtractionCache(max_entries=10, disk_path=path, commit_every=2, commit_interval_secs=3600)
+        other_process = ExtractionCache(max_entries=10, disk_path=path)
+        cache.put("a", 1)
+        assert other_process.get("a") is None, "Expected the put to wait for its batch"
+        cache.put("b", 2)
+        assert other_process.get("a") == 1, "Expected the batch committed"
+        cache.put("c", 3)
+        cache.flush()
+        assert other_process.get("c") == 3, "Expected the pending put committed on flush"
+        cache.close()
+        other_process.close()
+
+    def test_key(self):
+        assert ExtractionCache.key("<html/>", "a") != ExtractionCache.key("<html/>", "b"), \
+            "Expected the namespaces to be separated"
+        assert ExtractionCache.key("<html/>") == ExtractionCache.key("<html/>"), "Expected a stable key"
+
+    def test_caching_extractor(self):
+        wrapped = StaticExtractor()
+        extractor = CachingArticleExtractor(wrapped, ExtractionCache())
+        first = extractor.extract_article("https://a.example.com/story", "<html>wire story</html>")
+        mirror = extractor.extract_article("https://b.example.com/story", "<html>wire story</html>")
+        assert wrapped.calls == 1, "Expected the repeated html not to be extracted again"
+        assert (first.url, mirror.url) == ("https://a.example.com/story", "https://b.example.com/story"), \
+            "Expected the url of the page the html was served from"
+
+    def test_stats_shared_with_workers(self):
+        cache = ExtractionCache()
+        with Pool(2, initializer=extraction_cache.install, initargs=(cache,)) as pool:
+            list(pool.map(_lookup, ["a", "b", "a", "b"] * 5, chunksize=1))
+        stats = cache.stats()
+        assert stats["memory_hits"] + stats["misses"] == 20, "Expected the lookups of all workers"
+        assert stats["misses"] <= 4, "Expected every worker to keep its memory tier across tasks"
+
+    def test_stream_extractor(self):
+        warc_path = os.path.join(self.root, "test.warc.gz")
+        write_warc(warc_path, [("https://www.bbc.co.uk/news/a", "Wire story"),
+                               ("https://mirror.example.com/a", "Wire story")])
+        cache = ExtractionCache()
+        extraction_cache.install(cache)
+        try:
+            articles = []
+            StreamingCommonCrawlExtractor().extract_from_commoncrawl(warc_path, articles.append)
+        finally:
+            extraction_cache.install(None)
+
+        assert [article.url for article in articles] == ["https://www.bbc.co.uk/news/a",
+                                                         "https://mirror.example.com/a"], "Expected both records"
+        assert articles[1].source_domain == "mirror.example.com", "Expected the domain of the mirror"
+        assert articles[0].maintext == articles[1].maintext, "Expected the same text"
+        assert (cache.stats()["misses"], cache.stats()["memory_hits"]) == (1, 1), "Expected the mirror from cache"
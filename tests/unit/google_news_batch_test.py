@@ -0,0 +1,87 @@
+"""
+Tests the multi topic batch of the google news connector
+"""
+from kgai_crawler.connector.google_news import GoogNews
+
+
+def article(url: str, title: str) -> dict:
+    return {"source": {"id": None, "name": "Example"}, "author": None, "title": title, "description": None,
+            "url": url, "urlToImage": None, "publishedAt": "2020-05-01T00:00:00Z", "content": None}
+
+
+class FakeNewsApi(object):
+    """
+    serves the articles whose title contains a word of the query
+    """
+
+    def __init__(self, articles):
+        self.articles = articles
+        self.queries = []
+
+    def get_everything(self, q, **kwargs):
+        self.queries.append(q)
+        words = set(q.lower().replace("(", " ").replace(")", " ").split()) - {"or"}
+        hits = [hit for hit in self.articles if words & set(hit["title"].lower().split())]
+        return {"status": "ok", "totalResults": len(hits), "articles": hits}
+
+
+class TestGoogleNewsBatch(object):
+
+    def test_merge_topics(self):
+        assert GoogNews.merge_topics(["corona", "climate change", "corona", " "]) == [["corona", "climate change"]], \
+            "Expected the distinct topics in a single query"
+        assert GoogNews.topics_query(["corona", "climate change"]) == "(corona) OR (climate change)", \
+            "Expected an OR query"
+        groups = GoogNews.merge_topics(["topic{}".format(i) for i in range(100)], max_query_chars=100)
+        assert len(groups) > 1 and all(len(GoogNews.topics_query(group)) <= 100 for group in groups), \
+            "Expected the queries to be bounded"
+
+    def test_iter_news_batch(self):
+        api = FakeNewsApi([article("https://example.com/1", "Corona and climate"),
+                           article("https://example.com/2", "Climate summit"),
+                           article("https://example.com/3", "Election results")])
+        client = GoogNews(api_key="test")
+        client._news_client = api
+        tagged = [(news.url, topics) for news, topics in client.iter_news_batch(["corona", "climate", "election"])]
+        assert len(api.queries) == 1, "Expected a single merged query"
+        assert tagged == [("https://example.com/1", ["corona", "climate"]), ("https://example.com/2", ["climate"]),
+                          ("https://example.com/3", ["election"])], "Expected every url once with its topics"
+
+    def test_iter_news_batch_tags_before_yielding(self):
+        api = FakeNewsApi([article("https://example.com/1", "Corona and climate"),
+                           article("https://example.com/2", "Climate summit")])
+        client = GoogNews(api_key="test")
+        client._news_client = api
+        client.merge_topics = lambda topics: [[topic] for topic in topics]
+        batch = client.iter_news_batch(["corona", "climate"])
+        first, first_topics = next(batch)
+        assert api.queries == ["corona", "climate"], "Expected every query to run before the first article"
+        assert first_topics == ["corona", "climate"], "Expected the topics complete when the article is yielded"
+        assert [news.url for news, _ in batch] == ["https://example.com/2"], "Expected every url once"
+
+    def test_single_query_streams(self):
+        api = FakeNewsApi([article("https://example.com/1", "Corona cases")])
+        client = GoogNews(api_key="test")
+        client._news_client = api
+
+        def iter_news(topic, scrape_month):
+            yield from GoogNews._map_articles(api.get_everything(topic))
+            raise AssertionError("Expected the first article before the query is exhausted")
+
+        client.iter_news = iter_news
+        batch = client.iter_news_batch(["corona"])
+        first, first_topics = next(batch)
+        assert first.url == "https://example.com/1" and first_topics == ["corona"], \
+            "Expected the article of a single query before the query is exhausted"
+
+    def test_topics_of_the_query_returning_the_article(self):
+        api = FakeNewsApi([article("https://example.com/1", "Pandemic"), article("https://example.com/2", "Summit")])
+        # newsapi matched the articles on text it does not return
+        api.get_everything = lambda q, **kwargs: {"status": "ok", "totalResults": 1,
+                                                  "articles": api.articles[:1] if "corona" in q else api.articles[1:]}
+        client = GoogNews(api_key="test")
+        client._news_client = api
+        client.merge_topics = lambda topics: [["corona", "covid"], ["climate"]]
+        tagged = [(news.url, topics) for news, topics in client.iter_news_batch(["corona", "covid", "climate"])]
+        assert tagged == [("https://example.com/1", ["corona", "covid"]), ("https://example.com/2", ["climate"])], \
+            "Expected the topics of the query that returned the article, not all the topics of the batch"
@@ -0,0 +1,111 @@
+"""
+Tests the conditional re-fetch of article pages against a local server
+"""
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from kgai_crawler.service.article_engine import ArticleEngine
+from kgai_crawler.service.article_extractor import ArticleExtractor
+from kgai_crawler.service.http_cache import ConditionalCache
+from kgai_crawler.service.http_transport import HttpTransport
+from tests.unit.article_extractor_test import StaticExtractor
+
+
+class ValidatingHandler(BaseHTTPRequestHandler):
+    """
+    /etag answers with an ETag and 304s, /static has no validators and always the same body
+    """
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        self.server.conditional.append(self.headers.get("If-None-Match"))
+        etag = '"v{}"'.format(self.server.version)
+        if self.path == "/etag" and self.headers.get("If-None-Match") == etag:
+            self.send_response(304)
+            self.send_header("ETag", etag)
+            self.end_headers()
+            return
+        body = "<html><body>version {}</body></html>".format(self.server.version).encode("utf-8")
+        self.send_response(200)
+        if self.path == "/etag":
+            self.send_header("ETag", etag)
+        self.send_header("Content-Type", "text/html")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+class FailingExtractor(ArticleExtractor):
+    name = "failing"
+
+    def extract(self, url, html):
+        raise ValueError("cannot parse")
+
+
+class TestHttpCache(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), ValidatingHandler)
+        cls.server.conditional = []
+        cls.server.version = 1
+        cls.base_url = "http://127.0.0.1:{}".format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def setup_method(self):
+        self.server.conditional.clear()
+        self.server.version = 1
+
+    def engine(self, cache: ConditionalCache, extractor: ArticleExtractor = None) -> ArticleEngine:
+        return ArticleEngine(extractor=extractor or StaticExtractor(), transport=HttpTransport(conditional_cache=cache))
+
+    def test_not_modified(self, tmp_path):
+        urls = [self.base_url + "/etag", self.base_url + "/static"]
+        cache = ConditionalCache(path=str(tmp_path / "http.db"))
+        articles = list(self.engine(cache).scrape(urls))
+        assert len(articles) == 2, "Expected both pages on the first sweep"
+        for article in articles:
+            # the articles are delivered
+            cache.commit(article.url)
+        cache.close()
+
+        cache = ConditionalCache(path=str(tmp_path / "http.db"))
+        engine = self.engine(cache)
+        assert list(engine.scrape(urls)) == [], "Expected the unchanged pages to be skipped on the next sweep"
+        assert self.server.conditional[-2:] == ['"v1"', None], "Expected a conditional request where possible"
+        stats = engine.transport.stats()
+        assert (stats["not_modified"], stats["unchanged"]) == (1, 1), "Expected a 304 and an unchanged digest"
+
+        self.server.version = 2
+        assert len(list(engine.scrape(urls))) == 2, "Expected changed pages to be parsed again"
+
+    def test_undelivered_article_is_fetched_again(self):
+        cache = ConditionalCache(path=":memory:")
+        urls = [self.base_url + "/etag"]
+        assert len(list(self.engine(cache).scrape(urls))) == 1, "Expected the page on the first sweep"
+        assert len(list(self.engine(cache).scrape(urls))) == 1, "Expected the page again without a delivery"
+        assert self.server.conditional == [None, None], "Expected no validators before the article is delivered"
+
+    def test_failed_parse_is_fetched_again(self):
+        cache = ConditionalCache(path=":memory:")
+        urls = [self.base_url + "/etag"]
+        assert list(self.engine(cache, FailingExtractor()).scrape(urls)) == [], "Expected the parse to fail"
+        assert len(list(self.engine(cache).scrape(urls))) == 1, "Expected the failed page to be downloaded again"
+        assert self.server.conditional == [None, None], "Expected no validators of the failed page"
+
+    def test_ttl(self):
+        cache = ConditionalCache(path=":memory:", ttl_days=0)
+        cache.stage("https://example.com/a", '"v1"', None, "digest")
+        cache.commit("https://example.com/a")
+        time.sleep(0.01)
+        assert cache.conditional_headers("https://example.com/a") == {}, "Expected expired validators to be ignored"
+        assert cache.evict_expired() == 1, "Expected expired validators to be evicted"
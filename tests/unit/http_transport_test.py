@@ -0,0 +1,89 @@
+"""
+Tests the shared http transport against a local keep-alive server
+"""
+import gzip
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from kgai_crawler.service.http_transport import HttpTransport, ResponseTooLarge, decode_html
+
+PAGE = "<html><head><title>Été</title></head><body>{}</body></html>".format("news " * 1000).encode("utf-8")
+
+
+class KeepAliveHandler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def do_GET(self):
+        body = PAGE
+        self.send_response(200 if self.path != "/missing" else 404)
+        self.send_header("Content-Type", "text/html; charset=utf-8")
+        if self.path == "/gzip" and "gzip" in self.headers.get("Accept-Encoding", ""):
+            body = gzip.compress(body)
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+        self.server.encoded.append(self.headers.get("Accept-Encoding"))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestHttpTransport(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.server = ThreadingHTTPServer(("127.0.0.1", 0), KeepAliveHandler)
+        cls.server.encoded = []
+        cls.base_url = "http://localhost:{}".format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+
+    def test_connection_reuse(self):
+        transport = HttpTransport()
+        for _ in range(5):
+            assert transport.download_html(self.base_url + "/page") == PAGE.decode("utf-8"), "Expected the page"
+        stats = transport.stats()
+        assert (stats["requests"], stats["connections"]) == (5, 1), "Expected a single keep-alive connection"
+        assert stats["reuse_ratio"] == 0.8, "Expected the reuse ratio"
+        assert stats["ttfb_p50_ms"] is not None and stats["bytes"] == 5 * len(PAGE), "Expected the ttfb and bytes"
+        transport.close()
+
+    def test_dns_cache(self):
+        transport = HttpTransport(pool_maxsize=1)
+        threads = [threading.Thread(target=transport.download_html, args=(self.base_url + "/page",))
+                   for _ in range(4)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        stats = transport.stats()
+        assert stats["dns_misses"] >= 1 and stats["dns_hits"] + stats["dns_misses"] == stats["connections"], \
+            "Expected every new connection to be resolved through the cache"
+        transport.close()
+
+    def test_gzip(self):
+        transport = HttpTransport()
+        assert transport.download_html(self.base_url + "/gzip") == PAGE.decode("utf-8"), "Expected the page inflated"
+        assert "gzip" in self.server.encoded[-1], "Expected compressed responses to be asked for"
+        assert transport.stats()["bytes"] == len(PAGE), "Expected the inflated size to be counted"
+
+    def test_limits(self):
+        transport = HttpTransport(max_response_bytes=1000)
+        with pytest.raises(ResponseTooLarge):
+            transport.download_html(self.base_url + "/page")
+        with pytest.raises(ResponseTooLarge):
+            transport.download_html(self.base_url + "/gzip")
+        assert transport.stats()["too_large"] == 2, "Expected the responses to be abandoned"
+        assert HttpTransport().download_html(self.base_url + "/missing") is None, "Expected no html of a 404"
+
+    def test_decode_html(self):
+        latin = "<html><head><meta charset=\"iso-8859-1\"></head><body>Été</body></html>".encode("iso-8859-1")
+        assert "Été" in decode_html(latin), "Expected the declared charset"
+        assert "Été" in decode_html(PAGE, "text/html; charset=\"utf-8\""), "Expected the charset of the header"
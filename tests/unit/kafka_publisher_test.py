@@ -0,0 +1,134 @@
+"""
+Tests the kafka publishing layer against an in-process fake broker
+"""
+from functools import partial
+
+import pytest
+
+from kgai_crawler.service.kafka_publisher import KafkaPublisher
+
+
+class FakeProducer(object):
+    """
+    Mimics the confluent-kafka producer: a bounded local queue, delivery reports served from poll/flush
+    the broker round trip only completes when poll is allowed to wait
+    """
+
+    def __init__(self, queue_max_messages: int, fail_keys=()):
+        self.queue_max_messages = queue_max_messages
+        self.fail_keys = set(fail_keys)
+        self.queued = []
+        self.broker = []
+
+    def produce(self, topic, key, value, on_delivery=None, headers=None):
+        if len(self.queued) >= self.queue_max_messages:
+            raise BufferError("Local: Queue full")
+        self.queued.append((topic, key, value, headers, on_delivery))
+
+    def poll(self, timeout=None):
+        delivered = 0
+        if not timeout:
+            return delivered
+        while self.queued:
+            topic, key, value, headers, on_delivery = self.queued.pop(0)
+            err = "broker down" if key in self.fail_keys else None
+            if not err:
+                self.broker.append((topic, key, value, headers))
+            on_delivery(err, None)
+            delivered += 1
+        return delivered
+
+    def flush(self, timeout=None):
+        self.poll(timeout or 1)
+        return len(self.queued)
+
+
+class PlainProducer(object):
+    """
+    Only has produce(topic, key, value), flush and the four argument constructor of the baseline TRAvroProducer,
+    the messages reach the broker on flush
+    """
+
+    def __init__(self, bootstrap_servers, schema_registry, namespace, data_class):
+        self.queued = []
+        self.broker = []
+        self.broker_down = False
+
+    def produce(self, topic, key, value):
+        if key == "bad":
+            raise ValueError("cannot serialize")
+        self.queued.append((topic, key, value))
+
+    def flush(self, timeout=None):
+        if not self.broker_down:
+            self.broker.extend(self.queued)
+            self.queued = []
+        return len(self.queued)
+
+
+class TestKafkaPublisher(object):
+
+    def test_blocks_on_full_queue_instead_of_dropping(self):
+        producer = FakeProducer(queue_max_messages=1)
+        publisher = KafkaPublisher(producer=producer, queue_full_backoff_secs=0.01)
+        for i in range(5):
+            publisher.publish(topic="news", key=str(i), value={"i": i})
+        publisher.close()
+
+        assert [key for _, key, _, _ in producer.broker] == ["0", "1", "2", "3", "4"], \
+            "Expected every message delivered in order"
+        assert publisher.stats()["acked"] == 5, "Expected all deliveries to be acked"
+
+    def test_counts_failed_deliveries(self):
+        producer = FakeProducer(queue_max_messages=10, fail_keys={"bad"})
+        publisher = KafkaPublisher(producer=producer)
+        publisher.publish(topic="news", key="good", value={}, headers=[("news_topics", b"corona")])
+        publisher.publish(topic="news", key="bad", value={})
+        publisher.close()
+
+        stats = publisher.stats()
+        assert (stats["acked"], stats["failed"], stats["pending"]) == (1, 1, 0), "Expected acks and failures counted"
+        assert producer.broker[0][3] == [("news_topics", b"corona")], "Expected headers to be passed through"
+
+    def test_on_delivered_only_after_the_ack(self):
+        producer = FakeProducer(queue_max_messages=10, fail_keys={"bad"})
+        publisher = KafkaPublisher(producer=producer)
+        delivered = []
+        publisher.publish(topic="news", key="good", value={}, on_delivered=lambda: delivered.append("good"))
+        publisher.publish(topic="news", key="bad", value={}, on_delivered=lambda: delivered.append("bad"),
+                          on_failed=lambda: delivered.append("failed"))
+        assert delivered == [], "Expected nothing delivered before the broker round trip"
+        publisher.close()
+        assert delivered == ["good", "failed"], "Expected the callbacks of the delivery reports"
+
+    def test_producer_without_delivery_reports(self):
+        producer = KafkaPublisher.build_producer(PlainProducer, KafkaPublisher.producer_config(),
+                                                 bootstrap_servers="kafka:9092", schema_registry="http://registry",
+                                                 namespace="news", data_class=dict)
+        publisher = KafkaPublisher(producer=producer)
+        assert not publisher.sends_headers, "Expected the producer not to send headers"
+        with pytest.raises(ValueError):
+            publisher.publish(topic="news", key="good", value={}, headers=[("news_topics", b"corona")])
+        delivered = []
+        publisher.publish(topic="news", key="good", value={}, on_delivered=lambda: delivered.append("good"))
+        publisher.publish(topic="news", key="bad", value={}, on_delivered=lambda: delivered.append("bad"))
+        assert delivered == [], "Expected no delivery before the flush"
+        publisher.close()
+
+        assert producer.broker == [("news", "good", {})], "Expected the message without headers produced once"
+        assert delivered == ["good"], "Expected a flushed message to count as delivered"
+        stats = publisher.stats()
+        assert (stats["acked"], stats["failed"], stats["pending"]) == (1, 1, 0), "Expected acks and failures counted"
+
+    def test_unflushed_messages_are_not_delivered(self):
+        producer = PlainProducer("kafka:9092", "http://registry", "news", dict)
+        producer.broker_down = True
+        publisher = KafkaPublisher(producer=producer, unreported_flush_every=2)
+        delivered, failed = [], []
+        for key in ("a", "b", "c"):
+            publisher.publish(topic="news", key=key, value={}, on_delivered=partial(delivered.append, key),
+                              on_failed=partial(failed.append, key))
+        assert (delivered, failed) == ([], ["a", "b"]), "Expected the messages of a failed flush not delivered"
+        producer.broker_down = False
+        publisher.close()
+        assert (delivered, failed) == (["c"], ["a", "b"]), "Expected the message of the last flush delivered"
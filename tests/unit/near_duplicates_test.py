@@ -0,0 +1,60 @@
+"""
+Tests the near-duplicate detection of articles
+"""
+import random
+
+from kgai_crawler.service.near_duplicates import CLUSTER, DUPLICATE_OF_HEADER, NearDuplicateIndex, minhash, \
+    shingle_hashes, similarity
+
+
+def make_article(seed, paragraphs=6):
+    rand = random.Random(seed)
+    vocabulary = ["word{}".format(i) for i in range(2000)]
+    return "\n\n".join(" ".join(rand.choice(vocabulary) for _ in range(60)) for _ in range(paragraphs))
+
+
+class TestNearDuplicates(object):
+
+    def test_similarity(self):
+        text = make_article(1)
+        signature = minhash(shingle_hashes(text))
+        assert similarity(signature, minhash(shingle_hashes(text + " Distributed by the wire."))) > 0.9, \
+            "Expected a syndicated copy to be similar"
+        assert similarity(signature, minhash(shingle_hashes(make_article(2)))) < 0.1, \
+            "Expected another story not to be similar"
+
+    def test_check(self):
+        index = NearDuplicateIndex()
+        text = make_article(1)
+        assert index.check("a", text) is None, "Expected the first article to be new"
+        assert index.check("b", make_article(2)) is None, "Expected another story to be new"
+        edited = text.replace("word1 ", "word0 ", 2) + " (c) Example Wire"
+        assert index.check("c", edited) == "a", "Expected the edited copy to be a near-duplicate of the first"
+        assert index.stats() == {"checked": 3, "duplicates": 1, "too_short": 0, "window_size": 2}, \
+            "Expected the near-duplicate not to be added to the window"
+
+    def test_short_texts(self):
+        index = NearDuplicateIndex()
+        assert index.check("a", "") is None and index.check("b", "") is None, "Expected empty texts to be skipped"
+        assert index.check("c", "breaking news") is None, "Expected teasers to be skipped"
+        assert index.stats()["too_short"] == 3, "Expected the short texts to be counted"
+
+    def test_window(self):
+        index = NearDuplicateIndex(window_secs=60, max_entries=2)
+        text = make_article(1)
+        index.check("a", text, seen_at=0)
+        assert index.check("b", text, seen_at=30) == "a", "Expected a duplicate within the window"
+        assert index.check("c", text, seen_at=61) is None, "Expected the first article to have expired"
+        index.check("d", make_article(2), seen_at=62)
+        index.check("e", make_article(3), seen_at=63)
+        assert index.stats()["window_size"] == 2, "Expected the window to be bounded"
+        assert index.check("f", text, seen_at=64) is None, "Expected the oldest article to be dropped"
+
+    def test_review(self):
+        suppress, cluster = NearDuplicateIndex(), NearDuplicateIndex(mode=CLUSTER)
+        text = make_article(1)
+        for index in (suppress, cluster):
+            assert index.review("a", text) == (True, None), "Expected the first article to be published"
+        assert suppress.review("b", text) == (False, None), "Expected the duplicate to be suppressed"
+        assert cluster.review("b", text) == (True, [(DUPLICATE_OF_HEADER, b"a")]), \
+            "Expected the duplicate to be published pointing to the first article"
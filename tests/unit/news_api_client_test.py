@@ -0,0 +1,130 @@
+"""
+Tests the quota aware newsapi transport against a local fake newsapi server
+"""
+import json
+import os
+import shutil
+import tempfile
+import threading
+from datetime import datetime
+from http.server import BaseHTTPRequestHandler, HTTPServer
+
+import pytest
+from newsapi import NewsApiClient
+from newsapi.newsapi_exception import NewsAPIException
+
+from kgai_crawler.connector import google_news
+from kgai_crawler.connector.google_news import GoogNews
+from kgai_crawler.connector.news_api_client import QuotaSession, TokenBucket
+
+
+class FakeNewsApiHandler(BaseHTTPRequestHandler):
+
+    def do_GET(self):
+        server = self.server
+        server.requests.append(self.path)
+        if server.failures:
+            status = server.failures.pop(0)
+            self.send_response(status)
+            self.send_header("Retry-After", "0")
+            self.end_headers()
+            self.wfile.write(json.dumps({"status": "error", "code": "rateLimited", "message": ""}).encode("utf-8"))
+            return
+        if self.path.startswith("/v2/sources"):
+            body = {"status": "ok", "sources": [{"id": "example", "name": "Example", "description": None,
+                                                 "url": "https://example.com", "category": None, "language": "en",
+                                                 "country": "us"}]}
+        else:
+            body = {"status": "ok", "totalResults": 1, "articles": []}
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.end_headers()
+        self.wfile.write(json.dumps(body).encode("utf-8"))
+
+    def log_message(self, *args):
+        pass
+
+
+class TestNewsApiClient(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.server = HTTPServer(("127.0.0.1", 0), FakeNewsApiHandler)
+        cls.server.requests = []
+        cls.server.failures = []
+        cls.base_url = "http://127.0.0.1:{}".format(cls.server.server_port)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        shutil.rmtree(cls.root)
+
+    def setup_method(self):
+        self.server.requests.clear()
+        self.server.failures.clear()
+
+    def client(self, **kwargs) -> NewsApiClient:
+        return NewsApiClient(api_key="test", session=QuotaSession(base_url=self.base_url, backoff_secs=0, **kwargs))
+
+    def test_cache(self):
+        client = self.client()
+        client.get_everything(q="corona", page_size=100, page=1)
+        client.get_everything(page=1, page_size=100, q=" corona ")
+        assert len(self.server.requests) == 1, "Expected the same query to be served from cache"
+        client.get_everything(q="corona", page_size=100, page=2)
+        assert len(self.server.requests) == 2, "Expected another page to be requested"
+        assert client.request_method.stats["cache_hits"] == 1, "Expected the cache hit to be counted"
+
+    def test_disk_cache(self):
+        path = os.path.join(self.root, "newsapi.sqlite")
+        session = QuotaSession(base_url=self.base_url, cache_path=path)
+        sources = GoogNews(api_key="test", session=session).get_news_sources()
+        session.close()
+        reopened = GoogNews(api_key="test", session=QuotaSession(base_url=self.base_url, cache_path=path))
+        assert reopened.get_news_sources() == sources and len(sources) == 1, "Expected the sources of the last run"
+        assert len(self.server.requests) == 1, "Expected the sources to be requested once over both runs"
+
+    def test_repeated_iter_news_is_cached(self, monkeypatch):
+        runs = iter([datetime(2020, 5, 1, 10, 5, 12), datetime(2020, 5, 1, 10, 40, 3)])
+
+        class RunClock(datetime):
+            @classmethod
+            def utcnow(cls):
+                return next(runs)
+
+        monkeypatch.setattr(google_news, "datetime", RunClock)
+        client = GoogNews(api_key="test", session=QuotaSession(base_url=self.base_url))
+        assert client.get_news(topic="corona") == [], "Expected no news"
+        assert client.get_news(topic="corona") == [], "Expected no news"
+        assert len(self.server.requests) == 1, "Expected the windows of the second run to be served from cache"
+
+    def test_retry(self):
+        self.server.failures.extend([429, 503])
+        client = self.client()
+        assert client.get_everything(q="corona")["status"] == "ok", "Expected the call to succeed after retries"
+        assert client.request_method.stats["retries"] == 2, "Expected a retry per failure"
+
+        self.server.failures.extend([429] * 4)
+        with pytest.raises(NewsAPIException):
+            client.get_everything(q="ebola")
+        assert len(self.server.requests) == 3 + 4, "Expected the retries to be bounded"
+
+    def test_quota(self):
+        client = self.client(requests_per_day=100, burst=2, max_wait_secs=0)
+        client.get_everything(q="a")
+        client.get_everything(q="b")
+        with pytest.raises(NewsAPIException):
+            client.get_everything(q="c")
+        assert len(self.server.requests) == 2, "Expected the call beyond the burst not to be made"
+        client.get_everything(q="a")
+        assert client.request_method.stats["cache_hits"] == 1, "Expected cached queries to cost no quota"
+
+    def test_token_bucket(self):
+        bucket = TokenBucket(rate_per_sec=1, capacity=2, updated_at=0)
+        assert [bucket.reserve(now=0), bucket.reserve(now=0)] == [0, 0], "Expected the burst without waiting"
+        assert bucket.reserve(now=0.5) == 0.5, "Expected to wait for the refill"
+        assert bucket.reserve(max_wait_secs=0.5, now=0.5) is None, "Expected no token beyond the max wait"
+        assert bucket.reserve(now=3) == 0, "Expected the bucket to refill"
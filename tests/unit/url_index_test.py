@@ -0,0 +1,33 @@
+"""
+Tests the persistent seen url index and the url normalization it relies on
+"""
+import time
+
+from kgai_crawler.service.url_index import SeenUrlIndex
+from kgai_crawler.utils.url_utils import canonical_url
+
+
+class TestUrlIndex(object):
+
+    def test_canonical_url(self):
+        assert canonical_url("http://WWW.Example.com:80/news/story/?utm_source=x&b=2&a=1#top") == \
+            canonical_url("https://example.com/news/story?a=1&b=2"), "Expected equivalent urls to be normalized"
+        assert canonical_url("https://example.com/a") != canonical_url("https://example.com/b"), \
+            "Expected different articles to stay different"
+
+    def test_seen_urls_persist(self, tmp_path):
+        path = str(tmp_path / "seen.db")
+        index = SeenUrlIndex(path=path)
+        index.mark_seen(["https://example.com/story?utm_medium=rss"])
+        index.close()
+
+        index = SeenUrlIndex(path=path)
+        assert index.is_seen("http://www.example.com/story"), "Expected url to be seen across runs"
+        assert not index.is_seen("https://example.com/other"), "Expected unknown url to be unseen"
+
+    def test_ttl_eviction(self, tmp_path):
+        index = SeenUrlIndex(path=str(tmp_path / "seen.db"), ttl_days=1 / (24 * 3600))
+        index.mark_seen(["https://example.com/story"])
+        time.sleep(1.1)
+        assert not index.is_seen("https://example.com/story"), "Expected expired url to be fetched again"
+        assert index.evict_expired() == 1, "Expected expired url to be evicted"
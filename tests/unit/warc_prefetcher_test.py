@@ -0,0 +1,56 @@
+"""
+Tests the WARC prefetch queue against a local stand-in file server
+"""
+import functools
+import http.server
+import os
+import shutil
+import tempfile
+import threading
+
+from kgai_crawler.scripts.warc_prefetcher import WarcPrefetcher
+
+
+class TestWarcPrefetcher(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.root = tempfile.mkdtemp()
+        for i in range(5):
+            with open(os.path.join(cls.root, "{}.warc.gz".format(i)), "wb") as warc_file:
+                warc_file.write(b"x" * 1000)
+        handler = functools.partial(http.server.SimpleHTTPRequestHandler, directory=cls.root)
+        cls.server = http.server.HTTPServer(("127.0.0.1", 0), handler)
+        threading.Thread(target=cls.server.serve_forever, daemon=True).start()
+        cls.urls = ["http://127.0.0.1:{}/{}.warc.gz".format(cls.server.server_port, i) for i in range(5)]
+
+    @classmethod
+    def teardown_class(cls):
+        cls.server.shutdown()
+        shutil.rmtree(cls.root)
+
+    def test_prefetch_bounded_and_released(self):
+        download_dir = tempfile.mkdtemp()
+        try:
+            prefetcher = WarcPrefetcher(download_dir, prefetch_count=1, disk_budget_bytes=2500,
+                                        reuse_previously_downloaded_files=False)
+            extracted = []
+            for url, local_path in prefetcher.iter_downloaded(self.urls + [self.urls[0] + ".missing"]):
+                assert os.path.getsize(local_path) == 1000, "Expected the complete WARC on disk"
+                on_disk = [name for name in os.listdir(download_dir) if name.endswith(".warc.gz")]
+                assert len(on_disk) <= 2, "Expected at most the extracted and one prefetched WARC on disk"
+                extracted.append(url)
+                prefetcher.release(local_path)
+
+            assert extracted == self.urls, "Expected all WARCs in order, failed downloads skipped"
+            assert not os.listdir(download_dir), "Expected the released WARCs to be deleted"
+        finally:
+            shutil.rmtree(download_dir)
+
+    def test_local_files_not_deleted(self):
+        prefetcher = WarcPrefetcher(tempfile.gettempdir())
+        local_url = "file://" + os.path.join(self.root, "0.warc.gz")
+        for _, local_path in prefetcher.iter_downloaded([local_url]):
+            prefetcher.release(local_path)
+
+        assert os.path.isfile(os.path.join(self.root, "0.warc.gz")), "Expected a local mirror to be left alone"
@@ -0,0 +1,59 @@
+"""
+Tests the WARC header prefilters
+"""
+import datetime
+
+from warcio.statusandheaders import StatusAndHeaders
+
+from kgai_crawler.scripts.warc_prefilter import HostSuffixMatcher, WarcPrefilter
+
+
+class FakeRecord(object):
+
+    def __init__(self, url: str, warc_date: str = "2020-05-10T10:00:00Z", content_type: str = "text/html"):
+        self.rec_headers = StatusAndHeaders("WARC/1.0", [("WARC-Target-URI", url), ("WARC-Date", warc_date)])
+        self.http_headers = StatusAndHeaders("200 OK", [("Content-Type", content_type)], protocol="HTTP/1.1")
+
+
+class TestWarcPrefilter(object):
+
+    def test_host_suffix_matcher(self):
+        matcher = HostSuffixMatcher(["bbc.co.uk"])
+        assert matcher.matches("www.bbc.co.uk"), "Expected sub domain to match"
+        assert matcher.matches("bbc.co.uk"), "Expected host itself to match"
+        assert not matcher.matches("notbbc.co.uk"), "Expected lookalike host not to match"
+        assert not matcher.matches("co.uk"), "Expected parent domain not to match"
+
+    def test_counts_rejects_per_filter(self):
+        prefilter = WarcPrefilter(valid_hosts=["bbc.co.uk"], start_date=datetime.datetime(2020, 5, 1))
+        records = [FakeRecord("https://www.bbc.co.uk/news/1"),
+                   FakeRecord("https://g.co/?forward_url=bbc.co.uk"),
+                   FakeRecord("https://www.bbc.co.uk/news/2", warc_date="2020-04-30T23:00:00Z"),
+                   FakeRecord("https://www.bbc.co.uk/logo.png", content_type="image/png")]
+
+        assert [prefilter.accept(record) for record in records] == [True, False, False, False]
+        assert prefilter.counters == {"passed": 1, "rejected_host": 1, "rejected_date": 1,
+                                      "rejected_content_type": 1}, "Expected one reject per filter"
+
+    def test_crawl_date_in_utc(self):
+        prefilter = WarcPrefilter(start_date=datetime.datetime(2020, 5, 1, 2, tzinfo=datetime.timezone(
+            datetime.timedelta(hours=2))))
+        records = [FakeRecord("https://www.bbc.co.uk/news/1", warc_date="2020-04-30T23:30:00Z"),
+                   FakeRecord("https://www.bbc.co.uk/news/2", warc_date="2020-05-01T01:30:00+02:00"),
+                   FakeRecord("https://www.bbc.co.uk/news/3", warc_date="2020-05-01T00:30:00"),
+                   FakeRecord("https://www.bbc.co.uk/news/4", warc_date="2020-04-30T23:30:00-02:00")]
+
+        assert [prefilter.accept(record) for record in records] == [False, False, True, True], \
+            "Expected naive dates taken as UTC and offsets converted to UTC"
+
+    def test_no_date_reject_without_strict_date(self):
+        records = [FakeRecord("https://www.bbc.co.uk/news/1", warc_date="2020-04-30T23:00:00Z"),
+                   FakeRecord("https://www.bbc.co.uk/news/2", warc_date=""),
+                   FakeRecord("https://www.bbc.co.uk/news/3", warc_date="not a date")]
+
+        strict = WarcPrefilter(start_date=datetime.datetime(2020, 5, 1))
+        assert [strict.accept(record) for record in records] == [False, True, True], \
+            "Expected only the dated record crawled before the start date rejected"
+        lenient = WarcPrefilter(start_date=datetime.datetime(2020, 5, 1), strict_date=False)
+        assert [lenient.accept(record) for record in records] == [True, True, True], \
+            "Expected no date reject when articles without a publishing date are kept"
@@ -0,0 +1,62 @@
+"""
+Tests splitting a WARC into record ranges and extracting the ranges in parallel
+"""
+import os
+import shutil
+import tempfile
+
+from kgai_crawler.scripts.commoncrawl_stream_extractor import StreamingCommonCrawlExtractor
+from kgai_crawler.scripts.warc_prefilter import WarcPrefilter
+from kgai_crawler.scripts.warc_record_index import build_record_index, split_record_ranges
+from tests.unit.commoncrawl_stream_extractor_test import write_warc
+
+
+class InProcessPool(object):
+    """
+    stands in for a multiprocessing pool, so the extracted articles can be collected
+    """
+
+    @staticmethod
+    def imap_unordered(fn, items):
+        return map(fn, items)
+
+
+class TestWarcRecordIndex(object):
+
+    @classmethod
+    def setup_class(cls):
+        cls.root = tempfile.mkdtemp()
+        cls.warc_path = os.path.join(cls.root, "test.warc.gz")
+        write_warc(cls.warc_path, [("https://www.bbc.co.uk/news/{}".format(i), "Story {}".format(i))
+                                   for i in range(7)] + [("https://example.com/b", "Other story")])
+
+    @classmethod
+    def teardown_class(cls):
+        shutil.rmtree(cls.root)
+
+    def test_index_and_ranges(self):
+        with open(self.warc_path, "rb") as stream:
+            index = build_record_index(stream, WarcPrefilter(valid_hosts=["bbc.co.uk"]))
+
+        assert len(index) == 8, "Expected every response record indexed"
+        assert sum(passes for _, _, passes in index) == 7, "Expected the prefilter applied"
+        ranges = split_record_ranges(index, records_per_range=3)
+        assert len(ranges) == 3, "Expected ranges of 3 passing records and a remainder"
+        assert ranges[0][0] == index[0][0], "Expected the first range to start at the first record"
+        assert sum(length for _, length in ranges) == sum(length for _, length, _ in index), \
+            "Expected the ranges to cover all records"
+
+    def test_parallel_matches_streaming(self):
+        streamed, split = [], []
+        completed = []
+        StreamingCommonCrawlExtractor().extract_from_commoncrawl(
+            self.warc_path, streamed.append, valid_hosts=["bbc.co.uk"],
+            callback_on_warc_completed=lambda *counters: completed.append(counters))
+        StreamingCommonCrawlExtractor().extract_from_commoncrawl(
+            self.warc_path, split.append, valid_hosts=["bbc.co.uk"], local_warc_path=self.warc_path,
+            record_pool=InProcessPool(), records_per_range=2,
+            callback_on_warc_completed=lambda *counters: completed.append(counters))
+
+        assert sorted(a.title for a in split) == sorted(a.title for a in streamed), "Expected the same articles"
+        assert len(split) == 7, "Expected all the valid articles"
+        assert completed[0] == completed[1], "Expected one completion with the counters of the whole WARC"
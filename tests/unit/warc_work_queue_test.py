@@ -0,0 +1,79 @@
+"""
+Tests the WARC work queue shared by crawler nodes
+"""
+import os
+import pickle
+import shutil
+import tempfile
+import time
+
+from kgai_crawler.scripts.warc_work_queue import WarcWorkQueue
+
+WARCS = ["warc-{}".format(i) for i in range(4)]
+
+
+class TestWarcWorkQueue(object):
+
+    def setup_method(self):
+        self.directory = tempfile.mkdtemp()
+        self.path = os.path.join(self.directory, "queue.sqlite")
+
+    def teardown_method(self):
+        shutil.rmtree(self.directory)
+
+    def test_nodes_claim_disjoint_warcs(self):
+        node_a = WarcWorkQueue(self.path, worker_id="a")
+        node_b = WarcWorkQueue(self.path, worker_id="b")
+        assert node_a.enqueue(WARCS) == 4, "Expected all WARCs added"
+        assert node_b.enqueue(WARCS) == 0, "Expected enqueueing the same manifest again to be a no-op"
+
+        claims_a = [node_a.claim(), node_a.claim()]
+        claims_b = [node_b.claim(), node_b.claim()]
+        assert sorted(claims_a + claims_b) == WARCS, "Expected every WARC claimed exactly once"
+        assert node_a.claim() is None, "Expected nothing left to claim"
+
+        for warc_url in claims_a:
+            node_a.complete(warc_url)
+        node_b.release(claims_b[0])
+        assert node_a.counts() == {"done": 2, "leased": 1, "queued": 1}, "Expected the states of all nodes"
+        assert node_a.claim() == claims_b[0], "Expected a released WARC to be claimed again"
+
+    def test_expired_lease_is_claimed_again(self):
+        crashed = WarcWorkQueue(self.path, worker_id="crashed", lease_secs=0.05)
+        crashed.enqueue(WARCS[:1])
+        assert crashed.claim() == WARCS[0], "Expected the claim"
+        survivor = WarcWorkQueue(self.path, worker_id="survivor")
+        assert survivor.claim() is None, "Expected a valid lease to be respected"
+        time.sleep(0.1)
+
+        assert survivor.claim() == WARCS[0], "Expected the expired lease to be claimed again"
+        assert not crashed.renew(WARCS[0]), "Expected the old owner to have lost the lease"
+
+    def test_iter_claims_bounds_the_leases(self):
+        queue = WarcWorkQueue(self.path, poll_secs=0.01)
+        queue.enqueue(WARCS)
+        # completions come from pool workers, with their own copy of the queue
+        worker_copy = pickle.loads(pickle.dumps(queue))
+        claimed = []
+        for warc_url in queue.iter_claims(max_held=2):
+            claimed.append(warc_url)
+            held = queue.counts().get("leased", 0)
+            assert held <= 2, "Expected at most max_held leases"
+            worker_copy.complete(warc_url)
+
+        assert claimed == WARCS, "Expected all WARCs claimed"
+        assert queue.counts() == {"done": 4}, "Expected all WARCs done"
+
+    def test_leases_renewed_after_the_last_claim(self):
+        queue = WarcWorkQueue(self.path, worker_id="a", lease_secs=0.3, poll_secs=0.01)
+        queue.enqueue(WARCS[:2])
+        claims = queue.iter_claims(max_held=2, wait_for_peers=False)
+        first, second = next(claims), next(claims)
+        queue.complete(first)
+        assert list(claims) == [], "Expected the iterator to be exhausted"
+        time.sleep(0.6)
+
+        peer = WarcWorkQueue(self.path, worker_id="b")
+        assert peer.claim() is None, "Expected the lease of the WARC still extracted to be renewed"
+        queue.complete(second)
+        assert queue.counts() == {"done": 2}, "Expected both WARCs done"
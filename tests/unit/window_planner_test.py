@@ -0,0 +1,91 @@
+"""
+Tests the query planner of the google news connector against a fake newsapi capping the results of a query
+"""
+from datetime import datetime, timedelta
+from functools import partial
+
+from kgai_crawler.connector.google_news import DATE_FORMAT, GoogNews
+from kgai_crawler.service.window_planner import WindowPlanner
+
+START = datetime(2020, 5, 1)
+
+
+class FakeNewsApi(object):
+    """
+    one article every `every` from START, at most max_results hits per query over all pages
+    """
+
+    def __init__(self, articles: int, every: timedelta, max_results: int = 100):
+        self.published = [START + every * i for i in range(articles)]
+        self.max_results = max_results
+        self.calls = []
+
+    def get_everything(self, q, language, from_param, to, sort_by, page_size, page):
+        self.calls.append((from_param, to, page))
+        from_date, to_date = datetime.strptime(from_param, DATE_FORMAT), datetime.strptime(to, DATE_FORMAT)
+        hits = [published for published in self.published if from_date <= published <= to_date]
+        start = (page - 1) * page_size
+        page_hits = hits[start:min(start + page_size, self.max_results)]
+        return {"status": "ok", "totalResults": len(hits),
+                "articles": [{"source": {"id": None, "name": "Example"}, "author": None, "title": q,
+                              "description": None, "url": "https://example.com/{}".format(published.isoformat()),
+                              "urlToImage": None, "publishedAt": published.isoformat(), "content": None}
+                             for published in page_hits]}
+
+
+def goog_news(api: FakeNewsApi, **kwargs) -> GoogNews:
+    client = GoogNews(api_key="test", **kwargs)
+    client._news_client = api
+    return client
+
+
+def fetch_all(client: GoogNews, windows):
+    planner = WindowPlanner(fetch=partial(client._get_news_window, "news"),
+                            max_results=client.max_results_per_query, page_size=client.page_size,
+                            min_window=client.min_window, max_calls=client.max_calls,
+                            max_workers=client.query_workers)
+    urls = {article.url for articles in planner.run(windows) for article in articles}
+    return urls, planner.stats
+
+
+class TestWindowPlanner(object):
+
+    def test_split_saturated_window(self):
+        # 480 articles over a day, 5 queries of 100 cannot cover less than 5 windows
+        api = FakeNewsApi(articles=480, every=timedelta(minutes=3))
+        urls, stats = fetch_all(goog_news(api), [(START, START + timedelta(days=1))])
+        assert len(urls) == 480, "Expected every article of the saturated day"
+        assert stats["split_windows"] >= 1 and "truncated_windows" not in stats, "Expected the day to be split"
+        assert stats["calls"] == len(api.calls) <= 12, "Expected the split to follow the hits of the window"
+
+    def test_split_on_the_grid(self):
+        planner = WindowPlanner(fetch=None, min_window=timedelta(hours=1))
+        parts = planner.split((START + timedelta(minutes=30), START + timedelta(days=1)), total=700)
+        assert all(part[0].minute == 0 for part in parts[1:]), "Expected the split points on the hour"
+        assert parts[0][0] == START + timedelta(minutes=30) and parts[-1][1] == START + timedelta(days=1) and \
+            all(parts[i][1] == parts[i + 1][0] for i in range(len(parts) - 1)), "Expected the window covered"
+
+    def test_pagination(self):
+        api = FakeNewsApi(articles=250, every=timedelta(minutes=5), max_results=1000)
+        urls, stats = fetch_all(goog_news(api, max_results_per_query=1000), [(START, START + timedelta(days=1))])
+        assert len(urls) == 250, "Expected every article"
+        assert sorted(call[2] for call in api.calls) == [1, 2, 3], "Expected the window to be paged through"
+
+    def test_min_window(self):
+        # 300 articles within the same hour cannot be split
+        api = FakeNewsApi(articles=300, every=timedelta(seconds=10))
+        urls, stats = fetch_all(goog_news(api), [(START, START + timedelta(hours=1))])
+        assert len(urls) == 100 and stats["truncated_windows"] == 1, "Expected the hour to be truncated"
+
+    def test_budget(self):
+        api = FakeNewsApi(articles=2000, every=timedelta(minutes=1))
+        urls, stats = fetch_all(goog_news(api, max_calls=5), [(START, START + timedelta(days=2))])
+        assert len(api.calls) == 5 and stats["skipped_calls"] > 0, "Expected the calls to stop at the budget"
+
+    def test_iter_news(self):
+        api = FakeNewsApi(articles=0, every=timedelta(minutes=1))
+        client = goog_news(api)
+        assert client.get_news(topic="news", scrape_month=True) == [], "Expected no news"
+        from_param, to, _ = api.calls[0]
+        assert datetime.strptime(to, DATE_FORMAT) - datetime.strptime(from_param, DATE_FORMAT) == \
+            timedelta(days=30), "Expected the month as a single window, not inverted"